@@ -0,0 +1,622 @@
+"""Offline load test for the backend.
+
+Starts the FastAPI app in-process on a local port with stand-ins for every
+external service, so it runs on a laptop with no network or credentials:
+
+- Gemini: stub SDK adapter with configurable latency, slow-tail and error
+  rates that returns valid JSON for every prompt type. It runs behind the
+  real GeminiGateway, so concurrency limits behave as in production.
+- Firestore: the in-memory repo (InMemoryDB).
+- GCS: in-process fake bucket with configurable latency.
+- TTS: fake synthesis with configurable latency; audio still goes through
+  the real upload path into the fake bucket.
+
+It then drives N glasses clients on /ws/ios/{user_id} and M query clients
+on /ws/query/{user_id}, and reports throughput, ack latency and
+p50/p95/p99 query latency.
+
+    python loadtest.py --ios-clients 20 --query-clients 5 --duration 30
+    python loadtest.py --gemini-latency-ms 1500 --gemini-error-rate 0.05 --json
+
+Pass --max-query-p95-ms / --max-ack-p95-ms / --max-error-rate to exit
+non-zero on a regression.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import types
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# No real Firestore/TTS clients even if credentials happen to be present
+os.environ.setdefault("GCP_PROJECT_ID", "loadtest")
+
+import main  # noqa: E402
+
+try:
+    import uvicorn  # type: ignore
+except Exception:  # pragma: no cover
+    uvicorn = None  # type: ignore
+
+try:
+    import websockets  # type: ignore
+except Exception:  # pragma: no cover
+    websockets = None  # type: ignore
+
+
+TRANSCRIPTS = [
+    "Bob said the coffee here is the best in town.",
+    "I'm taking my blood pressure pills with breakfast.",
+    "Alice is showing me the photos from her trip to Lisbon.",
+    "We walked to the park and fed the ducks.",
+    "The doctor wants me back in two weeks for a checkup.",
+    "Let's make pasta tonight, I bought tomatoes and basil.",
+    "Mary called to say she'll visit on Sunday afternoon.",
+    "I left my keys on the kitchen counter next to the fruit bowl.",
+]
+
+QUESTIONS = [
+    "What was I just doing?",
+    "Did I take my medication today?",
+    "Who did I talk to this morning?",
+    "Where did I leave my keys?",
+    "What did the doctor say?",
+    "When is Mary visiting?",
+    "What did I do yesterday?",
+    "Who is Bob?",
+]
+
+
+# =============================================================================
+# FAKE BACKENDS
+# =============================================================================
+
+class LatencyModel:
+    """Uniform base latency with an optional slow tail, in seconds."""
+
+    def __init__(self, mean_ms: float, jitter_ms: float = 0.0,
+                 tail_rate: float = 0.0, tail_ms: float = 0.0,
+                 rng: Optional[random.Random] = None) -> None:
+        self.mean = mean_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.tail_rate = tail_rate
+        self.tail = tail_ms / 1000.0
+        self.rng = rng or random.Random()
+
+    def sample(self) -> float:
+        delay = self.mean + self.rng.uniform(-self.jitter, self.jitter)
+        if self.tail_rate and self.rng.random() < self.tail_rate:
+            delay += self.tail
+        return max(0.0, delay)
+
+
+class InjectedQuotaError(Exception):
+    """Carries the HTTP status like google.api_core errors, so the gateway
+    treats it as a rate limit."""
+
+    code = 429
+
+
+class FakeGemini:
+    """Stand-in for the google.generativeai SDK, installed as the gateway's
+    adapter. Calls run on the gateway executor like the real SDK."""
+
+    _CAPTURE_ID_RE = re.compile(r'"captureId":\s*"([^"]+)"')
+    _ID_RE = re.compile(r'"id":\s*"([^"]+)"')
+
+    def __init__(self, latency: LatencyModel, error_rate: float, seed: int) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    def install(self, gateway: Any) -> None:
+        gateway._ensure_ready = lambda: None
+        gateway._adapter = "loadtest"
+        gateway._call_sync = self.call
+        gateway._stream_sync = self.stream
+
+    @staticmethod
+    def kind(prompt: str) -> str:
+        if '"analyses"' in prompt:
+            return "capture_batch"
+        if "You are analyzing a memory capture" in prompt:
+            return "capture"
+        if "Determine what data is needed" in prompt:
+            return "router"
+        if "running summary of the current hour" in prompt:
+            return "hourly_partial"
+        if "hourly summary" in prompt:
+            return "hourly"
+        if "daily summary" in prompt:
+            return "daily"
+        if "setting up a user profile" in prompt:
+            return "user_init"
+        return "answer"
+
+    def _capture_analysis(self, capture_id: Optional[str] = None) -> Dict[str, Any]:
+        name = self.rng.choice(["Bob", "Alice", "Mary"])
+        out = {
+            "imageSummary": "A kitchen table with a coffee cup",
+            "themes": [self.rng.choice(["coffee", "family", "health", "walk"])],
+            "mood": "relaxed",
+            "location": self.rng.choice(["home", "cafe", "park"]),
+            "detectedFaces": [],
+            "mentionedNames": [name],
+            "keyMoment": f"Talking with {name}",
+        }
+        if capture_id:
+            out["captureId"] = capture_id
+        return out
+
+    def respond(self, kind: str, prompt: str) -> Dict[str, Any]:
+        if kind == "capture":
+            return self._capture_analysis()
+        if kind == "capture_batch":
+            return {"analyses": [self._capture_analysis(cid)
+                                 for cid in self._CAPTURE_ID_RE.findall(prompt)]}
+        if kind == "router":
+            today = datetime.now(main.EST).date().isoformat()
+            return {
+                "queryType": "general",
+                "needsFaceImages": False,
+                "relevantContacts": ["Bob"],
+                "dataNeeded": {"captures": True, "hourlySummaries": True,
+                               "dailySummaries": True, "specificDates": [today]},
+                "needsMoreQueryContext": 0,
+                "needsClarification": False,
+                "clarificationQuestion": None,
+            }
+        if kind in ("hourly", "hourly_partial"):
+            return {"summary": "A calm hour at home with coffee and a call from Mary.",
+                    "themes": ["home"], "events": [], "peoplePresent": ["Mary"],
+                    "locations": ["home"], "highlight": "Call from Mary",
+                    "mood": "calm", "activities": ["coffee"]}
+        if kind == "daily":
+            return {"summary": "A quiet day.", "timeline": [], "themes": ["home"],
+                    "highlights": [], "mood": "calm", "peopleInteractions": [],
+                    "locations": ["home"], "accomplishments": [],
+                    "morningOverview": "", "afternoonOverview": "", "eveningOverview": ""}
+        if kind == "user_init":
+            return {"name": "Load Test", "occupation": "", "familyMembers": [],
+                    "dailyRoutines": "", "medicalNotes": "", "preferences": {},
+                    "initialContacts": [{"name": "Bob", "relationship": "friend", "notes": ""}]}
+        ids = self._ID_RE.findall(prompt)[:2]
+        return {"answer": "You were having coffee with Bob at home. Then Mary called about Sunday.",
+                "confidence": 0.8, "sourceCaptureIds": ids, "suggestedFollowUp": None}
+
+    def _simulate(self, prompt: str) -> Tuple[str, str]:
+        kind = self.kind(prompt)
+        with self._lock:
+            delay = self.latency.sample()
+            fail = self.rng.random() < self.error_rate
+            self.calls[kind] += 1
+            if fail:
+                self.errors[kind] += 1
+        time.sleep(delay)
+        if fail:
+            raise InjectedQuotaError(f"Resource exhausted (injected, {kind})")
+        return kind, json.dumps(self.respond(kind, prompt))
+
+    def call(self, prompt: str, images: List[str]) -> str:
+        return self._simulate(prompt)[1]
+
+    def stream(self, prompt: str, images: List[str], emit: Callable[[str], None]) -> None:
+        _, text = self._simulate(prompt)
+        step = max(1, len(text) // 6)
+        for i in range(0, len(text), step):
+            emit(text[i:i + step])
+
+
+class _FakeBlobWriter:
+    def __init__(self, blob: "_FakeBlob") -> None:
+        self.blob = blob
+        self.buf = io.BytesIO()
+
+    def write(self, data: bytes) -> int:
+        return self.buf.write(data)
+
+    def close(self) -> None:
+        self.blob._store(self.buf.getvalue())
+
+
+class _FakeBlob:
+    def __init__(self, storage: "FakeStorage", bucket: str, name: str) -> None:
+        self._storage = storage
+        self.key = (bucket, name)
+        self.name = name
+        self.generation: Optional[int] = None
+        self.cache_control: Optional[str] = None
+
+    def _store(self, data: bytes) -> None:
+        self._storage.sleep()
+        with self._storage.lock:
+            self._storage.generation += 1
+            self._storage.objects[self.key] = (data, self._storage.generation)
+
+    def upload_from_string(self, data: bytes, content_type: Optional[str] = None,
+                           timeout: Optional[float] = None) -> None:
+        self._store(data if isinstance(data, bytes) else data.encode("utf-8"))
+
+    def open(self, mode: str, **kwargs: Any) -> _FakeBlobWriter:
+        return _FakeBlobWriter(self)
+
+    def _get(self) -> Tuple[bytes, int]:
+        self._storage.sleep()
+        with self._storage.lock:
+            found = self._storage.objects.get(self.key)
+        if found is None:
+            raise main.GcsNotFound(self.name)
+        return found
+
+    def download_as_bytes(self, timeout: Optional[float] = None) -> bytes:
+        data, self.generation = self._get()
+        return data
+
+    def reload(self, timeout: Optional[float] = None) -> None:
+        _, self.generation = self._get()
+
+    def exists(self, timeout: Optional[float] = None) -> bool:
+        self._storage.sleep()
+        with self._storage.lock:
+            return self.key in self._storage.objects
+
+    def generate_signed_url(self, **kwargs: Any) -> str:
+        return f"https://storage.googleapis.com/{self.key[0]}/{self.name}?X-Goog-Signature=loadtest"
+
+
+class FakeStorage:
+    """In-process stand-in for google.cloud.storage."""
+
+    def __init__(self, latency: LatencyModel) -> None:
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.objects: Dict[Tuple[str, str], Tuple[bytes, int]] = {}
+        self.generation = 0
+        storage = self
+
+        class _Bucket:
+            def __init__(self, name: str) -> None:
+                self.name = name
+
+            def blob(self, name: str) -> _FakeBlob:
+                return _FakeBlob(storage, self.name, name)
+
+        class _Client:
+            def __init__(self, project: Optional[str] = None, **kwargs: Any) -> None:
+                self._http = types.SimpleNamespace(mount=lambda *a, **k: None)
+
+            def bucket(self, name: str) -> _Bucket:
+                return _Bucket(name)
+
+            def close(self) -> None:
+                pass
+
+        self.module = types.SimpleNamespace(Client=_Client)
+
+    def sleep(self) -> None:
+        delay = self.latency.sample()
+        if delay:
+            time.sleep(delay)
+
+    def put(self, bucket: str, name: str, data: bytes) -> str:
+        with self.lock:
+            self.generation += 1
+            self.objects[(bucket, name)] = (data, self.generation)
+        return f"https://storage.googleapis.com/{bucket}/{name}"
+
+
+def install_fake_tts(service: Any, latency: LatencyModel) -> None:
+    """Make the TTS service available and synthesize fake MP3 bytes."""
+    service._client = object()
+
+    async def _synthesize(text: str) -> Optional[bytes]:
+        if not text or not text.strip():
+            return None
+        start = time.perf_counter()
+        await asyncio.sleep(latency.sample())
+        main.TTS_SYNTHESIS_SECONDS.since(start)
+        service._stats["syntheses"] += 1
+        return b"ID3" + text.encode("utf-8")[:256]
+
+    service.synthesize = _synthesize
+
+
+def _sample_jpeg() -> Optional[bytes]:
+    if main.Image is None:
+        return None
+    buf = io.BytesIO()
+    main.Image.new("RGB", (1600, 1200), (180, 140, 90)).save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def install_fakes(args: argparse.Namespace) -> Tuple[FakeGemini, FakeStorage]:
+    rng = random.Random(args.seed)
+    gemini = FakeGemini(
+        LatencyModel(args.gemini_latency_ms, args.gemini_jitter_ms,
+                     args.gemini_tail_rate, args.gemini_tail_ms, random.Random(rng.random())),
+        args.gemini_error_rate, args.seed)
+    gemini.install(main.gemini)
+
+    storage = FakeStorage(LatencyModel(args.gcs_latency_ms, args.gcs_latency_ms / 2,
+                                       rng=random.Random(rng.random())))
+    main.storage = storage.module
+
+    main.repo._client = None
+    install_fake_tts(main.tts_service, LatencyModel(
+        args.tts_latency_ms, args.tts_latency_ms / 2, rng=random.Random(rng.random())))
+    return gemini, storage
+
+
+# =============================================================================
+# CLIENTS
+# =============================================================================
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def latency_summary(values_ms: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(values_ms),
+        "p50": _round(percentile(values_ms, 50)),
+        "p95": _round(percentile(values_ms, 95)),
+        "p99": _round(percentile(values_ms, 99)),
+        "max": _round(max(values_ms)) if values_ms else None,
+    }
+
+
+def _round(v: Optional[float]) -> Optional[float]:
+    return round(v, 1) if v is not None else None
+
+
+class Results:
+    def __init__(self) -> None:
+        self.ack_ms: List[float] = []
+        self.ack_status: Counter = Counter()
+        self.query_ms: List[float] = []
+        self.query_types: Counter = Counter()
+        self.query_cached = 0
+        self.errors: Counter = Counter()
+
+
+async def ios_client(uri: str, user_id: str, deadline: float, interval: float,
+                     photo_url: Optional[str], rng: random.Random, results: Results) -> None:
+    try:
+        async with websockets.connect(f"{uri}/ws/ios/{user_id}", max_size=None) as ws:
+            await asyncio.sleep(rng.uniform(0, interval))
+            while time.monotonic() < deadline:
+                msg = {
+                    "type": "memory_capture",
+                    "id": str(uuid.uuid4()),
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "transcription": rng.choice(TRANSCRIPTS),
+                }
+                if photo_url:
+                    msg["photoURL"] = photo_url
+                start = time.perf_counter()
+                await ws.send(json.dumps(msg))
+                while True:
+                    ack = json.loads(await ws.recv())
+                    if ack.get("type") == "ack" or "error" in ack:
+                        break
+                results.ack_ms.append((time.perf_counter() - start) * 1000)
+                results.ack_status[ack.get("status") or ack.get("error") or "unknown"] += 1
+                await asyncio.sleep(interval * rng.uniform(0.5, 1.5))
+    except Exception as e:
+        results.errors[f"ios:{type(e).__name__}"] += 1
+
+
+async def query_client(uri: str, user_id: str, deadline: float, interval: float,
+                       stream: bool, rng: random.Random, results: Results) -> None:
+    try:
+        async with websockets.connect(f"{uri}/ws/query/{user_id}", max_size=None) as ws:
+            await asyncio.sleep(rng.uniform(0, interval))
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                await ws.send(json.dumps({"text": rng.choice(QUESTIONS), "stream": stream}))
+                # Skip partial/audio frames and pushes such as memory_processed
+                while True:
+                    frame = json.loads(await ws.recv())
+                    if "ok" in frame:
+                        break
+                results.query_ms.append((time.perf_counter() - start) * 1000)
+                results.query_types[frame.get("type") if frame.get("ok") else
+                                    f"error:{frame.get('error')}"] += 1
+                if frame.get("cached"):
+                    results.query_cached += 1
+                await asyncio.sleep(interval * rng.uniform(0.5, 1.5))
+    except Exception as e:
+        results.errors[f"query:{type(e).__name__}"] += 1
+
+
+# =============================================================================
+# RUNNER
+# =============================================================================
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_for_drain(timeout: float) -> float:
+    """Wait until the capture queue is idle; returns seconds waited."""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        stats = main.capture_queue.stats()
+        if not stats["depth"] and not stats["inflight"]:
+            break
+        await asyncio.sleep(0.1)
+    return time.monotonic() - start
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    gemini, storage = install_fakes(args)
+    photo_url = None
+    if args.photos:
+        jpeg = _sample_jpeg()
+        if jpeg is None:
+            print("Pillow not installed; running without photos", file=sys.stderr)
+        else:
+            photo_url = storage.put(main.RAW_MEDIA_BUCKET, "loadtest/photo.jpg", jpeg)
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        main.app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            raise RuntimeError("server failed to start")
+        await asyncio.sleep(0.05)
+    uri = f"ws://127.0.0.1:{port}"
+
+    rng = random.Random(args.seed)
+    results = Results()
+    processed_before = main.capture_queue.stats()["processed"]
+    started = time.monotonic()
+    deadline = started + args.duration
+    users = [f"loadtest-{i}" for i in range(max(1, args.ios_clients))]
+    clients = [ios_client(uri, users[i], deadline, args.capture_interval, photo_url,
+                          random.Random(rng.random()), results)
+               for i in range(args.ios_clients)]
+    clients += [query_client(uri, users[i % len(users)], deadline, args.query_interval,
+                             args.stream, random.Random(rng.random()), results)
+                for i in range(args.query_clients)]
+    await asyncio.gather(*clients)
+    elapsed = time.monotonic() - started
+    processed_in_run = main.capture_queue.stats()["processed"] - processed_before
+    drain_seconds = await _wait_for_drain(args.drain_timeout)
+    processed_total = main.capture_queue.stats()["processed"] - processed_before
+
+    server.should_exit = True
+    await server_task
+
+    sent = sum(results.ack_status.values())
+    query_errors = sum(n for t, n in results.query_types.items() if t.startswith("error"))
+    total_queries = len(results.query_ms)
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "durationSeconds": round(elapsed, 2),
+        "captures": {
+            "acked": sent,
+            "ackStatus": dict(results.ack_status),
+            "ackPerSecond": round(sent / elapsed, 2) if elapsed else 0.0,
+            "ackLatencyMs": latency_summary(results.ack_ms),
+            "processedDuringRun": processed_in_run,
+            "processedPerSecond": round(processed_in_run / elapsed, 2) if elapsed else 0.0,
+            "processedAfterDrain": processed_total,
+            "drainSeconds": round(drain_seconds, 2),
+        },
+        "queries": {
+            "completed": total_queries,
+            "perSecond": round(total_queries / elapsed, 2) if elapsed else 0.0,
+            "types": dict(results.query_types),
+            "cached": results.query_cached,
+            "errorRate": round(query_errors / total_queries, 4) if total_queries else 0.0,
+            "latencyMs": latency_summary(results.query_ms),
+        },
+        "gemini": {"calls": dict(gemini.calls), "injectedErrors": dict(gemini.errors)},
+        "clientErrors": dict(results.errors),
+        "server": {
+            "captureQueue": main.capture_queue.stats(),
+            "captureBatcher": main.capture_batcher.stats(),
+            "answerCache": main.answer_cache.stats(),
+            "gemini": main.gemini.stats(),
+        },
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    c, q = report["captures"], report["queries"]
+    print(f"Duration: {report['durationSeconds']}s")
+    print(f"Captures: {c['acked']} acked ({c['ackPerSecond']}/s) status={c['ackStatus']}")
+    print(f"  ack latency ms: {c['ackLatencyMs']}")
+    print(f"  processed: {c['processedDuringRun']} during run ({c['processedPerSecond']}/s), "
+          f"{c['processedAfterDrain']} after {c['drainSeconds']}s drain")
+    print(f"Queries: {q['completed']} ({q['perSecond']}/s) types={q['types']} cached={q['cached']}")
+    print(f"  latency ms: {q['latencyMs']}")
+    print(f"Gemini calls: {report['gemini']['calls']} injected errors: {report['gemini']['injectedErrors']}")
+    if report["clientErrors"]:
+        print(f"Client errors: {report['clientErrors']}")
+
+
+def _check_thresholds(report: Dict[str, Any], args: argparse.Namespace) -> List[str]:
+    failures = []
+    query_p95 = report["queries"]["latencyMs"]["p95"]
+    ack_p95 = report["captures"]["ackLatencyMs"]["p95"]
+    if args.max_query_p95_ms and query_p95 is not None and query_p95 > args.max_query_p95_ms:
+        failures.append(f"query p95 {query_p95}ms > {args.max_query_p95_ms}ms")
+    if args.max_ack_p95_ms and ack_p95 is not None and ack_p95 > args.max_ack_p95_ms:
+        failures.append(f"ack p95 {ack_p95}ms > {args.max_ack_p95_ms}ms")
+    if args.max_error_rate is not None and report["queries"]["errorRate"] > args.max_error_rate:
+        failures.append(f"query error rate {report['queries']['errorRate']} > {args.max_error_rate}")
+    if report["clientErrors"]:
+        failures.append(f"client errors: {report['clientErrors']}")
+    return failures
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--ios-clients", type=int, default=10, help="simulated glasses clients (N)")
+    p.add_argument("--query-clients", type=int, default=3, help="simulated query clients (M)")
+    p.add_argument("--duration", type=float, default=20.0, help="seconds to generate load")
+    p.add_argument("--capture-interval", type=float, default=1.0, help="mean seconds between captures per client")
+    p.add_argument("--query-interval", type=float, default=2.0, help="mean seconds between queries per client")
+    p.add_argument("--stream", action="store_true", help="query clients request streamed answers")
+    p.add_argument("--photos", action="store_true", help="attach a photo to every capture (needs Pillow)")
+    p.add_argument("--gemini-latency-ms", type=float, default=800.0)
+    p.add_argument("--gemini-jitter-ms", type=float, default=300.0)
+    p.add_argument("--gemini-tail-rate", type=float, default=0.02, help="fraction of calls that are slow")
+    p.add_argument("--gemini-tail-ms", type=float, default=4000.0, help="extra latency of slow calls")
+    p.add_argument("--gemini-error-rate", type=float, default=0.0)
+    p.add_argument("--gcs-latency-ms", type=float, default=40.0)
+    p.add_argument("--tts-latency-ms", type=float, default=300.0)
+    p.add_argument("--drain-timeout", type=float, default=60.0, help="max seconds to wait for the capture queue")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--max-query-p95-ms", type=float, default=None)
+    p.add_argument("--max-ack-p95-ms", type=float, default=None)
+    p.add_argument("--max-error-rate", type=float, default=None)
+    p.add_argument("--verbose", action="store_true", help="keep the backend's INFO logging")
+    p.add_argument("--json", action="store_true", help="print the report as JSON")
+    return p.parse_args(argv)
+
+
+def cli(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if uvicorn is None or websockets is None:
+        print("loadtest needs uvicorn and websockets (pip install 'uvicorn[standard]')", file=sys.stderr)
+        return 2
+    if not args.verbose:
+        main.logger.setLevel(logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        _print_report(report)
+    failures = _check_thresholds(report, args)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -2,18 +2,30 @@ import os
 import json
 import uuid
 import asyncio
+import bisect
+import heapq
+import copy
+import hashlib
+import hmac
 import logging
+import mimetypes
 import re
 import base64
+import io
+import random
 import time
+import threading
 import httpx
-from dataclasses import dataclass, field
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
 from datetime import datetime, date, timezone, timedelta
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
 from zoneinfo import ZoneInfo
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Body
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 
 try:
@@ -36,6 +48,41 @@ try:
 except Exception:  # pragma: no cover
     genai = None  # type: ignore
 
+try:
+    from google.api_core.exceptions import NotFound as GcsNotFound  # type: ignore
+except Exception:  # pragma: no cover
+    class GcsNotFound(Exception):  # type: ignore
+        pass
+
+try:
+    from google.api_core import exceptions as google_exceptions  # type: ignore
+except Exception:  # pragma: no cover
+    google_exceptions = None  # type: ignore
+
+try:
+    from google.oauth2 import id_token as google_id_token  # type: ignore
+    from google.auth.transport import requests as google_auth_requests  # type: ignore
+except Exception:  # pragma: no cover
+    google_id_token = None  # type: ignore
+    google_auth_requests = None  # type: ignore
+
+try:
+    from PIL import Image, ImageOps  # type: ignore
+except Exception:  # pragma: no cover
+    Image = None  # type: ignore
+    ImageOps = None  # type: ignore
+
+try:
+    from multipart.multipart import MultipartParser, parse_options_header  # type: ignore
+except Exception:  # pragma: no cover
+    MultipartParser = None  # type: ignore
+    parse_options_header = None  # type: ignore
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover
+    np = None  # type: ignore
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -75,6 +122,210 @@ DEFAULT_QUERY_IMAGES = 8
 RAW_MEDIA_BUCKET = "reality-hack-2026-raw-media"
 PROCESSED_MEDIA_BUCKET = "reality-hack-2026-processed-media"
 
+# Raw media store: "gcs" (RAW_MEDIA_BUCKET) or "local" (filesystem stand-in
+# for testing), lifetime of signed upload URLs, and shared token accepted on
+# POST /upload-complete
+MEDIA_STORE_BACKEND = os.environ.get("MEDIA_STORE_BACKEND", "gcs").lower()
+LOCAL_MEDIA_DIR = os.environ.get("LOCAL_MEDIA_DIR", "./local-media")
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "http://localhost:8080")
+SIGNED_URL_TTL_SECONDS = int(os.environ.get("SIGNED_URL_TTL_SECONDS", "900"))
+UPLOAD_HOOK_TOKEN = os.environ.get("UPLOAD_HOOK_TOKEN", "")
+# Pub/Sub push authentication for POST /upload-complete: expected OIDC
+# audience and, optionally, the push service account. With the GCS backend
+# the hook rejects every call unless this or UPLOAD_HOOK_TOKEN is set.
+UPLOAD_HOOK_OIDC_AUDIENCE = os.environ.get("UPLOAD_HOOK_OIDC_AUDIENCE", "")
+UPLOAD_HOOK_OIDC_EMAIL = os.environ.get("UPLOAD_HOOK_OIDC_EMAIL", "")
+
+# Proxy uploads (POST /upload, /query-upload) stream to storage through a
+# resumable upload in UPLOAD_CHUNK_BYTES pieces (rounded up to the 256 KiB
+# granularity GCS requires); per-request size limits by media kind
+_GCS_CHUNK_GRANULARITY = 256 * 1024
+UPLOAD_CHUNK_BYTES = -(-max(1, int(os.environ.get(
+    "UPLOAD_CHUNK_BYTES", str(8 * 1024 * 1024)))) // _GCS_CHUNK_GRANULARITY) * _GCS_CHUNK_GRANULARITY
+UPLOAD_MAX_IMAGE_BYTES = int(
+    os.environ.get("UPLOAD_MAX_IMAGE_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_MAX_VIDEO_BYTES = int(
+    os.environ.get("UPLOAD_MAX_VIDEO_BYTES", str(512 * 1024 * 1024)))
+
+# Shared media clients: GCS connection pool / executor size and per-call
+# timeout, and the keep-alive pool for external image URLs
+GCS_POOL_SIZE = int(os.environ.get("GCS_POOL_SIZE", "16"))
+GCS_TIMEOUT_SECONDS = float(os.environ.get("GCS_TIMEOUT_SECONDS", "30"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "16"))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("HTTP_TIMEOUT_SECONDS", "30"))
+
+# Downloaded media cache: in-memory bytes, optional disk tier (MEDIA_CACHE_DIR),
+# and how long a URL's generation/ETag is trusted before revalidating
+MEDIA_CACHE_MAX_BYTES = int(
+    os.environ.get("MEDIA_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+MEDIA_CACHE_DIR = os.environ.get("MEDIA_CACHE_DIR", "")
+MEDIA_CACHE_DISK_MAX_BYTES = int(
+    os.environ.get("MEDIA_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+MEDIA_CACHE_REVALIDATE_SECONDS = float(
+    os.environ.get("MEDIA_CACHE_REVALIDATE_SECONDS", "300"))
+
+# Model-sized image derivatives (see MEDIA PREPROCESSING section); needs Pillow
+IMAGE_PREPROCESS_ENABLED = os.environ.get(
+    "IMAGE_PREPROCESS_ENABLED", "true").lower() in ("1", "true", "yes")
+IMAGE_MAX_DIMENSION = int(os.environ.get("IMAGE_MAX_DIMENSION", "1024"))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "80"))
+
+# Capture processing queue (see CAPTURE PROCESSING QUEUE section)
+CAPTURE_WORKERS = int(os.environ.get("CAPTURE_WORKERS", "4"))
+CAPTURE_QUEUE_MAX_DEPTH = int(os.environ.get("CAPTURE_QUEUE_MAX_DEPTH", "500"))
+CAPTURE_QUEUE_MAX_PER_USER = int(
+    os.environ.get("CAPTURE_QUEUE_MAX_PER_USER", "120"))
+CAPTURE_MAX_INFLIGHT_PER_USER = int(
+    os.environ.get("CAPTURE_MAX_INFLIGHT_PER_USER", "4"))
+CAPTURE_MAX_RETRIES = int(os.environ.get("CAPTURE_MAX_RETRIES", "3"))
+CAPTURE_RETRY_BASE_SECONDS = float(
+    os.environ.get("CAPTURE_RETRY_BASE_SECONDS", "5"))
+# How long ws_ios waits for queue space before deferring a capture
+CAPTURE_ENQUEUE_TIMEOUT_SECONDS = float(
+    os.environ.get("CAPTURE_ENQUEUE_TIMEOUT_SECONDS", "2"))
+CAPTURE_RECOVERY_LIMIT = int(os.environ.get("CAPTURE_RECOVERY_LIMIT", "500"))
+CAPTURE_RECOVERY_INTERVAL_SECONDS = float(
+    os.environ.get("CAPTURE_RECOVERY_INTERVAL_SECONDS", "60"))
+
+# Gemini gateway concurrency (global cap plus one cap per purpose)
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_CAPTURE_CONCURRENCY = int(
+    os.environ.get("GEMINI_CAPTURE_CONCURRENCY", "4"))
+GEMINI_QUERY_CONCURRENCY = int(os.environ.get("GEMINI_QUERY_CONCURRENCY", "4"))
+GEMINI_CONDENSE_CONCURRENCY = int(
+    os.environ.get("GEMINI_CONDENSE_CONCURRENCY", "2"))
+
+# Gemini scheduling (see GEMINI GATEWAY section). Requests per minute across
+# every caller, sized to the project quota (0 disables the limiter), plus the
+# burst the token bucket may spend at once.
+GEMINI_REQUESTS_PER_MINUTE = float(
+    os.environ.get("GEMINI_REQUESTS_PER_MINUTE", "600"))
+GEMINI_BURST = int(os.environ.get("GEMINI_BURST", "10"))
+# Retries for 429s, 5xx and timeouts (full-jitter exponential backoff)
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "3"))
+GEMINI_RETRY_BASE_SECONDS = float(
+    os.environ.get("GEMINI_RETRY_BASE_SECONDS", "0.5"))
+GEMINI_RETRY_MAX_SECONDS = float(
+    os.environ.get("GEMINI_RETRY_MAX_SECONDS", "8"))
+# Send a second copy of an interactive call still unanswered after this many
+# seconds and use whichever finishes first (0 disables hedging)
+GEMINI_HEDGE_AFTER_SECONDS = float(
+    os.environ.get("GEMINI_HEDGE_AFTER_SECONDS", "0"))
+# Consecutive upstream failures that open the circuit breaker, and how long
+# background (capture/condense) calls are shed once it opens
+GEMINI_BREAKER_FAILURES = int(os.environ.get("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_COOLDOWN_SECONDS = float(
+    os.environ.get("GEMINI_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Opt-in micro-batching of capture analysis (several captures per Gemini call).
+# Batch size is also bounded by CAPTURE_MAX_INFLIGHT_PER_USER.
+CAPTURE_BATCH_ENABLED = os.environ.get(
+    "CAPTURE_BATCH_ENABLED", "false").lower() in ("1", "true", "yes")
+CAPTURE_BATCH_WINDOW_SECONDS = float(
+    os.environ.get("CAPTURE_BATCH_WINDOW_SECONDS", "2"))
+CAPTURE_BATCH_MAX_ITEMS = int(os.environ.get("CAPTURE_BATCH_MAX_ITEMS", "4"))
+
+# Read-through cache for per-user Firestore documents (profile, contacts)
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get("USER_CACHE_MAX_ENTRIES", "2000"))
+
+# Contacts: coalesced mention/lastSeen updates, flushed per user on an
+# interval or once this many distinct names are pending
+CONTACTS_FLUSH_INTERVAL_SECONDS = float(
+    os.environ.get("CONTACTS_FLUSH_INTERVAL_SECONDS", "10"))
+CONTACTS_FLUSH_MAX_PENDING = int(
+    os.environ.get("CONTACTS_FLUSH_MAX_PENDING", "25"))
+
+# Condensation scheduler: hourly/daily summaries run this long after their
+# period closes, with bounded concurrency and retries
+CONDENSE_CONCURRENCY = int(os.environ.get("CONDENSE_CONCURRENCY", "2"))
+CONDENSE_HOURLY_DELAY_SECONDS = float(
+    os.environ.get("CONDENSE_HOURLY_DELAY_SECONDS", "120"))
+CONDENSE_DAILY_DELAY_SECONDS = float(
+    os.environ.get("CONDENSE_DAILY_DELAY_SECONDS", "900"))
+CONDENSE_MAX_RETRIES = int(os.environ.get("CONDENSE_MAX_RETRIES", "3"))
+CONDENSE_RETRY_SECONDS = float(
+    os.environ.get("CONDENSE_RETRY_SECONDS", "300"))
+CONDENSE_RECOVERY_HOURS = int(
+    os.environ.get("CONDENSE_RECOVERY_HOURS", "48"))
+# A capture processed after its hour/day was already due reopens that
+# period; the re-summary waits this long so a burst of late captures
+# (e.g. an offline phone catching up) shares one run
+CONDENSE_LATE_DEBOUNCE_SECONDS = float(
+    os.environ.get("CONDENSE_LATE_DEBOUNCE_SECONDS", "300"))
+
+# Incremental hourly summaries: fold every HOURLY_PARTIAL_BATCH processed
+# captures into a rolling partial and finish the hour from it (opt-in)
+HOURLY_INCREMENTAL_ENABLED = os.environ.get(
+    "HOURLY_INCREMENTAL_ENABLED", "false").lower() in ("1", "true", "yes")
+HOURLY_PARTIAL_BATCH = int(os.environ.get("HOURLY_PARTIAL_BATCH", "10"))
+
+# Prompt assembly: estimated-token budgets per prompt type (text only;
+# images are billed separately by Gemini)
+PROMPT_CHARS_PER_TOKEN = int(os.environ.get("PROMPT_CHARS_PER_TOKEN", "4"))
+PROMPT_BUDGET_CAPTURE = int(os.environ.get("PROMPT_BUDGET_CAPTURE", "3000"))
+PROMPT_BUDGET_QUERY_ROUTER = int(
+    os.environ.get("PROMPT_BUDGET_QUERY_ROUTER", "6000"))
+PROMPT_BUDGET_QUERY_ANSWER = int(
+    os.environ.get("PROMPT_BUDGET_QUERY_ANSWER", "32000"))
+PROMPT_BUDGET_HOURLY = int(os.environ.get("PROMPT_BUDGET_HOURLY", "24000"))
+PROMPT_BUDGET_DAILY = int(os.environ.get("PROMPT_BUDGET_DAILY", "16000"))
+
+# Recent queries: per-user in-memory ring size and Firestore log retention
+RECENT_QUERY_RING_SIZE = int(os.environ.get("RECENT_QUERY_RING_SIZE", "50"))
+RECENT_QUERY_RETENTION_DAYS = int(
+    os.environ.get("RECENT_QUERY_RETENTION_DAYS", "30"))
+
+# Query retrieval fan-out: max concurrent Firestore reads and overall deadline
+RETRIEVAL_CONCURRENCY = int(os.environ.get("RETRIEVAL_CONCURRENCY", "8"))
+RETRIEVAL_DEADLINE_SECONDS = float(
+    os.environ.get("RETRIEVAL_DEADLINE_SECONDS", "5"))
+
+# Semantic capture retrieval (see CAPTURE VECTOR INDEX section)
+EMBEDDING_PROVIDER = os.environ.get("EMBEDDING_PROVIDER", "local").lower()
+GEMINI_EMBEDDING_MODEL = os.environ.get(
+    "GEMINI_EMBEDDING_MODEL", "models/text-embedding-004")
+VECTOR_INDEX_DIM = int(os.environ.get("VECTOR_INDEX_DIM", "256"))
+VECTOR_INDEX_EXACT_LIMIT = int(
+    os.environ.get("VECTOR_INDEX_EXACT_LIMIT", "5000"))
+VECTOR_INDEX_MAX_PER_USER = int(
+    os.environ.get("VECTOR_INDEX_MAX_PER_USER", "50000"))
+QUERY_MAX_CAPTURES = int(os.environ.get("QUERY_MAX_CAPTURES", "20"))
+QUERY_MAX_UNPROCESSED_CAPTURES = int(
+    os.environ.get("QUERY_MAX_UNPROCESSED_CAPTURES", "5"))
+
+# Answer cache for repeated questions: entry lifetime, entries kept per user,
+# and the minimum embedding similarity for a reworded question to reuse an
+# answer (exact matches after normalization always qualify)
+ANSWER_CACHE_ENABLED = os.environ.get(
+    "ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_TTL_SECONDS = float(
+    os.environ.get("ANSWER_CACHE_TTL_SECONDS", "600"))
+ANSWER_CACHE_MAX_PER_USER = int(
+    os.environ.get("ANSWER_CACHE_MAX_PER_USER", "32"))
+ANSWER_CACHE_SIMILARITY = float(
+    os.environ.get("ANSWER_CACHE_SIMILARITY", "0.9"))
+
+# Recent activity window: minutes of processed captures kept in memory per
+# user (at most RECENT_ACTIVITY_MAX_ITEMS), and the default span of a
+# "what did I just do?" rewind answered from it without the router
+RECENT_ACTIVITY_WINDOW_MINUTES = int(
+    os.environ.get("RECENT_ACTIVITY_WINDOW_MINUTES", "60"))
+RECENT_ACTIVITY_MAX_ITEMS = int(
+    os.environ.get("RECENT_ACTIVITY_MAX_ITEMS", "100"))
+RECENT_ACTIVITY_REWIND_MINUTES = int(
+    os.environ.get("RECENT_ACTIVITY_REWIND_MINUTES", "10"))
+
+# Streaming query answers: minimum characters per synthesized audio chunk
+STREAM_TTS_MIN_CHARS = int(os.environ.get("STREAM_TTS_MIN_CHARS", "40"))
+
+# TTS cache: bytes of recent audio kept in memory, and known object URLs
+TTS_CACHE_MAX_BYTES = int(
+    os.environ.get("TTS_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+TTS_URL_CACHE_MAX_ENTRIES = int(
+    os.environ.get("TTS_URL_CACHE_MAX_ENTRIES", "5000"))
+
 # =============================================================================
 # SYSTEM PROMPTS (well-labeled for easy modification)
 # =============================================================================
@@ -109,6 +360,41 @@ Transcription: {transcription}
 Be concise but informative. Focus on details that would help someone recall this moment later.
 Return ONLY valid JSON, no markdown formatting."""
 
+CAPTURE_BATCH_ANALYSIS_PROMPT = """You are analyzing {count} memory captures for a memory assistance application.
+The user relies on this app to remember their daily experiences.
+
+Each capture below has an id, a timestamp and a transcription of audio. Images are
+attached in order; "imageIndex" gives the 1-based position of a capture's image
+(null if the capture has no image).
+
+Captures:
+{captures_json}
+
+Analyze EACH capture independently and return a JSON object:
+{{
+  "analyses": [
+    {{
+      "captureId": "the id of the capture this analysis belongs to",
+      "imageSummary": "Brief description of what's shown in the image",
+      "themes": ["theme1", "theme2"],
+      "mood": "the emotional tone (e.g., happy, focused, relaxed, stressed)",
+      "location": "best guess of location type (e.g., home, office, cafe, outdoors)",
+      "detectedFaces": [
+        {{
+          "description": "physical description of person",
+          "possibleName": "name if mentioned in transcription, otherwise null",
+          "confidence": 0.0-1.0
+        }}
+      ],
+      "mentionedNames": ["names mentioned in transcription"],
+      "keyMoment": "one sentence capturing the essence of this memory"
+    }}
+  ]
+}}
+
+Return exactly one analysis per capture. Be concise but informative.
+Return ONLY valid JSON, no markdown formatting."""
+
 HOURLY_SUMMARY_PROMPT = """You are creating an hourly summary for a memory assistance application.
 The user relies on these summaries to remember their day.
 NOTE: There may be 60+ memory captures per hour - this is normal. Synthesize them into a comprehensive narrative.
@@ -137,6 +423,62 @@ Create a detailed, comprehensive summary. Return a JSON object:
 Be warm and personal. Include enough detail that someone could vividly recall this hour later.
 Return ONLY valid JSON, no markdown formatting."""
 
+HOURLY_PARTIAL_PROMPT = """You are keeping a running summary of the current hour for a memory assistance application.
+The user relies on these summaries to remember their day.
+
+Running summary of this hour so far (empty if this is the start of the hour):
+{partial_json}
+
+New memory captures to fold in:
+{captures_json}
+
+Update the running summary so it covers everything so far. Keep earlier details unless the new captures correct them. Return a JSON object:
+{{
+  "summary": "A detailed narrative of everything that has happened this hour so far, including specific details, conversations, activities and transitions.",
+  "themes": ["theme1", "theme2"],
+  "events": [
+    {{"time": "HH:MM", "description": "what happened"}}
+  ],
+  "peoplePresent": ["names of people seen or mentioned"],
+  "locations": ["places visited"],
+  "highlight": "the most notable moment so far",
+  "mood": "overall emotional tone so far",
+  "activities": ["distinct activities performed"]
+}}
+
+Return ONLY valid JSON, no markdown formatting."""
+
+HOURLY_FINALIZE_PROMPT = """You are creating an hourly summary for a memory assistance application.
+The user relies on these summaries to remember their day.
+Most of the hour has already been condensed into a running summary; finish it with the remaining captures.
+
+Running summary of this hour:
+{partial_json}
+
+Remaining memory captures from this hour:
+{captures_json}
+
+Queries made this hour (user was thinking about these topics):
+{queries_json}
+
+Create a detailed, comprehensive summary of the whole hour. Return a JSON object:
+{{
+  "summary": "A detailed 5-10 sentence narrative summary of everything that happened this hour. Include specific details, conversations, activities, and transitions between moments. Be thorough.",
+  "themes": ["theme1", "theme2", "theme3", "theme4", "theme5"],
+  "events": [
+    {{"time": "HH:MM", "description": "what happened"}},
+    {{"time": "HH:MM", "description": "what happened"}}
+  ],
+  "peoplePresent": ["names of people seen or mentioned"],
+  "locations": ["places visited this hour"],
+  "highlight": "the single most notable or meaningful moment from this hour",
+  "mood": "overall emotional tone of the hour",
+  "activities": ["list of distinct activities performed"]
+}}
+
+Be warm and personal. Include enough detail that someone could vividly recall this hour later.
+Return ONLY valid JSON, no markdown formatting."""
+
 DAILY_SUMMARY_PROMPT = """You are creating a daily summary for a memory assistance application.
 This summary helps the user remember their entire day.
 NOTE: Each hour may contain 60+ captures, so a full day could have hundreds of moments. Create a rich, detailed narrative.
@@ -296,6 +638,180 @@ app.add_middleware(
 )
 
 
+# =============================================================================
+# METRICS
+# =============================================================================
+# Minimal Prometheus-style metrics, exposed in text format at GET /metrics.
+# Recording is a dict lookup plus a bisect, so it is safe on hot paths;
+# durations are measured with time.perf_counter(). Gauges can be backed by a
+# function that is sampled only when /metrics is scraped.
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_BACKGROUND_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _metric_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        metrics_registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return self._header() + [
+            f"{self.name}{_metric_labels(self.labelnames, k)} {v:g}"
+            for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float], **labels: str) -> None:
+        """Sample `fn` at scrape time instead of tracking the value."""
+        self._functions[self._key(labels)] = fn
+
+    def render(self) -> List[str]:
+        values = dict(self._values)
+        for key, fn in self._functions.items():
+            try:
+                values[key] = float(fn())
+            except Exception:
+                continue
+        return self._header() + [
+            f"{self.name}{_metric_labels(self.labelnames, k)} {v:g}"
+            for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = _LATENCY_BUCKETS) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def since(self, start: float, **labels: str) -> float:
+        """Observe the time elapsed since perf_counter() `start`; returns it."""
+        elapsed = time.perf_counter() - start
+        self.observe(elapsed, **labels)
+        return elapsed
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else f"{bound:g}")
+                lines.append(f"{self.name}_bucket"
+                             f"{_metric_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_metric_labels(self.labelnames, key)} {total[0]:.6f}")
+            lines.append(f"{self.name}_count{_metric_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+metrics_registry: List[_Metric] = []
+
+
+def render_metrics() -> str:
+    return "\n".join(line for m in metrics_registry for line in m.render()) + "\n"
+
+
+QUERY_STAGE_SECONDS = Histogram(
+    "memory_query_stage_seconds",
+    "Query pipeline stage latency (context, router, retrieval, answer, total).",
+    ("stage",))
+TTS_SYNTHESIS_SECONDS = Histogram(
+    "memory_tts_synthesis_seconds", "Text-to-Speech synthesis call latency.")
+GCS_UPLOAD_SECONDS = Histogram(
+    "memory_gcs_upload_seconds", "GCS upload latency (single request or resumable).",
+    ("mode",))
+GEMINI_CALL_SECONDS = Histogram(
+    "memory_gemini_call_seconds", "Gemini call latency, including queueing.",
+    ("purpose",))
+CAPTURE_ANALYSIS_SECONDS = Histogram(
+    "memory_capture_analysis_seconds", "Capture analysis latency (image fetch + Gemini).",
+    buckets=_BACKGROUND_BUCKETS)
+CONDENSATION_SECONDS = Histogram(
+    "memory_condensation_seconds", "Hourly/daily condensation job latency.",
+    ("kind",), buckets=_BACKGROUND_BUCKETS)
+GEMINI_ERRORS = Counter(
+    "memory_gemini_errors_total", "Failed Gemini calls.", ("purpose",))
+GEMINI_ADAPTER_FALLBACKS = Counter(
+    "memory_gemini_adapter_fallbacks_total", "Gemini SDK adapter switches.")
+GEMINI_RETRIES = Counter(
+    "memory_gemini_retries_total", "Gemini calls retried after a transient failure.",
+    ("purpose",))
+GEMINI_SHED = Counter(
+    "memory_gemini_shed_total", "Background Gemini calls rejected by the open circuit breaker.",
+    ("purpose",))
+GEMINI_HEDGES = Counter(
+    "memory_gemini_hedges_total", "Hedged interactive Gemini calls (launched, won).",
+    ("outcome",))
+GEMINI_RATE_WAIT_SECONDS = Histogram(
+    "memory_gemini_rate_wait_seconds", "Time spent waiting for a Gemini rate-limit token.",
+    ("purpose",))
+GEMINI_BREAKER_OPEN = Gauge(
+    "memory_gemini_breaker_open", "1 while the Gemini circuit breaker sheds background work.")
+JSON_PARSE_FAILURES = Counter(
+    "memory_json_parse_failures_total",
+    "Model responses that were not plain JSON (recovered by extraction, or failed).",
+    ("outcome",))
+WEBSOCKET_CONNECTIONS = Gauge(
+    "memory_websocket_connections", "Open WebSocket connections.", ("kind",))
+INFLIGHT_TASKS = Gauge(
+    "memory_inflight_tasks", "Work currently being processed.", ("kind",))
+
+
 def _parse_iso_datetime(value: Any) -> datetime:
     if isinstance(value, datetime):
         return value
@@ -322,9 +838,182 @@ class InMemoryDB:
     processed_memories: Dict[Tuple[str, str],
                              Dict[str, Any]] = field(default_factory=dict)
     user_profiles: Dict[str, Dict[str, Any]] = field(default_factory=dict)
-    contacts: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    # user_id -> contact key -> contact
+    contacts: Dict[str, Dict[str, Dict[str, Any]]
+                   ] = field(default_factory=dict)
+    # user_id -> alias -> contact keys
+    contact_aliases: Dict[str, Dict[str, Set[str]]
+                          ] = field(default_factory=dict)
     hourly_summaries: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    hourly_partials: Dict[str, Dict[str, Any]] = field(default_factory=dict)
     daily_summaries: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    # user_id -> [(epoch seconds, capture_id)] kept sorted, for range queries
+    captures_by_user: Dict[str, List[Tuple[float, str]]
+                           ] = field(default_factory=dict)
+    # capture_id -> its current entry in captures_by_user
+    capture_positions: Dict[str, Tuple[str, float]
+                            ] = field(default_factory=dict)
+    # (user_id, date_str) -> hour -> hourly summary doc
+    hourly_by_day: Dict[Tuple[str, str], Dict[int, Dict[str, Any]]
+                        ] = field(default_factory=dict)
+
+    def put_contact(self, user_id: str, key: str, contact: Dict[str, Any]) -> None:
+        people = self.contacts.setdefault(user_id, {})
+        people[key] = {**people.get(key, {}), **contact, "key": key}
+        aliases = self.contact_aliases.setdefault(user_id, {})
+        for alias in _contact_aliases(people[key]):
+            if alias != key:
+                aliases.setdefault(alias, set()).add(key)
+
+    def index_capture(self, doc: Dict[str, Any]) -> None:
+        capture_id = doc["id"]
+        old = self.capture_positions.pop(capture_id, None)
+        if old is not None:
+            entries = self.captures_by_user.get(old[0], [])
+            i = bisect.bisect_left(entries, (old[1], capture_id))
+            if i < len(entries) and entries[i] == (old[1], capture_id):
+                del entries[i]
+
+        user_id = doc.get("userId")
+        try:
+            ts = _parse_iso_datetime(doc.get("timestamp")).timestamp()
+        except Exception:
+            return
+        if user_id is None:
+            return
+        bisect.insort(self.captures_by_user.setdefault(
+            user_id, []), (ts, capture_id))
+        self.capture_positions[capture_id] = (user_id, ts)
+
+    def captures_between(self, user_id: str, start_dt: datetime, end_dt: datetime) -> List[Dict[str, Any]]:
+        """Captures with start_dt <= timestamp <= end_dt, oldest first."""
+        entries = self.captures_by_user.get(user_id, [])
+        lo = bisect.bisect_left(
+            entries, start_dt.timestamp(), key=lambda e: e[0])
+        hi = bisect.bisect_right(
+            entries, end_dt.timestamp(), key=lambda e: e[0])
+        return [self.captures[cid] for _, cid in entries[lo:hi]]
+
+    def put_hourly_summary(self, doc_id: str, user_id: str, date_str: str, hour: int, doc: Dict[str, Any]) -> None:
+        self.hourly_summaries[doc_id] = doc
+        self.hourly_by_day.setdefault((user_id, date_str), {})[hour] = doc
+
+
+class UserDocCache:
+    """In-process TTL + LRU cache for small per-user documents.
+
+    Every (kind, user) key carries a version that is bumped on invalidation;
+    a read that started before a write can't repopulate the cache with the
+    stale document it fetched. Missing documents (None) are cached too.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self._versions: Dict[Tuple[str, str], int] = {}
+        self._stats: Dict[str, int] = {
+            "hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def version(self, kind: str, user_id: str) -> int:
+        return self._versions.get((kind, user_id), 0)
+
+    def get(self, kind: str, user_id: str) -> Tuple[bool, Any]:
+        key = (kind, user_id)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self._stats["misses"] += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return True, copy.deepcopy(entry[1])
+
+    def put(self, kind: str, user_id: str, value: Any, version: int) -> None:
+        key = (kind, user_id)
+        if self._versions.get(key, 0) != version:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def invalidate(self, kind: str, user_id: str) -> None:
+        key = (kind, user_id)
+        self._versions[key] = self._versions.get(key, 0) + 1
+        self._entries.pop(key, None)
+        self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "entries": len(self._entries),
+            "hitRate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+
+def _contact_key(name: str) -> str:
+    """Normalized contact name, used as its document id and index key."""
+    key = " ".join(re.sub(r"[^\w\s'-]", " ", name.lower()).split())
+    return key.strip("_")[:200]
+
+
+def _contact_aliases(contact: Dict[str, Any]) -> Set[str]:
+    """Index keys for a contact: its full name, first name and any aliases."""
+    key = _contact_key(contact.get("name") or "")
+    aliases = {key} if key else set()
+    if " " in key:
+        aliases.add(key.split(" ", 1)[0])
+    for alias in contact.get("aliases") or []:
+        if isinstance(alias, str) and _contact_key(alias):
+            aliases.add(_contact_key(alias))
+    return aliases
+
+
+def _order_contact_matches(keys: List[str], found: Dict[str, Dict[str, Any]],
+                           resolved: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    matches: List[Dict[str, Any]] = []
+    seen: Set[str] = set()
+    for key in keys:
+        if key in found:
+            candidates = [key]
+        else:
+            candidates = sorted((ck for ck in resolved.get(key, []) if ck in found),
+                                key=lambda ck: found[ck].get("lastSeen") or "", reverse=True)
+        for ck in candidates:
+            if ck not in seen:
+                seen.add(ck)
+                matches.append(found[ck])
+    return matches
+
+
+# Firestore rejects transactions and batches with more writes than this
+FIRESTORE_MAX_WRITES = 500
+
+
+class _ChunkedWriter:
+    """Collects `set()` calls and commits them as consecutive batches of at
+    most FIRESTORE_MAX_WRITES writes. Not atomic across chunks, so every
+    write must be safe to repeat."""
+
+    def __init__(self, client: Any) -> None:
+        self._client = client
+        self._writes: List[Tuple[Any, Dict[str, Any], bool]] = []
+
+    def set(self, ref: Any, data: Dict[str, Any], merge: bool = False) -> None:
+        self._writes.append((ref, data, merge))
+
+    async def commit(self) -> int:
+        writes, self._writes = self._writes, []
+        for i in range(0, len(writes), FIRESTORE_MAX_WRITES):
+            batch = self._client.batch()
+            for ref, data, merge in writes[i:i + FIRESTORE_MAX_WRITES]:
+                batch.set(ref, data, merge=merge)
+            await batch.commit()
+        return len(writes)
 
 
 class FirestoreRepo:
@@ -332,6 +1021,12 @@ class FirestoreRepo:
         self.project_id = os.environ.get("GCP_PROJECT_ID")
         self._mem = InMemoryDB()
         self._client = None
+        self._cache = UserDocCache(
+            USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_ENTRIES)
+        self._recent: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._recent_loaded_at: Dict[str, float] = {}
+        self._contacts_sharded: Set[str] = set()
+        self._contacts_migrations: Dict[str, asyncio.Lock] = {}
 
         if firestore is None:
             logger.warning(
@@ -351,12 +1046,25 @@ class FirestoreRepo:
     def is_firestore(self) -> bool:
         return self._client is not None
 
+    async def _cached_get(self, kind: str, user_id: str, fetch) -> Optional[Dict[str, Any]]:
+        found, value = self._cache.get(kind, user_id)
+        if found:
+            return value
+        version = self._cache.version(kind, user_id)
+        value = await fetch()
+        self._cache.put(kind, user_id, value, version)
+        return copy.deepcopy(value)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
     # -------------------------------------------------------------------------
     # Memory Captures
     # -------------------------------------------------------------------------
     async def create_capture(self, doc: Dict[str, Any]) -> None:
         if not self._client:
             self._mem.captures[doc["id"]] = doc
+            self._mem.index_capture(doc)
             return
         await self._client.collection("memory_captures").document(doc["id"]).set(doc)
 
@@ -369,32 +1077,19 @@ class FirestoreRepo:
     async def update_capture(self, capture_id: str, updates: Dict[str, Any]) -> None:
         if not self._client:
             if capture_id in self._mem.captures:
-                self._mem.captures[capture_id].update(updates)
+                doc = self._mem.captures[capture_id]
+                doc.update(updates)
+                if "timestamp" in updates or "userId" in updates:
+                    self._mem.index_capture(doc)
             return
         await self._client.collection("memory_captures").document(capture_id).update(updates)
 
     async def list_captures_for_date(self, user_id: str, day: date) -> List[Dict[str, Any]]:
-        if not self._client:
-            out: List[Dict[str, Any]] = []
-            for doc in self._mem.captures.values():
-                if doc.get("userId") != user_id:
-                    continue
-                ts = doc.get("timestamp")
-                if isinstance(ts, datetime):
-                    d = ts.astimezone(timezone.utc).date()
-                else:
-                    try:
-                        d = _parse_iso_datetime(
-                            ts).astimezone(timezone.utc).date()
-                    except Exception:
-                        continue
-                if d == day:
-                    out.append(doc)
-            out.sort(key=lambda x: x.get("timestamp") or datetime.min)
-            return out
-
         start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
         end = start.replace(hour=23, minute=59, second=59, microsecond=999999)
+        if not self._client:
+            return self._mem.captures_between(user_id, start, end)
+
         q = (
             self._client.collection("memory_captures")
             .where("userId", "==", user_id)
@@ -407,16 +1102,7 @@ class FirestoreRepo:
 
     async def list_captures_in_range(self, user_id: str, start_dt: datetime, end_dt: datetime) -> List[Dict[str, Any]]:
         if not self._client:
-            out: List[Dict[str, Any]] = []
-            for doc in self._mem.captures.values():
-                if doc.get("userId") != user_id:
-                    continue
-                ts = doc.get("timestamp")
-                if isinstance(ts, datetime):
-                    if start_dt <= ts <= end_dt:
-                        out.append(doc)
-            out.sort(key=lambda x: x.get("timestamp") or datetime.min)
-            return out
+            return self._mem.captures_between(user_id, start_dt, end_dt)
 
         q = (
             self._client.collection("memory_captures")
@@ -428,6 +1114,43 @@ class FirestoreRepo:
         snaps = [doc async for doc in q.stream()]
         return [s.to_dict() for s in snaps]
 
+    async def list_unprocessed_captures(self, limit: int) -> List[Dict[str, Any]]:
+        """Captures still marked processed=False (pending, deferred or failed)."""
+        if not self._client:
+            out = [doc for doc in self._mem.captures.values()
+                   if not doc.get("processed")]
+            out.sort(key=lambda x: x.get("timestamp")
+                     or datetime.min.replace(tzinfo=timezone.utc))
+            return out[:limit]
+
+        q = (
+            self._client.collection("memory_captures")
+            .where("processed", "==", False)
+            .limit(limit)
+        )
+        snaps = [doc async for doc in q.stream()]
+        return [s.to_dict() for s in snaps]
+
+    async def list_capture_periods_since(self, since: datetime) -> List[Tuple[str, datetime]]:
+        """(userId, timestamp) of every capture at or after `since`."""
+        if not self._client:
+            cutoff = since.timestamp()
+            return [(user_id, datetime.fromtimestamp(ts, timezone.utc))
+                    for user_id, entries in self._mem.captures_by_user.items()
+                    for ts, _ in entries[bisect.bisect_left(entries, (cutoff, "")):]]
+
+        q = (
+            self._client.collection("memory_captures")
+            .where("timestamp", ">=", since)
+            .select(["userId", "timestamp"])
+        )
+        out = []
+        async for snap in q.stream():
+            d = snap.to_dict() or {}
+            if d.get("userId") and d.get("timestamp"):
+                out.append((d["userId"], _parse_iso_datetime(d["timestamp"])))
+        return out
+
     # -------------------------------------------------------------------------
     # User Profiles (lifestyle/general info)
     # -------------------------------------------------------------------------
@@ -435,8 +1158,11 @@ class FirestoreRepo:
         doc_id = f"profile_{user_id}"
         if not self._client:
             return self._mem.user_profiles.get(doc_id)
-        snap = await self._client.collection("user_profiles").document(doc_id).get()
-        return snap.to_dict() if snap.exists else None
+
+        async def _fetch() -> Optional[Dict[str, Any]]:
+            snap = await self._client.collection("user_profiles").document(doc_id).get()
+            return snap.to_dict() if snap.exists else None
+        return await self._cached_get("profile", user_id, _fetch)
 
     async def upsert_user_profile(self, user_id: str, doc: Dict[str, Any]) -> None:
         doc_id = f"profile_{user_id}"
@@ -445,26 +1171,198 @@ class FirestoreRepo:
         if not self._client:
             self._mem.user_profiles[doc_id] = doc
             return
+        self._cache.invalidate("profile", user_id)
         await self._client.collection("user_profiles").document(doc_id).set(doc, merge=True)
+        self._cache.invalidate("profile", user_id)
 
     # -------------------------------------------------------------------------
     # Contacts
     # -------------------------------------------------------------------------
+    # Contacts live one per document in contacts/contacts_{user}/people,
+    # keyed by _contact_key(name), with contacts/contacts_{user}/aliases
+    # mapping first names and explicit aliases to contact keys. Users still
+    # on the old single-array document are migrated on first access.
+    def _contacts_parent(self, user_id: str):
+        return self._client.collection("contacts").document(f"contacts_{user_id}")
+
+    @staticmethod
+    def _write_contact(writer, parent, key: str, contact: Dict[str, Any],
+                       with_aliases: bool = True) -> None:
+        writer.set(parent.collection("people").document(key),
+                   {**contact, "key": key}, merge=True)
+        if with_aliases:
+            for alias in _contact_aliases(contact):
+                if alias != key:
+                    writer.set(parent.collection("aliases").document(alias),
+                               {"keys": firestore.ArrayUnion([key])}, merge=True)
+
+    async def _ensure_contacts_sharded(self, user_id: str) -> None:
+        """Move a legacy single-array contacts doc into per-contact docs.
+
+        Runs in chunked batches (a few hundred contacts with aliases exceed
+        one transaction), with `sharded` written last. All writes merge, so
+        an interrupted migration is simply redone on the next access.
+        """
+        if user_id in self._contacts_sharded:
+            return
+        lock = self._contacts_migrations.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            if user_id in self._contacts_sharded:
+                return
+            parent = self._contacts_parent(user_id)
+            snap = await parent.get()
+            legacy = (snap.to_dict() or {}) if snap.exists else {}
+            if not legacy.get("sharded"):
+                contacts = [c for c in legacy.get("contacts") or []
+                            if _contact_key(c.get("name") or "")]
+                writer = _ChunkedWriter(self._client)
+                for c in contacts:
+                    self._write_contact(writer, parent, _contact_key(c["name"]), c)
+                writes = await writer.commit()
+                await parent.set({
+                    "userId": user_id,
+                    "sharded": True,
+                    "contacts": firestore.DELETE_FIELD,
+                    "updatedAt": datetime.now(timezone.utc),
+                }, merge=True)
+                if contacts:
+                    logger.info("Migrated %d contacts (%d writes) to per-contact docs user=%s",
+                                len(contacts), writes, user_id)
+            self._contacts_sharded.add(user_id)
+        self._contacts_migrations.pop(user_id, None)
+
+    def _invalidate_contacts(self, user_id: str) -> None:
+        self._cache.invalidate("contacts", user_id)
+        self._cache.invalidate("recent_contacts", user_id)
+
     async def get_contacts(self, user_id: str) -> Optional[Dict[str, Any]]:
-        doc_id = f"contacts_{user_id}"
+        """All contacts for a user as {"userId", "contacts": [...]}, or None."""
         if not self._client:
-            return self._mem.contacts.get(doc_id)
-        snap = await self._client.collection("contacts").document(doc_id).get()
-        return snap.to_dict() if snap.exists else None
+            people = self._mem.contacts.get(user_id)
+            if not people:
+                return None
+            return {"userId": user_id, "contacts": copy.deepcopy(list(people.values()))}
+
+        async def _fetch() -> Optional[Dict[str, Any]]:
+            await self._ensure_contacts_sharded(user_id)
+            people = self._contacts_parent(user_id).collection("people")
+            contacts = [snap.to_dict() async for snap in people.stream()]
+            return {"userId": user_id, "contacts": contacts} if contacts else None
+        return await self._cached_get("contacts", user_id, _fetch)
+
+    async def list_recent_contacts(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """The `limit` most recently seen contacts, newest first."""
+        if not self._client:
+            people = self._mem.contacts.get(user_id) or {}
+            ordered = sorted(people.values(),
+                             key=lambda c: c.get("lastSeen") or "", reverse=True)
+            return copy.deepcopy(ordered[:limit])
+
+        async def _fetch() -> Optional[Dict[str, Any]]:
+            await self._ensure_contacts_sharded(user_id)
+            q = (self._contacts_parent(user_id).collection("people")
+                 .order_by("lastSeen", direction=firestore.Query.DESCENDING)
+                 .limit(limit))
+            return {"contacts": [snap.to_dict() async for snap in q.stream()]}
+        doc = await self._cached_get("recent_contacts", user_id, _fetch)
+        return (doc or {}).get("contacts", [])[:limit]
+
+    async def find_contacts(self, user_id: str, names: List[str]) -> List[Dict[str, Any]]:
+        """Resolve names to contacts by key, then through the alias index.
+
+        Results follow the order of `names`; an alias shared by several
+        contacts yields all of them, most recently seen first.
+        """
+        keys = list(dict.fromkeys(k for k in map(_contact_key, names) if k))
+        if not keys:
+            return []
+
+        if not self._client:
+            people = self._mem.contacts.get(user_id) or {}
+            aliases = self._mem.contact_aliases.get(user_id) or {}
+            found = {k: people[k] for k in keys if k in people}
+            resolved = {k: [ck for ck in aliases.get(k, ()) if ck in people]
+                        for k in keys if k not in found}
+            for alias_keys in resolved.values():
+                found.update({ck: people[ck] for ck in alias_keys})
+            return copy.deepcopy(_order_contact_matches(keys, found, resolved))
+
+        await self._ensure_contacts_sharded(user_id)
+        parent = self._contacts_parent(user_id)
+        people = parent.collection("people")
+
+        async def _get_people(wanted: List[str]) -> Dict[str, Dict[str, Any]]:
+            refs = [people.document(k) for k in wanted]
+            return {snap.id: snap.to_dict() async for snap in self._client.get_all(refs)
+                    if snap.exists}
+
+        found = await _get_people(keys)
+        missing = [k for k in keys if k not in found]
+        resolved: Dict[str, List[str]] = {}
+        if missing:
+            alias_refs = [parent.collection("aliases").document(k) for k in missing]
+            async for snap in self._client.get_all(alias_refs):
+                if snap.exists:
+                    resolved[snap.id] = list((snap.to_dict() or {}).get("keys", []))
+            extra = list(dict.fromkeys(
+                ck for alias_keys in resolved.values() for ck in alias_keys if ck not in found))
+            if extra:
+                found.update(await _get_people(extra))
+        return _order_contact_matches(keys, found, resolved)
 
     async def upsert_contacts(self, user_id: str, doc: Dict[str, Any]) -> None:
-        doc_id = f"contacts_{user_id}"
-        doc["userId"] = user_id
-        doc["updatedAt"] = datetime.now(timezone.utc)
+        """Upsert every contact in doc["contacts"] into its own document."""
+        contacts = [c for c in doc.get("contacts") or []
+                    if _contact_key(c.get("name") or "")]
         if not self._client:
-            self._mem.contacts[doc_id] = doc
+            for c in contacts:
+                self._mem.put_contact(user_id, _contact_key(c["name"]), dict(c))
             return
-        await self._client.collection("contacts").document(doc_id).set(doc, merge=True)
+
+        await self._ensure_contacts_sharded(user_id)
+        parent = self._contacts_parent(user_id)
+        self._invalidate_contacts(user_id)
+        writer = _ChunkedWriter(self._client)
+        for c in contacts:
+            self._write_contact(writer, parent, _contact_key(c["name"]), c)
+        writer.set(parent, {"userId": user_id, "sharded": True,
+                            "updatedAt": datetime.now(timezone.utc)}, merge=True)
+        await writer.commit()
+        self._invalidate_contacts(user_id)
+
+    async def apply_contact_deltas(self, user_id: str, deltas: Dict[str, Dict[str, Any]]) -> int:
+        """Merge coalesced contact deltas (keyed by _contact_key) in one
+        transaction that touches only the affected contact documents.
+        Returns the number of contacts written."""
+        if not self._client:
+            people = self._mem.contacts.get(user_id) or {}
+            existing = {k: people[k] for k in deltas if k in people}
+            changed = _apply_contact_deltas(existing, deltas)
+            for key, contact in changed.items():
+                self._mem.put_contact(user_id, key, contact)
+            return len(changed)
+
+        await self._ensure_contacts_sharded(user_id)
+        parent = self._contacts_parent(user_id)
+        people = parent.collection("people")
+
+        @firestore.async_transactional
+        async def _txn(transaction) -> int:
+            refs = [people.document(k) for k in deltas]
+            existing = {snap.id: snap.to_dict()
+                        async for snap in self._client.get_all(refs, transaction=transaction)
+                        if snap.exists}
+            changed = _apply_contact_deltas(existing, deltas)
+            for key, contact in changed.items():
+                self._write_contact(transaction, parent, key, contact,
+                                    with_aliases=key not in existing)
+            return len(changed)
+
+        self._invalidate_contacts(user_id)
+        try:
+            return await _txn(self._client.transaction())
+        finally:
+            self._invalidate_contacts(user_id)
 
     # -------------------------------------------------------------------------
     # Hourly Summaries
@@ -483,19 +1381,37 @@ class FirestoreRepo:
         doc["hour"] = hour
         doc["createdAt"] = datetime.now(timezone.utc)
         if not self._client:
-            self._mem.hourly_summaries[doc_id] = doc
+            self._mem.put_hourly_summary(doc_id, user_id, date_str, hour, doc)
             return
         await self._client.collection("hourly_summaries").document(doc_id).set(doc)
 
+    async def get_hourly_partial(self, user_id: str, date_str: str, hour: int) -> Optional[Dict[str, Any]]:
+        doc_id = f"partial_{user_id}_{date_str}_{hour:02d}"
+        if not self._client:
+            return copy.deepcopy(self._mem.hourly_partials.get(doc_id))
+        snap = await self._client.collection("hourly_partials").document(doc_id).get()
+        return snap.to_dict() if snap.exists else None
+
+    async def put_hourly_partial(self, user_id: str, date_str: str, hour: int, doc: Dict[str, Any]) -> None:
+        doc_id = f"partial_{user_id}_{date_str}_{hour:02d}"
+        doc = {**doc, "userId": user_id, "date": date_str, "hour": hour,
+               "updatedAt": datetime.now(timezone.utc)}
+        if not self._client:
+            self._mem.hourly_partials[doc_id] = copy.deepcopy(doc)
+            return
+        await self._client.collection("hourly_partials").document(doc_id).set(doc)
+
+    async def delete_hourly_partial(self, user_id: str, date_str: str, hour: int) -> None:
+        doc_id = f"partial_{user_id}_{date_str}_{hour:02d}"
+        if not self._client:
+            self._mem.hourly_partials.pop(doc_id, None)
+            return
+        await self._client.collection("hourly_partials").document(doc_id).delete()
+
     async def list_hourly_summaries_for_date(self, user_id: str, date_str: str) -> List[Dict[str, Any]]:
         if not self._client:
-            out = []
-            prefix = f"hourly_{user_id}_{date_str}_"
-            for k, v in self._mem.hourly_summaries.items():
-                if k.startswith(prefix):
-                    out.append(v)
-            out.sort(key=lambda x: x.get("hour", 0))
-            return out
+            by_hour = self._mem.hourly_by_day.get((user_id, date_str), {})
+            return [by_hour[h] for h in sorted(by_hour)]
 
         q = (
             self._client.collection("hourly_summaries")
@@ -529,43 +1445,69 @@ class FirestoreRepo:
     # -------------------------------------------------------------------------
     # Recent Queries
     # -------------------------------------------------------------------------
-    async def get_recent_queries(self, user_id: str) -> Optional[Dict[str, Any]]:
-        doc_id = f"queries_{user_id}"
-        if not self._client:
-            return self._mem.processed_memories.get(("recent_queries", user_id))
-        snap = await self._client.collection("recent_queries").document(doc_id).get()
-        return snap.to_dict() if snap.exists else None
+    # Stored append-only: one document per query in
+    # recent_queries/queries_{user}/log, written without reading first. Each
+    # instance keeps a bounded ring of the newest queries per user for the
+    # hot "last 5/20" reads; with Firestore the ring is re-hydrated after
+    # USER_CACHE_TTL_SECONDS to pick up queries answered by other instances.
+    # Log entries carry `expireAt` for a Firestore TTL policy.
+    def _recent_log(self, user_id: str):
+        return (self._client.collection("recent_queries")
+                .document(f"queries_{user_id}").collection("log"))
+
+    async def _hydrate_recent_queries(self, user_id: str) -> Deque[Dict[str, Any]]:
+        q = (self._recent_log(user_id)
+             .order_by("timestamp", direction=firestore.Query.DESCENDING)
+             .limit(RECENT_QUERY_RING_SIZE))
+        fetched = [s.to_dict() async for s in q.stream()]
+        if not fetched:
+            # Users whose history predates the log: read the old array doc once
+            snap = await self._client.collection("recent_queries").document(f"queries_{user_id}").get()
+            if snap.exists:
+                fetched = (snap.to_dict() or {}).get("queries", [])
+
+        # Merge with anything appended locally while the read was in flight
+        merged: Dict[Any, Dict[str, Any]] = {}
+        for record in list(self._recent.get(user_id, ())) + fetched:
+            merged.setdefault(record.get("queryId") or id(record), record)
+        ordered = sorted(merged.values(),
+                         key=lambda r: _parse_iso_datetime(
+                             r.get("timestamp") or datetime.min.replace(tzinfo=timezone.utc)),
+                         reverse=True)
+        ring: Deque[Dict[str, Any]] = deque(
+            ordered[:RECENT_QUERY_RING_SIZE], maxlen=RECENT_QUERY_RING_SIZE)
+        self._recent[user_id] = ring
+        self._recent_loaded_at[user_id] = time.monotonic()
+        return ring
+
+    async def get_recent_queries(self, user_id: str, limit: int = RECENT_QUERY_RING_SIZE) -> Optional[Dict[str, Any]]:
+        """Newest-first recent queries as {"queries": [...]}, or None."""
+        ring = self._recent.get(user_id)
+        if self._client:
+            loaded_at = self._recent_loaded_at.get(user_id)
+            if loaded_at is None or time.monotonic() - loaded_at > USER_CACHE_TTL_SECONDS:
+                ring = await self._hydrate_recent_queries(user_id)
+        if not ring:
+            return None
+        return {"queries": [dict(r) for r in list(ring)[:limit]]}
 
     async def add_recent_query(self, user_id: str, query_record: Dict[str, Any]) -> None:
-        doc_id = f"queries_{user_id}"
         now = datetime.now(timezone.utc)
         query_record["timestamp"] = now
 
+        ring = self._recent.get(user_id)
+        if ring is None:
+            ring = deque(maxlen=RECENT_QUERY_RING_SIZE)
+            self._recent[user_id] = ring
+        ring.appendleft(query_record)
+
         if not self._client:
-            existing = self._mem.processed_memories.get(
-                ("recent_queries", user_id), {"queries": []})
-            existing["queries"].insert(0, query_record)
-            existing["queries"] = existing["queries"][:50]  # Keep last 50
-            existing["updatedAt"] = now
-            self._mem.processed_memories[(
-                "recent_queries", user_id)] = existing
             return
 
-        doc_ref = self._client.collection("recent_queries").document(doc_id)
-        snap = await doc_ref.get()
-        if snap.exists:
-            data = snap.to_dict()
-            queries = data.get("queries", [])
-        else:
-            queries = []
-
-        queries.insert(0, query_record)
-        queries = queries[:50]  # Keep last 50 queries
-
-        await doc_ref.set({
+        await self._recent_log(user_id).add({
+            **query_record,
             "userId": user_id,
-            "queries": queries,
-            "updatedAt": now
+            "expireAt": now + timedelta(days=RECENT_QUERY_RETENTION_DAYS),
         })
 
     # -------------------------------------------------------------------------
@@ -598,15 +1540,17 @@ class ConnectionManager:
         async with self._lock:
             bucket = self._ios if kind == "ios" else self._unity
             bucket.setdefault(user_id, set()).add(websocket)
+        WEBSOCKET_CONNECTIONS.inc(kind=kind)
         logger.info("WS connected kind=%s user=%s", kind, user_id)
 
     async def disconnect(self, kind: str, user_id: str, websocket: WebSocket) -> None:
         async with self._lock:
             bucket = self._ios if kind == "ios" else self._unity
-            if user_id in bucket:
+            if user_id in bucket and websocket in bucket[user_id]:
                 bucket[user_id].discard(websocket)
                 if not bucket[user_id]:
                     del bucket[user_id]
+                WEBSOCKET_CONNECTIONS.dec(kind=kind)
         logger.info("WS disconnected kind=%s user=%s", kind, user_id)
 
     async def send_json(self, websocket: WebSocket, data: Dict[str, Any]) -> None:
@@ -627,25 +1571,361 @@ class ConnectionManager:
         if dead:
             async with self._lock:
                 for ws in dead:
-                    self._unity.get(user_id, set()).discard(ws)
+                    conns = self._unity.get(user_id, set())
+                    if ws in conns:
+                        conns.discard(ws)
+                        WEBSOCKET_CONNECTIONS.dec(kind="unity")
 
 
 manager = ConnectionManager()
 
 
+# =============================================================================
+# MEDIA I/O (shared GCS and HTTP clients)
+# =============================================================================
+
+class MediaIO:
+    """Owns the process-wide GCS and HTTP clients used for all media I/O.
+
+    One `storage.Client` (its connection pool sized to `gcs_pool_size`) is
+    shared by every upload and download, and blocking GCS calls run on a
+    dedicated executor of the same size, so auth and TLS sessions are reused
+    instead of re-created per request. External URLs use one keep-alive
+    `httpx.AsyncClient`. Clients are created on startup, or lazily when used
+    outside the app lifecycle, and closed on shutdown.
+    """
+
+    def __init__(self, gcs_pool_size: int, gcs_timeout: float,
+                 http_max_connections: int, http_max_keepalive: int,
+                 http_timeout: float) -> None:
+        self.gcs_pool_size = max(1, gcs_pool_size)
+        self.gcs_timeout = gcs_timeout
+        self.http_max_connections = http_max_connections
+        self.http_max_keepalive = http_max_keepalive
+        self.http_timeout = http_timeout
+        self._storage = None
+        self._storage_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._stats: Dict[str, int] = {
+            "gcsUploads": 0, "gcsUploadChunks": 0, "gcsDownloads": 0,
+            "gcsMetadata": 0, "gcsSigned": 0, "httpRequests": 0, "errors": 0}
+
+    @property
+    def gcs_available(self) -> bool:
+        return storage is not None
+
+    # -------------------------------------------------------------------------
+    # Lifecycle
+    # -------------------------------------------------------------------------
+    def _storage_client(self):
+        if self._storage is None:
+            with self._storage_lock:
+                if self._storage is None:
+                    if storage is None:
+                        raise RuntimeError("google-cloud-storage is not installed")
+                    client = storage.Client(project=os.environ.get("GCP_PROJECT_ID"))
+                    try:
+                        import requests.adapters
+                        adapter = requests.adapters.HTTPAdapter(
+                            pool_connections=self.gcs_pool_size,
+                            pool_maxsize=self.gcs_pool_size)
+                        client._http.mount("https://", adapter)
+                    except Exception:
+                        logger.warning("Could not resize GCS connection pool", exc_info=True)
+                    self._storage = client
+        return self._storage
+
+    def _gcs_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.gcs_pool_size, thread_name_prefix="gcs")
+        return self._executor
+
+    def _http_client(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.http_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.http_max_connections,
+                    max_keepalive_connections=self.http_max_keepalive),
+                follow_redirects=True,
+            )
+        return self._http
+
+    def startup(self) -> None:
+        self._http_client()
+        self._gcs_executor()
+        if storage is not None:
+            try:
+                self._storage_client()
+            except Exception:
+                logger.exception("GCS client unavailable at startup; will retry on use")
+
+    async def shutdown(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._storage is not None:
+            close = getattr(self._storage, "close", None)
+            if close:
+                close()
+            self._storage = None
+
+    # -------------------------------------------------------------------------
+    # GCS
+    # -------------------------------------------------------------------------
+    async def _run(self, fn: Callable[..., Any], counter: str) -> Any:
+        loop = asyncio.get_running_loop()
+        self._stats[counter] += 1
+        try:
+            return await loop.run_in_executor(self._gcs_executor(), fn)
+        except Exception as e:
+            if not isinstance(e, GcsNotFound):
+                self._stats["errors"] += 1
+            raise
+
+    def blob(self, bucket_name: str, object_name: str):
+        return self._storage_client().bucket(bucket_name).blob(object_name)
+
+    async def upload_bytes(self, bucket_name: str, object_name: str, data: bytes,
+                           content_type: str, cache_control: Optional[str] = None) -> str:
+        """Upload `data` and return the object's public-style URL."""
+        def _upload() -> None:
+            blob = self.blob(bucket_name, object_name)
+            if cache_control:
+                blob.cache_control = cache_control
+            blob.upload_from_string(data, content_type=content_type,
+                                    timeout=self.gcs_timeout)
+        start = time.perf_counter()
+        await self._run(_upload, "gcsUploads")
+        GCS_UPLOAD_SECONDS.since(start, mode="single")
+        return f"https://storage.googleapis.com/{bucket_name}/{object_name}"
+
+    async def open_upload(self, bucket_name: str, object_name: str, content_type: str,
+                          chunk_size: int) -> "GcsUploadStream":
+        """Start a resumable upload that is fed chunk by chunk."""
+        def _open():
+            blob = self.blob(bucket_name, object_name)
+            return blob.open("wb", chunk_size=chunk_size, content_type=content_type,
+                             timeout=self.gcs_timeout)
+        writer = await self._run(_open, "gcsUploads")
+        return GcsUploadStream(self, writer,
+                               f"https://storage.googleapis.com/{bucket_name}/{object_name}")
+
+    async def download_bytes(self, bucket_name: str, object_name: str) -> Tuple[bytes, Optional[str]]:
+        """Object bytes and generation; raises GcsNotFound if missing."""
+        def _download() -> Tuple[bytes, Optional[str]]:
+            blob = self.blob(bucket_name, object_name)
+            data = blob.download_as_bytes(timeout=self.gcs_timeout)
+            return data, str(blob.generation) if blob.generation else None
+        return await self._run(_download, "gcsDownloads")
+
+    async def generation(self, bucket_name: str, object_name: str) -> Optional[str]:
+        def _reload() -> Optional[str]:
+            blob = self.blob(bucket_name, object_name)
+            blob.reload(timeout=self.gcs_timeout)
+            return str(blob.generation) if blob.generation else None
+        return await self._run(_reload, "gcsMetadata")
+
+    async def exists(self, bucket_name: str, object_name: str) -> bool:
+        return await self._run(
+            lambda: self.blob(bucket_name, object_name).exists(timeout=self.gcs_timeout),
+            "gcsMetadata")
+
+    async def sign_upload_url(self, bucket_name: str, object_name: str,
+                              content_type: str, ttl_seconds: int) -> str:
+        """V4 signed URL that lets a client PUT one object directly."""
+        def _sign() -> str:
+            blob = self.blob(bucket_name, object_name)
+            kwargs = dict(version="v4", expiration=timedelta(seconds=ttl_seconds),
+                          method="PUT", content_type=content_type)
+            try:
+                return blob.generate_signed_url(**kwargs)
+            except AttributeError:
+                # Token-only credentials (Cloud Run, GCE) have no private key;
+                # sign through the IAM signBlob API instead
+                import google.auth
+                import google.auth.transport.requests
+                creds, _ = google.auth.default()
+                creds.refresh(google.auth.transport.requests.Request())
+                return blob.generate_signed_url(
+                    service_account_email=creds.service_account_email,
+                    access_token=creds.token, **kwargs)
+        return await self._run(_sign, "gcsSigned")
+
+    # -------------------------------------------------------------------------
+    # HTTP
+    # -------------------------------------------------------------------------
+    async def http_get(self, url: str) -> Tuple[bytes, Optional[str]]:
+        """Body and ETag of an external URL."""
+        self._stats["httpRequests"] += 1
+        try:
+            resp = await self._http_client().get(url)
+            resp.raise_for_status()
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        return resp.content, resp.headers.get("etag")
+
+    async def http_etag(self, url: str) -> Optional[str]:
+        self._stats["httpRequests"] += 1
+        try:
+            resp = await self._http_client().head(url)
+            resp.raise_for_status()
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        return resp.headers.get("etag")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "gcsPoolSize": self.gcs_pool_size,
+            "httpMaxConnections": self.http_max_connections,
+            "gcsClientReady": self._storage is not None,
+        }
+
+
+class GcsUploadStream:
+    """One in-progress resumable upload.
+
+    The underlying BlobWriter holds at most one chunk and sends it as soon as
+    it fills, so memory stays bounded by the chunk size whatever the object
+    size. Only `close()` finalizes the object; `abort()` cancels the session
+    so a failed or oversized upload never becomes a (truncated) object.
+    """
+
+    def __init__(self, io_: MediaIO, writer: Any, url: str) -> None:
+        self._io = io_
+        self._writer = writer
+        self.url = url
+        self._started = time.perf_counter()
+
+    async def write(self, data: bytes) -> None:
+        await self._io._run(lambda: self._writer.write(data), "gcsUploadChunks")
+
+    async def close(self) -> str:
+        await self._io._run(self._writer.close, "gcsUploadChunks")
+        GCS_UPLOAD_SECONDS.since(self._started, mode="resumable")
+        return self.url
+
+    def _cancel(self, writer: Any) -> None:
+        # BlobWriter.close(), which IOBase.__del__ also calls, uploads
+        # whatever is buffered and finalizes the object unless the buffer is
+        # already closed. Close it first, then cancel the resumable session
+        # if a chunk already opened one.
+        session = getattr(writer, "_upload_and_transport", None)
+        buffer = getattr(writer, "_buffer", None)
+        if buffer is not None:
+            buffer.close()
+        if not session:
+            return
+        upload, transport = session
+        if upload.resumable_url and not upload.finished:
+            # GCS answers a cancelled session with 499
+            transport.request("DELETE", upload.resumable_url,
+                              timeout=self._io.gcs_timeout)
+
+    async def abort(self) -> None:
+        writer, self._writer = self._writer, None
+        if writer is None:
+            return
+        try:
+            await self._io._run(lambda: self._cancel(writer), "gcsUploads")
+        except Exception:
+            # The session still can't be finalized; GCS expires it
+            logger.warning("Failed to cancel resumable upload %s", self.url, exc_info=True)
+
+
+media_io = MediaIO(
+    gcs_pool_size=GCS_POOL_SIZE,
+    gcs_timeout=GCS_TIMEOUT_SECONDS,
+    http_max_connections=HTTP_MAX_CONNECTIONS,
+    http_max_keepalive=HTTP_MAX_KEEPALIVE,
+    http_timeout=HTTP_TIMEOUT_SECONDS,
+)
+
+
+@app.on_event("startup")
+async def _start_media_io() -> None:
+    media_io.startup()
+
+
+@app.on_event("shutdown")
+async def _stop_media_io() -> None:
+    await media_io.shutdown()
+
+
 # =============================================================================
 # TEXT-TO-SPEECH SERVICE
 # =============================================================================
 
+class ByteLRUCache:
+    """LRU mapping of key -> bytes, bounded by total size in bytes."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size_bytes -= len(old)
+        self._items[key] = value
+        self.size_bytes += len(value)
+        while self.size_bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size_bytes -= len(evicted)
+            self.evictions += 1
+
+    def pop(self, key: str) -> None:
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size_bytes -= len(old)
+
+
 class TTSService:
-    """Google Cloud Text-to-Speech service for generating audio from query responses."""
+    """Google Cloud Text-to-Speech service for generating audio from query responses.
+
+    Audio is content-addressed: the object name is a hash of the text, voice
+    and audio config, so an answer that was spoken before (clarification
+    prompts, "I couldn't find relevant information.", repeated answers) is
+    served from the existing object without another synthesis call. Recent
+    audio bytes are also kept in memory for the streaming path.
+    """
 
     MAX_TEXT_LENGTH = 5000
+    LANGUAGE_CODE = "en-US"
+    VOICE_NAME = "en-US-Neural2-F"
+    AUDIO_ENCODING = "MP3"
+    CACHE_PREFIX = "tts-cache"
 
     def __init__(self):
         self._client = None
         self._voice = None
         self._audio_config = None
+        self._audio_cache = ByteLRUCache(TTS_CACHE_MAX_BYTES)
+        # content key -> public URL of an object known to exist
+        self._url_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._stats: Dict[str, int] = {
+            "urlHits": 0, "storageHits": 0, "audioHits": 0, "syntheses": 0}
 
         if texttospeech is None:
             logger.warning(
@@ -655,14 +1935,16 @@ class TTSService:
         try:
             self._client = texttospeech.TextToSpeechClient()
             self._voice = texttospeech.VoiceSelectionParams(
-                language_code="en-US",
-                name="en-US-Neural2-F",
+                language_code=self.LANGUAGE_CODE,
+                name=self.VOICE_NAME,
                 ssml_gender=texttospeech.SsmlVoiceGender.FEMALE
             )
             self._audio_config = texttospeech.AudioConfig(
-                audio_encoding=texttospeech.AudioEncoding.MP3
+                audio_encoding=getattr(
+                    texttospeech.AudioEncoding, self.AUDIO_ENCODING)
             )
-            logger.info("TTS service initialized with voice en-US-Neural2-F")
+            logger.info("TTS service initialized with voice %s",
+                        self.VOICE_NAME)
         except Exception:
             logger.exception("Failed to initialize TTS client")
             self._client = None
@@ -671,6 +1953,46 @@ class TTSService:
     def is_available(self) -> bool:
         return self._client is not None
 
+    def _cache_key(self, text: str) -> str:
+        material = "\x1f".join(
+            (self.LANGUAGE_CODE, self.VOICE_NAME, self.AUDIO_ENCODING, text))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _remember_url(self, key: str, url: str) -> None:
+        self._url_cache[key] = url
+        self._url_cache.move_to_end(key)
+        while len(self._url_cache) > TTS_URL_CACHE_MAX_ENTRIES:
+            self._url_cache.popitem(last=False)
+
+    async def synthesize(self, text: str) -> Optional[bytes]:
+        """Synthesize MP3 audio for `text` without uploading it."""
+        if not self.is_available or not text or not text.strip():
+            return None
+
+        key = self._cache_key(text)
+        cached = self._audio_cache.get(key)
+        if cached is not None:
+            self._stats["audioHits"] += 1
+            return cached
+
+        # Synthesize speech (sync call wrapped in to_thread)
+        def _synthesize():
+            synthesis_input = texttospeech.SynthesisInput(text=text)
+            response = self._client.synthesize_speech(
+                input=synthesis_input,
+                voice=self._voice,
+                audio_config=self._audio_config
+            )
+            return response.audio_content
+
+        start = time.perf_counter()
+        audio_content = await asyncio.to_thread(_synthesize)
+        TTS_SYNTHESIS_SECONDS.since(start)
+        self._stats["syntheses"] += 1
+        if audio_content:
+            self._audio_cache.put(key, audio_content)
+        return audio_content
+
     async def generate_speech(self, text: str, query_id: str, user_id: str) -> Optional[str]:
         """
         Generate speech from text and upload to Cloud Storage.
@@ -691,22 +2013,14 @@ class TTSService:
                 logger.info("TTS text truncated to %d chars for query_id=%s",
                             self.MAX_TEXT_LENGTH, query_id)
 
-            # Synthesize speech (sync call wrapped in to_thread)
-            def _synthesize():
-                synthesis_input = texttospeech.SynthesisInput(text=text)
-                response = self._client.synthesize_speech(
-                    input=synthesis_input,
-                    voice=self._voice,
-                    audio_config=self._audio_config
-                )
-                return response.audio_content
-
-            audio_content = await asyncio.to_thread(_synthesize)
-
-            if not audio_content:
-                logger.warning(
-                    "TTS returned empty audio for query_id=%s", query_id)
-                return None
+            key = self._cache_key(text)
+            cached_url = self._url_cache.get(key)
+            if cached_url:
+                self._url_cache.move_to_end(key)
+                self._stats["urlHits"] += 1
+                logger.info("TTS cache hit: query_id=%s url=%s",
+                            query_id, cached_url)
+                return cached_url
 
             # Upload to Cloud Storage
             if storage is None:
@@ -715,21 +2029,26 @@ class TTSService:
                 return None
 
             bucket_name = PROCESSED_MEDIA_BUCKET
-            object_name = f"query-responses/{user_id}/{query_id}/response.mp3"
-
-            def _upload():
-                import io
-                client = storage.Client(
-                    project=os.environ.get("GCP_PROJECT_ID"))
-                bucket = client.bucket(bucket_name)
-                blob = bucket.blob(object_name)
-                # Use BytesIO to avoid any ACL operations with uniform bucket access
-                audio_file = io.BytesIO(audio_content)
-                blob.upload_from_file(
-                    audio_file, content_type="audio/mpeg", rewind=True)
-                return f"https://storage.googleapis.com/{bucket_name}/{object_name}"
-
-            public_url = await asyncio.to_thread(_upload)
+            object_name = f"{self.CACHE_PREFIX}/{key[:2]}/{key}.mp3"
+            public_url = f"https://storage.googleapis.com/{bucket_name}/{object_name}"
+
+            if await media_io.exists(bucket_name, object_name):
+                self._stats["storageHits"] += 1
+                self._remember_url(key, public_url)
+                logger.info("TTS object reused: query_id=%s url=%s",
+                            query_id, public_url)
+                return public_url
+
+            audio_content = await self.synthesize(text)
+
+            if not audio_content:
+                logger.warning(
+                    "TTS returned empty audio for query_id=%s", query_id)
+                return None
+
+            await media_io.upload_bytes(bucket_name, object_name, audio_content,
+                                        content_type="audio/mpeg")
+            self._remember_url(key, public_url)
 
             logger.info("TTS audio uploaded: query_id=%s url=%s",
                         query_id, public_url)
@@ -740,6 +2059,18 @@ class TTSService:
                 "TTS generation failed for query_id=%s: %s", query_id, e)
             return None
 
+    def stats(self) -> Dict[str, Any]:
+        hits = self._stats["urlHits"] + \
+            self._stats["storageHits"] + self._stats["audioHits"]
+        lookups = hits + self._stats["syntheses"]
+        return {
+            **self._stats,
+            "hitRate": round(hits / lookups, 3) if lookups else 0.0,
+            "audioCacheBytes": self._audio_cache.size_bytes,
+            "audioCacheEntries": len(self._audio_cache),
+            "urlCacheEntries": len(self._url_cache),
+        }
+
 
 tts_service = TTSService()
 
@@ -799,58 +2130,224 @@ async def test_gemini() -> Dict[str, Any]:
         return {"status": "error", "error": str(e)}
 
 
-@app.post("/upload/{capture_id}")
-async def upload_capture_media(capture_id: str, file: UploadFile = File(...)) -> Dict[str, Any]:
+# -----------------------------------------------------------------------------
+# Streaming proxy uploads
+# -----------------------------------------------------------------------------
+#
+# The proxy endpoints never hold a whole file: the request body is parsed
+# incrementally and the file field is forwarded to storage in
+# UPLOAD_CHUNK_BYTES pieces. Reading the next piece from the socket waits for
+# the previous chunk to be stored, so a slow bucket throttles the client
+# instead of filling memory.
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds its configured size limit."""
+
+
+class MultipartFileReader:
+    """Pulls one file field out of a multipart/form-data request as it arrives.
+
+    Bodies that aren't multipart are treated as the raw file, with the
+    request's Content-Type.
+    """
+
+    def __init__(self, request: Request, field_name: str = "file") -> None:
+        self._stream = request.stream().__aiter__()
+        self._field_name = field_name.encode("utf-8")
+        self._data: List[bytes] = []
+        self._eof = False
+        self._target_seen = False
+        self._target_done = False
+        self._in_target = False
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self.content_type: Optional[str] = None
+        self._parser = None
+
+        raw_type = request.headers.get("content-type", "")
+        if raw_type.startswith("multipart/"):
+            if MultipartParser is None:
+                raise RuntimeError("python-multipart is not installed")
+            _, params = parse_options_header(raw_type)
+            boundary = params.get(b"boundary")
+            if not boundary:
+                raise ValueError("multipart upload without a boundary")
+            self._parser = MultipartParser(boundary, callbacks={
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            })
+        else:
+            self.content_type = raw_type or None
+            self._target_seen = self._in_target = True
+
+    # Parser callbacks (called synchronously from parser.write)
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if not self._target_seen and options.get(b"name") == self._field_name:
+            self._target_seen = self._in_target = True
+            ctype = self._headers.get(b"content-type", b"").decode("latin-1").strip()
+            self.content_type = ctype or None
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_target:
+            self._data.append(bytes(data[start:end]))
+
+    def _on_part_end(self) -> None:
+        if self._in_target:
+            self._in_target = False
+            self._target_done = True
+
+    async def _feed(self) -> None:
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            self._eof = True
+            if self._parser is not None:
+                self._parser.finalize()
+            else:
+                self._target_done = True
+            return
+        if self._parser is not None:
+            self._parser.write(chunk)
+        elif chunk:
+            self._data.append(chunk)
+
+    async def open(self) -> Optional[str]:
+        """Read up to the start of the file field; returns its content type."""
+        while not self._target_seen:
+            if self._eof:
+                raise ValueError(
+                    f"missing '{self._field_name.decode()}' file field")
+            await self._feed()
+        return self.content_type
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yield the file's bytes as they arrive."""
+        await self.open()
+        while True:
+            if self._data:
+                data = b"".join(self._data)
+                self._data.clear()
+                yield data
+                continue
+            if self._target_done:
+                return
+            if self._eof:
+                raise ValueError("upload ended before the file was complete")
+            await self._feed()
+
+
+async def _stream_to_store(chunks: AsyncIterator[bytes], object_name: str,
+                           content_type: str, max_bytes: int) -> Tuple[str, int]:
+    """Copy `chunks` into the raw media store; returns (url, size)."""
+    writer = await media_store.open_writer(object_name, content_type)
+    total = 0
+    buf = bytearray()
     try:
-        if storage is None:
-            raise RuntimeError("google-cloud-storage is not installed")
+        async for data in chunks:
+            total += len(data)
+            if total > max_bytes:
+                raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+            buf += data
+            while len(buf) >= UPLOAD_CHUNK_BYTES:
+                await writer.write(bytes(buf[:UPLOAD_CHUNK_BYTES]))
+                del buf[:UPLOAD_CHUNK_BYTES]
+        if buf:
+            await writer.write(bytes(buf))
+        return await writer.close(), total
+    except BaseException:
+        await writer.abort()
+        raise
 
-        bucket_name = "reality-hack-2026-raw-media"
-        object_name = f"memories/{capture_id}/photo.jpg"
 
-        content = await file.read()
-        content_type = file.content_type or "image/jpeg"
+def _upload_limit(content_type: str) -> int:
+    return UPLOAD_MAX_VIDEO_BYTES if content_type.startswith("video/") else UPLOAD_MAX_IMAGE_BYTES
+
+
+def _declared_too_large(request: Request, max_bytes: int) -> bool:
+    # Multipart framing adds a little on top of the file itself
+    try:
+        length = int(request.headers.get("content-length", ""))
+    except ValueError:
+        return False
+    return length > max_bytes + 64 * 1024
 
-        def _upload() -> None:
-            client = storage.Client(project=os.environ.get("GCP_PROJECT_ID"))
-            bucket = client.bucket(bucket_name)
-            blob = bucket.blob(object_name)
-            blob.upload_from_string(content, content_type=content_type)
 
-        await asyncio.to_thread(_upload)
+def _capture_media_object(capture_id: str, content_type: str) -> str:
+    if content_type.startswith("video/"):
+        ext = mimetypes.guess_extension(content_type) or ".mp4"
+        return f"memories/{capture_id}/video{ext}"
+    return f"memories/{capture_id}/photo.jpg"
 
-        url = f"https://storage.googleapis.com/{bucket_name}/{object_name}"
+
+@app.post("/upload/{capture_id}")
+async def upload_capture_media(capture_id: str, request: Request) -> Dict[str, Any]:
+    """Stream a capture photo (or video clip) from a multipart `file` field."""
+    try:
+        if not _UPLOAD_ID_RE.match(capture_id):
+            return {"status": "error", "error": "invalid capture id"}
+        if _declared_too_large(request, max(UPLOAD_MAX_IMAGE_BYTES, UPLOAD_MAX_VIDEO_BYTES)):
+            return {"status": "error", "error": "upload too large"}
+
+        reader = MultipartFileReader(request)
+        content_type = await reader.open() or "image/jpeg"
+        if not content_type.startswith(("image/", "video/")):
+            content_type = "image/jpeg"
+        object_name = _capture_media_object(capture_id, content_type)
+
+        url, size = await _stream_to_store(
+            reader.chunks(), object_name, content_type, _upload_limit(content_type))
+        logger.info("[SEND_DATA] Uploaded capture media capture_id=%s bytes=%d type=%s",
+                    capture_id, size, content_type)
         return {"status": "success", "url": url, "captureId": capture_id}
+    except UploadTooLarge as e:
+        logger.warning("Upload rejected capture_id=%s: %s", capture_id, e)
+        return {"status": "error", "error": f"upload too large: {e}"}
     except Exception as e:
         logger.exception("Upload failed capture_id=%s", capture_id)
         return {"status": "error", "error": str(e)}
 
 
 @app.post("/query-upload/{query_id}")
-async def upload_query_image(query_id: str, file: UploadFile = File(...)) -> Dict[str, Any]:
+async def upload_query_image(query_id: str, request: Request) -> Dict[str, Any]:
     """Upload an image to be used with a query. Returns URL to reference in WebSocket query."""
     try:
-        if storage is None:
-            raise RuntimeError("google-cloud-storage is not installed")
+        if not _UPLOAD_ID_RE.match(query_id):
+            return {"status": "error", "error": "invalid query id"}
+        if _declared_too_large(request, UPLOAD_MAX_IMAGE_BYTES):
+            return {"status": "error", "error": "upload too large"}
 
-        bucket_name = "reality-hack-2026-raw-media"
+        reader = MultipartFileReader(request)
+        content_type = await reader.open() or "image/jpeg"
         object_name = f"queries/{query_id}/image.jpg"
 
-        content = await file.read()
-        content_type = file.content_type or "image/jpeg"
-
-        def _upload() -> None:
-            client = storage.Client(project=os.environ.get("GCP_PROJECT_ID"))
-            bucket = client.bucket(bucket_name)
-            blob = bucket.blob(object_name)
-            blob.upload_from_string(content, content_type=content_type)
-
-        await asyncio.to_thread(_upload)
-
-        url = f"https://storage.googleapis.com/{bucket_name}/{object_name}"
+        url, _ = await _stream_to_store(
+            reader.chunks(), object_name, content_type, UPLOAD_MAX_IMAGE_BYTES)
         logger.info(
             "[QUERY_DATA] Uploaded query image query_id=%s url=%s", query_id, url)
         return {"status": "success", "url": url, "queryId": query_id}
+    except UploadTooLarge as e:
+        logger.warning("Query image rejected query_id=%s: %s", query_id, e)
+        return {"status": "error", "error": f"upload too large: {e}"}
     except Exception as e:
         logger.exception("Query image upload failed query_id=%s", query_id)
         return {"status": "error", "error": str(e)}
@@ -872,6 +2369,356 @@ async def get_memories_for_date(user_id: str, date: str) -> Dict[str, Any]:
         return {"status": "error", "error": str(e)}
 
 
+# =============================================================================
+# DIRECT UPLOADS (signed URLs)
+# =============================================================================
+#
+# Clients ask for a short-lived signed URL, PUT the photo straight to the raw
+# media bucket, and the bucket's object-finalize notification (Pub/Sub push
+# or Eventarc) calls POST /upload-complete, which starts processing.
+#
+#   POST /upload-url/{capture_id}        -> memories/{capture_id}/photo.jpg
+#   POST /query-upload-url/{query_id}    -> queries/{query_id}/image.jpg
+#
+# MEDIA_STORE_BACKEND=local swaps GCS for a filesystem stand-in with the same
+# interface: its signed URLs point at PUT /local-upload/..., which stores the
+# file under LOCAL_MEDIA_DIR and fires the completion hook itself.
+
+class GcsMediaStore:
+    """Raw-media objects in RAW_MEDIA_BUCKET, through the shared MediaIO."""
+
+    def __init__(self, bucket_name: str) -> None:
+        self.bucket_name = bucket_name
+
+    def object_url(self, object_name: str) -> str:
+        return f"https://storage.googleapis.com/{self.bucket_name}/{object_name}"
+
+    async def sign_upload(self, object_name: str, content_type: str, ttl_seconds: int) -> str:
+        return await media_io.sign_upload_url(
+            self.bucket_name, object_name, content_type, ttl_seconds)
+
+    async def upload(self, object_name: str, data: bytes, content_type: str) -> str:
+        return await media_io.upload_bytes(
+            self.bucket_name, object_name, data, content_type=content_type)
+
+    async def open_writer(self, object_name: str, content_type: str) -> GcsUploadStream:
+        return await media_io.open_upload(
+            self.bucket_name, object_name, content_type, UPLOAD_CHUNK_BYTES)
+
+    async def download(self, object_name: str) -> Tuple[bytes, Optional[str]]:
+        return await media_io.download_bytes(self.bucket_name, object_name)
+
+    async def version(self, object_name: str) -> Optional[str]:
+        return await media_io.generation(self.bucket_name, object_name)
+
+
+class LocalMediaStore:
+    """Filesystem stand-in for GcsMediaStore, for local testing.
+
+    Object URLs keep the GCS form so the rest of the pipeline is unchanged;
+    signed URLs are HMAC-signed links to PUT /local-upload/{object_name}.
+    """
+
+    def __init__(self, root: str, bucket_name: str, public_base_url: str, secret: str) -> None:
+        self.root = os.path.abspath(root)
+        self.bucket_name = bucket_name
+        self.public_base_url = public_base_url.rstrip("/")
+        self._secret = (secret or uuid.uuid4().hex).encode("utf-8")
+
+    def object_url(self, object_name: str) -> str:
+        return f"https://storage.googleapis.com/{self.bucket_name}/{object_name}"
+
+    def _path(self, object_name: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, object_name))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"invalid object name: {object_name}")
+        return path
+
+    def _signature(self, object_name: str, expires: int, content_type: str) -> str:
+        msg = f"{object_name}\n{expires}\n{content_type}".encode("utf-8")
+        return hmac.new(self._secret, msg, hashlib.sha256).hexdigest()
+
+    def verify(self, object_name: str, expires: int, content_type: str, signature: str) -> bool:
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(
+            self._signature(object_name, expires, content_type), signature)
+
+    async def sign_upload(self, object_name: str, content_type: str, ttl_seconds: int) -> str:
+        expires = int(time.time()) + ttl_seconds
+        sig = self._signature(object_name, expires, content_type)
+        return (f"{self.public_base_url}/local-upload/{object_name}"
+                f"?expires={expires}&signature={sig}")
+
+    def _write(self, object_name: str, data: bytes) -> None:
+        path = self._path(object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    async def upload(self, object_name: str, data: bytes, content_type: str) -> str:
+        await asyncio.to_thread(self._write, object_name, data)
+        return self.object_url(object_name)
+
+    async def download(self, object_name: str) -> Tuple[bytes, Optional[str]]:
+        def _read() -> Tuple[bytes, Optional[str]]:
+            path = self._path(object_name)
+            with open(path, "rb") as f:
+                data = f.read()
+            return data, str(os.stat(path).st_mtime_ns)
+        return await asyncio.to_thread(_read)
+
+    async def version(self, object_name: str) -> Optional[str]:
+        try:
+            return str(os.stat(self._path(object_name)).st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    async def open_writer(self, object_name: str, content_type: str) -> "LocalUploadStream":
+        path = self._path(object_name)
+
+        def _open():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            return tmp, open(tmp, "wb")
+        tmp, f = await asyncio.to_thread(_open)
+        return LocalUploadStream(f, tmp, path, self.object_url(object_name))
+
+
+class LocalUploadStream:
+    """LocalMediaStore counterpart of GcsUploadStream: a temp file renamed
+    into place on close."""
+
+    def __init__(self, f: Any, tmp_path: str, path: str, url: str) -> None:
+        self._f = f
+        self._tmp_path = tmp_path
+        self._path = path
+        self.url = url
+
+    async def write(self, data: bytes) -> None:
+        await asyncio.to_thread(self._f.write, data)
+
+    async def close(self) -> str:
+        def _finish() -> None:
+            self._f.close()
+            os.replace(self._tmp_path, self._path)
+        await asyncio.to_thread(_finish)
+        return self.url
+
+    async def abort(self) -> None:
+        def _discard() -> None:
+            self._f.close()
+            try:
+                os.remove(self._tmp_path)
+            except FileNotFoundError:
+                pass
+        await asyncio.to_thread(_discard)
+
+
+def _make_media_store():
+    if MEDIA_STORE_BACKEND == "local":
+        logger.info("Using local media store at %s", LOCAL_MEDIA_DIR)
+        return LocalMediaStore(LOCAL_MEDIA_DIR, RAW_MEDIA_BUCKET,
+                               PUBLIC_BASE_URL, UPLOAD_HOOK_TOKEN)
+    if not UPLOAD_HOOK_TOKEN and not UPLOAD_HOOK_OIDC_AUDIENCE:
+        logger.warning("Neither UPLOAD_HOOK_TOKEN nor UPLOAD_HOOK_OIDC_AUDIENCE is set; "
+                       "POST /upload-complete will reject every call")
+    return GcsMediaStore(RAW_MEDIA_BUCKET)
+
+
+media_store = _make_media_store()
+
+_UPLOAD_CAPTURE_RE = re.compile(r"^memories/([^/]+)/photo\.jpg$")
+_UPLOAD_QUERY_RE = re.compile(r"^queries/([^/]+)/image\.jpg$")
+_UPLOAD_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+class UploadUrlRequest(BaseModel):
+    contentType: str = "image/jpeg"
+
+
+async def _signed_upload_response(object_name: str, content_type: str) -> Dict[str, Any]:
+    upload_url = await media_store.sign_upload(
+        object_name, content_type, SIGNED_URL_TTL_SECONDS)
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=SIGNED_URL_TTL_SECONDS)
+    return {
+        "status": "success",
+        "uploadURL": upload_url,
+        "method": "PUT",
+        "headers": {"Content-Type": content_type},
+        "url": media_store.object_url(object_name),
+        "expiresAt": expires_at.isoformat(),
+    }
+
+
+@app.post("/upload-url/{capture_id}")
+async def create_capture_upload_url(capture_id: str, request: Optional[UploadUrlRequest] = None) -> Dict[str, Any]:
+    """Signed URL for uploading a capture photo straight to storage."""
+    try:
+        if not _UPLOAD_ID_RE.match(capture_id):
+            return {"status": "error", "error": "invalid capture id"}
+        content_type = (request or UploadUrlRequest()).contentType
+        resp = await _signed_upload_response(f"memories/{capture_id}/photo.jpg", content_type)
+        return {**resp, "captureId": capture_id}
+    except Exception as e:
+        logger.exception("Signing upload URL failed capture_id=%s", capture_id)
+        return {"status": "error", "error": str(e)}
+
+
+@app.post("/query-upload-url/{query_id}")
+async def create_query_upload_url(query_id: str, request: Optional[UploadUrlRequest] = None) -> Dict[str, Any]:
+    """Signed URL for uploading a query image straight to storage."""
+    try:
+        if not _UPLOAD_ID_RE.match(query_id):
+            return {"status": "error", "error": "invalid query id"}
+        content_type = (request or UploadUrlRequest()).contentType
+        resp = await _signed_upload_response(f"queries/{query_id}/image.jpg", content_type)
+        return {**resp, "queryId": query_id}
+    except Exception as e:
+        logger.exception("Signing upload URL failed query_id=%s", query_id)
+        return {"status": "error", "error": str(e)}
+
+
+async def _on_upload_complete(object_name: str) -> Dict[str, Any]:
+    """React to a finished upload.
+
+    Capture photos (re)start processing if the capture is waiting or was
+    analyzed without its image; query images are preprocessed ahead of the
+    query so the answer path finds the derivative cached.
+    """
+    url = media_store.object_url(object_name)
+    # May overwrite an earlier upload; don't trust its cached version
+    media_cache.invalidate(url)
+    m = _UPLOAD_CAPTURE_RE.match(object_name)
+    if m:
+        capture_id = m.group(1)
+        capture = await repo.get_capture(capture_id)
+        if not capture:
+            # Photo landed before the capture message; ws_ios will enqueue it
+            return {"action": "none", "captureId": capture_id}
+        analysis = capture.get("geminiAnalysis") or {}
+        if capture.get("processed") and analysis.get("imageAnalyzed", True):
+            return {"action": "none", "captureId": capture_id}
+        if not capture.get("photoURL"):
+            await repo.update_capture(capture_id, {"photoURL": url})
+        job = CaptureJob(capture["userId"], capture_id,
+                         _parse_iso_datetime(capture.get("timestamp")))
+        try:
+            if await capture_queue.put(job):
+                action = "queued"
+            else:
+                # Already queued or running: a running pass may have read the
+                # capture before the photo existed, so ask for another one
+                action = await capture_queue.rerun(job)
+        except CaptureQueueFull:
+            # Still processed=False; the recovery sweep will pick it up
+            action = "pending"
+        return {"action": action, "captureId": capture_id}
+
+    m = _UPLOAD_QUERY_RE.match(object_name)
+    if m:
+        task = asyncio.create_task(_download_image_as_base64(url))
+        _upload_warmups.add(task)
+        task.add_done_callback(_upload_warmups.discard)
+        return {"action": "warming", "queryId": m.group(1)}
+    return {"action": "ignored"}
+
+
+_upload_warmups: Set[asyncio.Task] = set()
+
+
+def _verify_push_token(token: str) -> bool:
+    """Check a Pub/Sub push OIDC token (runs in a worker thread)."""
+    if google_id_token is None or google_auth_requests is None:
+        logger.warning("google-auth not available; cannot verify push token")
+        return False
+    try:
+        claims = google_id_token.verify_oauth2_token(
+            token, google_auth_requests.Request(), audience=UPLOAD_HOOK_OIDC_AUDIENCE)
+    except Exception as e:
+        logger.warning("Rejected upload hook push token: %s", e)
+        return False
+    if UPLOAD_HOOK_OIDC_EMAIL:
+        return (claims.get("email") == UPLOAD_HOOK_OIDC_EMAIL
+                and bool(claims.get("email_verified")))
+    return True
+
+
+async def _upload_hook_authorized(request: Request) -> bool:
+    """Shared token, or a Pub/Sub push OIDC token for the configured
+    audience. With neither configured only the local backend is open."""
+    if UPLOAD_HOOK_TOKEN:
+        supplied = (request.query_params.get("token")
+                    or request.headers.get("x-upload-hook-token") or "")
+        if supplied and hmac.compare_digest(supplied, UPLOAD_HOOK_TOKEN):
+            return True
+    if UPLOAD_HOOK_OIDC_AUDIENCE:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            return await asyncio.to_thread(_verify_push_token, token.strip())
+    if not UPLOAD_HOOK_TOKEN and not UPLOAD_HOOK_OIDC_AUDIENCE:
+        return isinstance(media_store, LocalMediaStore)
+    return False
+
+
+@app.post("/upload-complete")
+async def upload_complete(request: Request) -> Dict[str, Any]:
+    """Completion hook for finished direct uploads.
+
+    Accepts a GCS object-finalize notification delivered by Pub/Sub push
+    ({"message": {"data": base64 JSON, "attributes": {...}}}), an Eventarc /
+    plain object resource ({"bucket", "name"}), or a client call with
+    {"objectName"} after its PUT succeeds.
+    """
+    if not await _upload_hook_authorized(request):
+        return {"status": "error", "error": "unauthorized"}
+    try:
+        body = await request.json()
+        message = body.get("message") if isinstance(body, dict) else None
+        if message:
+            attrs = message.get("attributes") or {}
+            if attrs.get("eventType") and attrs["eventType"] != "OBJECT_FINALIZE":
+                return {"status": "success", "action": "ignored"}
+            payload = json.loads(base64.b64decode(message.get("data") or "e30=") or "{}")
+            bucket = payload.get("bucket") or attrs.get("bucketId")
+            name = payload.get("name") or attrs.get("objectId")
+        else:
+            bucket = body.get("bucket", RAW_MEDIA_BUCKET)
+            name = body.get("name") or body.get("objectName")
+        if bucket != RAW_MEDIA_BUCKET or not name:
+            return {"status": "success", "action": "ignored"}
+        result = await _on_upload_complete(name)
+        logger.info("Upload complete object=%s action=%s", name, result.get("action"))
+        return {"status": "success", **result}
+    except Exception as e:
+        logger.exception("Upload completion hook failed")
+        return {"status": "error", "error": str(e)}
+
+
+@app.put("/local-upload/{object_name:path}")
+async def local_upload(object_name: str, request: Request) -> Dict[str, Any]:
+    """Target of LocalMediaStore signed URLs (MEDIA_STORE_BACKEND=local)."""
+    if not isinstance(media_store, LocalMediaStore):
+        return {"status": "error", "error": "local media store is not enabled"}
+    try:
+        expires = int(request.query_params.get("expires", "0"))
+    except ValueError:
+        expires = 0
+    content_type = request.headers.get("content-type", "")
+    if not media_store.verify(object_name, expires, content_type,
+                              request.query_params.get("signature", "")):
+        return {"status": "error", "error": "invalid or expired signature"}
+    try:
+        await _stream_to_store(request.stream(), object_name, content_type,
+                               _upload_limit(content_type))
+    except UploadTooLarge as e:
+        return {"status": "error", "error": f"upload too large: {e}"}
+    result = await _on_upload_complete(object_name)
+    return {"status": "success", "url": media_store.object_url(object_name), **result}
+
+
 # =============================================================================
 # USER INITIALIZATION ENDPOINT
 # =============================================================================
@@ -927,6 +2774,7 @@ async def init_user(user_id: str, request: UserInitRequest) -> Dict[str, Any]:
             await repo.upsert_contacts(user_id, {"contacts": contacts_list})
         else:
             await repo.upsert_contacts(user_id, {"contacts": []})
+        answer_cache.invalidate(user_id, "profile", "contacts")
 
         logger.info("Initialized user profile for user_id=%s", user_id)
         return {
@@ -968,28 +2816,6 @@ async def get_user_contacts(user_id: str) -> Dict[str, Any]:
 # GEMINI HELPER FUNCTIONS
 # =============================================================================
 
-def _get_gemini_model():
-    """Configure the genai SDK and return the configured model identifier or
-    raise a helpful error if configuration is missing.
-
-    Note: newer versions of the `google.generativeai` SDK expose different
-    idioms for calling models. Callers should use the returned model name and
-    an adapter-based call helper implemented below.
-    """
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY not set")
-    if genai is None:
-        raise RuntimeError("google-generativeai not installed")
-    # Ensure SDK is configured (safe to call repeatedly)
-    try:
-        genai.configure(api_key=api_key)
-    except Exception:
-        # Older/newer SDKs may raise on configure; ignore and let adapter handle it
-        pass
-    return GEMINI_MODEL
-
-
 def _parse_json_response(text: str) -> Dict[str, Any]:
     text = text.strip()
     if text.startswith("```"):
@@ -1000,161 +2826,1485 @@ def _parse_json_response(text: str) -> Dict[str, Any]:
         return json.loads(text)
     except json.JSONDecodeError:
         match = re.search(r'\{.*\}', text, re.DOTALL)
-        if match:
-            return json.loads(match.group())
-        raise
+        try:
+            if not match:
+                raise
+            parsed = json.loads(match.group())
+        except json.JSONDecodeError:
+            JSON_PARSE_FAILURES.inc(outcome="failed")
+            raise
+        JSON_PARSE_FAILURES.inc(outcome="recovered")
+        return parsed
 
 
-async def _download_image_as_base64(url: str) -> Optional[str]:
-    """Download image and return as base64. Uses GCS SDK for private bucket URLs."""
-    try:
-        # Check if this is a GCS URL for our private bucket
-        gcs_prefix = f"https://storage.googleapis.com/{RAW_MEDIA_BUCKET}/"
-        if url.startswith(gcs_prefix):
-            # Use authenticated GCS SDK for private bucket
-            if storage is None:
-                logger.error(
-                    "google-cloud-storage not installed, cannot download from private bucket")
+# =============================================================================
+# MEDIA CACHE
+# =============================================================================
+
+MediaLoader = Callable[[], Awaitable[Tuple[bytes, Optional[str]]]]
+MediaVersionCheck = Callable[[], Awaitable[Optional[str]]]
+
+
+class MediaCache:
+    """Byte-bounded cache for downloaded media, keyed by URL plus version.
+
+    The version is the GCS object generation or the HTTP ETag. A URL's
+    known version is trusted for `revalidate_seconds`; after that a cheap
+    metadata request confirms it before cached bytes are served again.
+    Entries without a version check are treated as immutable. Recent bytes
+    live in memory (`max_bytes`); with `disk_dir` set, a second LRU tier of
+    up to `disk_max_bytes` keeps them across restarts; its index is shared
+    with the worker threads doing disk I/O and guarded by a lock. Concurrent
+    requests for the same key share one download; if that download is
+    cancelled, the waiters load it themselves.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: str, disk_max_bytes: int,
+                 revalidate_seconds: float, max_urls: int = 20000) -> None:
+        self.revalidate_seconds = revalidate_seconds
+        self.max_urls = max_urls
+        self._mem = ByteLRUCache(max_bytes)
+        self._versions: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._disk_dir = disk_dir or None
+        self._disk_max_bytes = disk_max_bytes
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+        self._stats: Dict[str, int] = {
+            "memoryHits": 0, "diskHits": 0, "misses": 0, "dedupedWaits": 0,
+            "revalidations": 0, "staleEntries": 0, "bytesServed": 0,
+            "bytesDownloaded": 0, "diskEvictions": 0, "errors": 0}
+        if self._disk_dir:
+            self._load_disk_index()
+
+    # -------------------------------------------------------------------------
+    # Disk tier
+    # -------------------------------------------------------------------------
+    def _load_disk_index(self) -> None:
+        try:
+            os.makedirs(self._disk_dir, exist_ok=True)
+            entries = []
+            for name in os.listdir(self._disk_dir):
+                path = os.path.join(self._disk_dir, name)
+                if name.endswith(".tmp"):
+                    os.remove(path)
+                    continue
+                st = os.stat(path)
+                entries.append((st.st_mtime, name, st.st_size))
+            for _, name, size in sorted(entries):
+                self._disk[name] = size
+                self._disk_bytes += size
+            logger.info("Media disk cache at %s: %d files, %d bytes",
+                        self._disk_dir, len(self._disk), self._disk_bytes)
+        except Exception:
+            logger.exception("Media disk cache unavailable at %s", self._disk_dir)
+            self._disk_dir = None
+
+    @staticmethod
+    def _disk_name(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    # Both run in worker threads; file reads and writes happen outside the
+    # lock, index updates (and the rename/removals they describe) inside it.
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        name = self._disk_name(key)
+        with self._disk_lock:
+            if name not in self._disk:
                 return None
+        try:
+            with open(os.path.join(self._disk_dir, name), "rb") as f:
+                data = f.read()
+        except OSError:
+            # Evicted (or removed externally) since the index check
+            with self._disk_lock:
+                self._disk_bytes -= self._disk.pop(name, 0)
+            return None
+        with self._disk_lock:
+            if name in self._disk:
+                self._disk.move_to_end(name)
+        return data
 
-            object_name = url[len(gcs_prefix):]
+    def _disk_put(self, key: str, data: bytes) -> None:
+        if len(data) > self._disk_max_bytes:
+            return
+        name = self._disk_name(key)
+        path = os.path.join(self._disk_dir, name)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        with self._disk_lock:
+            os.replace(tmp, path)
+            self._disk_bytes += len(data) - self._disk.pop(name, 0)
+            self._disk[name] = len(data)
+            while self._disk_bytes > self._disk_max_bytes and self._disk:
+                evicted, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self._stats["diskEvictions"] += 1
+                try:
+                    os.remove(os.path.join(self._disk_dir, evicted))
+                except OSError:
+                    pass
 
-            def _download_blob() -> bytes:
-                client = storage.Client(
-                    project=os.environ.get("GCP_PROJECT_ID"))
-                bucket = client.bucket(RAW_MEDIA_BUCKET)
-                blob = bucket.blob(object_name)
-                return blob.download_as_bytes()
+    # -------------------------------------------------------------------------
+    # Lookup
+    # -------------------------------------------------------------------------
+    def _remember_version(self, url: str, version: Optional[str]) -> None:
+        self._versions[url] = (version, time.monotonic())
+        self._versions.move_to_end(url)
+        while len(self._versions) > self.max_urls:
+            self._versions.popitem(last=False)
+
+    def invalidate(self, url: str) -> None:
+        """Forget the known version of `url` (e.g. it was just re-uploaded),
+        so the next lookup checks it again."""
+        known = self._versions.pop(url, None)
+        if known is not None:
+            self._mem.pop(f"{url}#{known[0]}")
+
+    async def version(self, url: str, check_version: MediaVersionCheck) -> Optional[str]:
+        """Current version of `url`, trusting a known one for
+        `revalidate_seconds` like `get` does."""
+        known = self._versions.get(url)
+        if known is not None and time.monotonic() - known[1] <= self.revalidate_seconds:
+            return known[0]
+        if known is not None:
+            self._stats["revalidations"] += 1
+        version = await check_version()
+        if known is not None and known[0] != version:
+            self._stats["staleEntries"] += 1
+            self._mem.pop(f"{url}#{known[0]}")
+        self._remember_version(url, version)
+        return version
+
+    async def get(self, url: str, load: MediaLoader,
+                  check_version: Optional[MediaVersionCheck] = None) -> bytes:
+        """Cached bytes for `url`; `load` returns (bytes, version) on a miss."""
+        fut = self._inflight.get(url)
+        while fut is not None:
+            self._stats["dedupedWaits"] += 1
+            try:
+                return await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                if not fut.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            # The leader was cancelled; take over (or join a newer leader)
+            fut = self._inflight.get(url)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[url] = fut
+        try:
+            data = await self._get(url, load, check_version)
+            fut.set_result(data)
+            return data
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            # Mark retrieved so a failure nobody else awaited isn't logged
+            fut.exception()
+            raise
+        finally:
+            self._inflight.pop(url, None)
+
+    async def _get(self, url: str, load: MediaLoader,
+                   check_version: Optional[MediaVersionCheck]) -> bytes:
+        known = self._versions.get(url)
+        if known is not None:
+            version, checked_at = known
+            if check_version is not None and time.monotonic() - checked_at > self.revalidate_seconds:
+                self._stats["revalidations"] += 1
+                try:
+                    current = await check_version()
+                except Exception:
+                    logger.warning("Media revalidation failed for %s", url, exc_info=True)
+                    current = None
+                if current != version:
+                    self._stats["staleEntries"] += 1
+                    self._mem.pop(f"{url}#{version}")
+                    known = None
+                else:
+                    self._remember_version(url, version)
+
+        if known is not None:
+            key = f"{url}#{known[0]}"
+            data = self._mem.get(key)
+            if data is not None:
+                self._stats["memoryHits"] += 1
+                self._stats["bytesServed"] += len(data)
+                return data
+            if self._disk_dir:
+                data = await asyncio.to_thread(self._disk_get, key)
+                if data is not None:
+                    self._stats["diskHits"] += 1
+                    self._stats["bytesServed"] += len(data)
+                    self._mem.put(key, data)
+                    return data
+
+        self._stats["misses"] += 1
+        data, version = await load()
+        key = f"{url}#{version}"
+        self._stats["bytesDownloaded"] += len(data)
+        self._remember_version(url, version)
+        self._mem.put(key, data)
+        if self._disk_dir:
+            try:
+                await asyncio.to_thread(self._disk_put, key, data)
+            except Exception:
+                self._stats["errors"] += 1
+                logger.warning("Media disk cache write failed", exc_info=True)
+        return data
 
-            content = await asyncio.to_thread(_download_blob)
-            return base64.b64encode(content).decode("utf-8")
-        else:
-            # External URL - use httpx (unauthenticated)
-            async with httpx.AsyncClient(timeout=30) as client:
-                resp = await client.get(url)
-                resp.raise_for_status()
-                return base64.b64encode(resp.content).decode("utf-8")
-    except Exception as e:
-        logger.warning("Failed to download image %s: %s", url, e)
-        return None
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "memoryBytes": self._mem.size_bytes,
+            "memoryEntries": len(self._mem),
+            "memoryEvictions": self._mem.evictions,
+            "diskBytes": self._disk_bytes,
+            "diskEntries": len(self._disk),
+            "inflight": len(self._inflight),
+        }
 
 
-async def _call_gemini_with_image(prompt: str, image_base64: Optional[str] = None) -> Dict[str, Any]:
-    # Reuse the unified adapter which attempts to call either the old
-    # `GenerativeModel` API or the newer `genai.models.generate` / `genai.generate`
-    text = await _call_gemini_raw(prompt, image_base64)
-    return _parse_json_response(text)
+media_cache = MediaCache(
+    max_bytes=MEDIA_CACHE_MAX_BYTES,
+    disk_dir=MEDIA_CACHE_DIR,
+    disk_max_bytes=MEDIA_CACHE_DISK_MAX_BYTES,
+    revalidate_seconds=MEDIA_CACHE_REVALIDATE_SECONDS,
+)
 
 
-async def _call_gemini_text(prompt: str) -> Dict[str, Any]:
-    text = await _call_gemini_raw(prompt, None)
-    return _parse_json_response(text)
+# =============================================================================
+# MEDIA PREPROCESSING
+# =============================================================================
+
+def _raw_object_name(url: str) -> Optional[str]:
+    gcs_prefix = f"https://storage.googleapis.com/{RAW_MEDIA_BUCKET}/"
+    return url[len(gcs_prefix):] if url.startswith(gcs_prefix) else None
+
+
+async def _download_media_bytes(url: str) -> bytes:
+    """Download media bytes through the media cache. Uses GCS SDK for
+    private bucket URLs."""
+    object_name = _raw_object_name(url)
+    if object_name is not None:
+        # Private raw-media bucket (or its local stand-in)
+        return await media_cache.get(
+            url,
+            lambda: media_store.download(object_name),
+            lambda: media_store.version(object_name))
 
+    # External URL - shared keep-alive httpx client (unauthenticated)
+    return await media_cache.get(
+        url, lambda: media_io.http_get(url), lambda: media_io.http_etag(url))
 
-async def _call_gemini_raw(prompt: str, image_base64: Optional[str] = None) -> str:
-    """Call the installed `google.generativeai` SDK using a best-effort
-    adapter that supports both older and newer SDK call patterns.
 
-    Returns the raw text response (not JSON-parsed). The caller will parse
-    JSON as needed.
+class ImagePreprocessor:
+    """Produces model-sized JPEG derivatives of images sent to Gemini.
+
+    The first request for an image downloads the original, downscales it to
+    `max_dimension` and re-encodes it at `quality`, then stores the result in
+    PROCESSED_MEDIA_BUCKET under a path that includes both settings and the
+    source's version (GCS generation or ETag), since photos can be
+    re-uploaded in place. Later requests download only the derivative. Without Pillow (or with
+    IMAGE_PREPROCESS_ENABLED off) the original bytes are used unchanged.
     """
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY not set")
-    if genai is None:
-        raise RuntimeError("google-generativeai not installed")
-
-    def _call():
-        # Ensure SDK configured
+
+    PREFIX = "derived"
+
+    def __init__(self, max_dimension: int, quality: int, enabled: bool) -> None:
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.enabled = enabled and Image is not None
+        if enabled and Image is None:
+            logger.warning("Pillow not available; sending original images to Gemini")
+        self._stats: Dict[str, int] = {
+            "derivativeHits": 0, "derivativesCreated": 0, "passthrough": 0,
+            "errors": 0, "originalBytes": 0, "derivativeBytes": 0}
+
+    def derivative_name(self, url: str, source_version: Optional[str] = None) -> str:
+        object_name = _raw_object_name(url)
+        if object_name is not None:
+            stem = object_name.rsplit(".", 1)[0]
+        else:
+            stem = "external/" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+        if source_version:
+            # Generations are digits; ETags may carry quotes or slashes
+            stem += "." + (re.sub(r"[^A-Za-z0-9_-]", "", source_version)[:64]
+                           or hashlib.sha256(source_version.encode("utf-8")).hexdigest()[:16])
+        return f"{self.PREFIX}/{self.max_dimension}q{self.quality}/{stem}.jpg"
+
+    @staticmethod
+    def _source_version_check(url: str) -> MediaVersionCheck:
+        object_name = _raw_object_name(url)
+        if object_name is not None:
+            return lambda: media_store.version(object_name)
+        return lambda: media_io.http_etag(url)
+
+    def shrink(self, content: bytes) -> bytes:
+        """Downscale and re-encode as JPEG; keeps the original if that is
+        already smaller."""
+        with Image.open(io.BytesIO(content)) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=self.quality, optimize=True)
+        derived = out.getvalue()
+        return derived if len(derived) < len(content) else content
+
+    async def _get_derivative(self, name: str) -> Optional[bytes]:
         try:
-            genai.configure(api_key=api_key)
+            data, _ = await media_io.download_bytes(PROCESSED_MEDIA_BUCKET, name)
+            return data
+        except GcsNotFound:
+            return None
+
+    async def _put_derivative(self, name: str, content: bytes) -> None:
+        await media_io.upload_bytes(
+            PROCESSED_MEDIA_BUCKET, name, content, content_type="image/jpeg",
+            cache_control="public, max-age=31536000, immutable")
+
+    async def model_image(self, url: str) -> bytes:
+        """Bytes to send to the model for `url`."""
+        if not self.enabled or storage is None:
+            self._stats["passthrough"] += 1
+            return await _download_media_bytes(url)
+
+        try:
+            source_version = await media_cache.version(
+                url, self._source_version_check(url))
         except Exception:
-            pass
+            logger.warning("Version check failed for %s", url, exc_info=True)
+            source_version = None
+        name = self.derivative_name(url, source_version)
+        cache_url = f"gs://{PROCESSED_MEDIA_BUCKET}/{name}"
 
-        # 1) Old style: genai.GenerativeModel(...).generate_content(...)
-        if hasattr(genai, "GenerativeModel"):
+        async def _load() -> Tuple[bytes, Optional[str]]:
+            # The path includes the source version, so it is immutable
+            return await self._produce(url, name), None
+
+        return await media_cache.get(cache_url, _load)
+
+    async def _produce(self, url: str, name: str) -> bytes:
+        try:
+            cached = await self._get_derivative(name)
+        except Exception:
+            logger.warning("Derivative lookup failed for %s", name, exc_info=True)
+            cached = None
+        if cached is not None:
+            self._stats["derivativeHits"] += 1
+            return cached
+
+        original = await _download_media_bytes(url)
+        try:
+            derived = await asyncio.to_thread(self.shrink, original)
+        except Exception:
+            # Not an image Pillow can read; let Gemini have the original
+            self._stats["errors"] += 1
+            logger.warning("Could not preprocess image %s", url, exc_info=True)
+            return original
+        self._stats["derivativesCreated"] += 1
+        self._stats["originalBytes"] += len(original)
+        self._stats["derivativeBytes"] += len(derived)
+        try:
+            await self._put_derivative(name, derived)
+        except Exception:
+            logger.warning("Failed to store derivative %s", name, exc_info=True)
+        return derived
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "enabled": self.enabled,
+                "maxDimension": self.max_dimension, "quality": self.quality}
+
+
+image_preprocessor = ImagePreprocessor(
+    max_dimension=IMAGE_MAX_DIMENSION,
+    quality=IMAGE_JPEG_QUALITY,
+    enabled=IMAGE_PREPROCESS_ENABLED,
+)
+
+
+async def _download_image_as_base64(url: str) -> Optional[str]:
+    """Download the model-sized version of an image and return it as base64."""
+    try:
+        content = await image_preprocessor.model_image(url)
+        return base64.b64encode(content).decode("utf-8")
+    except Exception as e:
+        logger.warning("Failed to download image %s: %s", url, e)
+        return None
+
+
+# =============================================================================
+# GEMINI GATEWAY
+# =============================================================================
+# One long-lived object owns the SDK: it configures `genai` once, picks the
+# SDK call shape at startup (older `GenerativeModel`, newer
+# `genai.models.generate`, or `genai.generate`), caches model objects and runs
+# every call on its own thread pool behind a global and a per-purpose
+# semaphore, so background capture/condensation work can't crowd out the
+# interactive queries.
+#
+# In front of the SDK sits a small scheduler: a token bucket sized to the
+# project quota hands out tokens by purpose priority (query > capture >
+# condense), transient failures (429, 5xx, timeouts) are retried with
+# full-jitter backoff, slow interactive calls can be hedged, and a circuit
+# breaker sheds background calls while upstream keeps failing.
+
+GEMINI_PURPOSE_CAPTURE = "capture"
+GEMINI_PURPOSE_QUERY = "query"
+GEMINI_PURPOSE_CONDENSE = "condense"
+
+# Lower is served first
+GEMINI_PRIORITIES = {
+    GEMINI_PURPOSE_QUERY: 0,
+    GEMINI_PURPOSE_CAPTURE: 1,
+    GEMINI_PURPOSE_CONDENSE: 2,
+}
+
+_GEMINI_RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+_GEMINI_RATE_LIMIT_ERRORS = tuple(
+    getattr(google_exceptions, name) for name in ("ResourceExhausted", "TooManyRequests")
+    if google_exceptions is not None and hasattr(google_exceptions, name))
+_GEMINI_TRANSIENT_ERRORS = (TimeoutError, ConnectionError) + tuple(
+    getattr(google_exceptions, name) for name in (
+        "ServiceUnavailable", "DeadlineExceeded", "InternalServerError",
+        "BadGateway", "GatewayTimeout", "RetryError")
+    if google_exceptions is not None and hasattr(google_exceptions, name))
+
+
+class GeminiUnavailable(Exception):
+    """Raised instead of calling Gemini while the circuit breaker sheds
+    background work. `retry_after` is roughly when to try again (seconds)."""
+
+    def __init__(self, purpose: str, retry_after: float) -> None:
+        super().__init__(
+            f"Gemini unavailable for {purpose} work; retry in {retry_after:.0f}s")
+        self.purpose = purpose
+        self.retry_after = retry_after
+
+
+class GeminiCallError(Exception):
+    """A Gemini SDK call failed; the SDK exception is chained as `__cause__`.
+    `kind` is "rate_limited", "transient" or None (a retry won't help)."""
+
+    def __init__(self, cause: BaseException) -> None:
+        super().__init__(f"{type(cause).__name__}: {cause}")
+        self.kind = _classify_sdk_error(cause)
+
+
+def _classify_sdk_error(exc: BaseException) -> Optional[str]:
+    """Classify an exception raised by the SDK by type and HTTP status only."""
+    if isinstance(exc, _GEMINI_RATE_LIMIT_ERRORS):
+        return "rate_limited"
+    if isinstance(exc, _GEMINI_TRANSIENT_ERRORS):
+        return "transient"
+    # google.api_core errors (and some transports) carry the HTTP status
+    code = getattr(exc, "code", None)
+    if isinstance(code, int) and not isinstance(code, bool):
+        if code == 429:
+            return "rate_limited"
+        if code in _GEMINI_RETRYABLE_STATUS:
+            return "transient"
+    return None
+
+
+def _classify_gemini_error(exc: BaseException) -> Optional[str]:
+    """"shed", "rate_limited" or "transient" for gateway failures worth
+    retrying later; None for anything else, including parse errors."""
+    if isinstance(exc, GeminiUnavailable):
+        return "shed"
+    if isinstance(exc, GeminiCallError):
+        return exc.kind
+    return None
+
+
+class GeminiRateLimiter:
+    """Token bucket shared by every Gemini call.
+
+    Waiters are served by priority, then arrival, so under quota pressure an
+    interactive query takes the next token ahead of any queued background
+    call. A 429 from upstream empties the bucket.
+    """
+
+    def __init__(self, rate_per_second: float, burst: int) -> None:
+        self.rate = rate_per_second
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        # (priority, arrival, future)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._arrivals = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._stats: Dict[str, int] = {"granted": 0, "waited": 0, "drained": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(float(self.burst),
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is free and nobody is queued for it."""
+        if not self.enabled:
+            return True
+        self._refill()
+        if self._waiters or self._tokens < 1:
+            return False
+        self._tokens -= 1
+        self._stats["granted"] += 1
+        return True
+
+    async def acquire(self, priority: int) -> None:
+        if self.try_acquire():
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._arrivals += 1
+        heapq.heappush(self._waiters, (priority, self._arrivals, fut))
+        self._stats["waited"] += 1
+        self._grant()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Granted just as the caller went away; hand the token back
+                self._tokens += 1
+                self._grant()
+            raise
+
+    def _grant(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._waiters and (self._tokens >= 1 or self._waiters[0][2].done()):
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self._tokens -= 1
+            self._stats["granted"] += 1
+            fut.set_result(None)
+        if self._waiters:
+            delay = (1 - self._tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._grant)
+
+    def drain(self) -> None:
+        """Upstream returned a rate-limit error: spend what is left."""
+        if self.enabled:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0)
+            self._stats["drained"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        if self.enabled:
+            self._refill()
+        return {**self._stats, "enabled": self.enabled,
+                "ratePerMinute": self.rate * 60, "burst": self.burst,
+                "tokens": round(self._tokens, 2),
+                "queued": sum(1 for _, _, f in self._waiters if not f.done())}
+
+
+class GeminiCircuitBreaker:
+    """Opens after `threshold` consecutive transient Gemini failures.
+
+    While open, background calls are shed for `cooldown` seconds; interactive
+    calls still go through, and their outcome counts like any other. After
+    the cooldown one background call is let through as a probe: success
+    closes the breaker, failure re-opens it.
+    """
+
+    def __init__(self, threshold: int, cooldown: float) -> None:
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None
+        self._stats: Dict[str, int] = {"opened": 0, "shed": 0}
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def retry_after(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(1.0, self._opened_at + self.cooldown - time.monotonic())
+
+    def allow(self, interactive: bool) -> bool:
+        if self._opened_at is None or interactive:
+            return True
+        now = time.monotonic()
+        if now < self._opened_at + self.cooldown:
+            self._stats["shed"] += 1
+            return False
+        if self._probe_at is not None and now < self._probe_at + self.cooldown:
+            # A probe is already out
+            self._stats["shed"] += 1
+            return False
+        self._probe_at = now
+        return True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._probe_at = None
+        if self._opened_at is not None:
+            self._opened_at = None
+            logger.info("Gemini circuit breaker closed")
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_at = None
+        if self._opened_at is None and self._failures < self.threshold:
+            return
+        if self._opened_at is None:
+            self._stats["opened"] += 1
+            logger.warning("Gemini circuit breaker open after %d failures; "
+                           "shedding background calls for %.0fs",
+                           self._failures, self.cooldown)
+        self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "open": self.is_open,
+                "consecutiveFailures": self._failures,
+                "retryAfter": round(self.retry_after(), 1)}
+
+
+class GeminiGateway:
+    ADAPTERS = ("generative_model", "models_generate", "generate")
+
+    def __init__(self, model_name: str, max_concurrency: int,
+                 purpose_limits: Dict[str, int], limiter: GeminiRateLimiter,
+                 breaker: GeminiCircuitBreaker, max_retries: int = 0,
+                 retry_base_seconds: float = 0.5, retry_max_seconds: float = 8.0,
+                 hedge_after_seconds: float = 0.0) -> None:
+        self.model_name = model_name
+        self.max_concurrency = max(1, max_concurrency)
+        self._purpose_limits = purpose_limits
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_retries = max(0, max_retries)
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.hedge_after_seconds = hedge_after_seconds
+        # Hedges run outside the semaphores, at most one per interactive call
+        hedge_workers = purpose_limits.get(GEMINI_PURPOSE_QUERY, 0) if hedge_after_seconds > 0 else 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency + hedge_workers, thread_name_prefix="gemini")
+        self._global_sem = asyncio.Semaphore(self.max_concurrency)
+        self._purpose_sems = {p: asyncio.Semaphore(max(1, n))
+                              for p, n in purpose_limits.items()}
+        self._models: Dict[str, Any] = {}
+        self._models_lock = threading.Lock()
+        self._configured_key: Optional[str] = None
+        self._adapter: Optional[str] = None
+        self._stats: Dict[str, int] = {"calls": 0, "errors": 0, "adapterFallbacks": 0,
+                                       "retries": 0, "shed": 0, "hedges": 0,
+                                       "hedgesWon": 0}
+
+    # -------------------------------------------------------------------------
+    # Setup
+    # -------------------------------------------------------------------------
+    def _ensure_ready(self) -> None:
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY not set")
+        if genai is None:
+            raise RuntimeError("google-generativeai not installed")
+        if self._configured_key != api_key:
             try:
-                model_obj = genai.GenerativeModel(GEMINI_MODEL)
-                if image_base64:
-                    image_part = {"mime_type": "image/jpeg",
-                                  "data": image_base64}
-                    resp = model_obj.generate_content([prompt, image_part])
-                else:
-                    resp = model_obj.generate_content(prompt)
-                text = getattr(resp, "text", None)
-                return text if text is not None else str(resp)
+                genai.configure(api_key=api_key)
             except Exception:
-                # Fall through to other adapters
+                # Older/newer SDKs may raise on configure; the adapter call
+                # will surface a real problem.
                 pass
-
-        # 2) Newer SDK: genai.models.generate(...)
+            self._configured_key = api_key
+        if self._adapter is None:
+            available = self._available_adapters()
+            if not available:
+                raise RuntimeError(
+                    "Unsupported google.generativeai SDK API shape; please ensure the SDK is up-to-date")
+            self._adapter = available[0]
+            logger.info("Gemini gateway using SDK adapter=%s model=%s",
+                        self._adapter, self.model_name)
+
+    def _available_adapters(self) -> List[str]:
+        out = []
+        if hasattr(genai, "GenerativeModel"):
+            out.append("generative_model")
         models_mod = getattr(genai, "models", None)
         if models_mod and hasattr(models_mod, "generate"):
+            out.append("models_generate")
+        if hasattr(genai, "generate"):
+            out.append("generate")
+        return out
+
+    def startup(self) -> None:
+        try:
+            self._ensure_ready()
+            if self._adapter == "generative_model":
+                self._model(self.model_name)
+        except Exception as e:
+            logger.warning("Gemini gateway not ready at startup: %s", e)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _model(self, model_name: str) -> Any:
+        model_obj = self._models.get(model_name)
+        if model_obj is None:
+            with self._models_lock:
+                model_obj = self._models.get(model_name)
+                if model_obj is None:
+                    model_obj = genai.GenerativeModel(model_name)
+                    self._models[model_name] = model_obj
+        return model_obj
+
+    # -------------------------------------------------------------------------
+    # SDK adapters (run on the gateway executor)
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _generative_model_input(prompt: str, images: List[str]) -> Any:
+        if not images:
+            return prompt
+        parts: List[Any] = [prompt]
+        parts.extend({"mime_type": "image/jpeg", "data": img} for img in images)
+        return parts
+
+    def _call_generative_model(self, prompt: str, images: List[str]) -> str:
+        model_obj = self._model(self.model_name)
+        resp = model_obj.generate_content(
+            self._generative_model_input(prompt, images))
+        text = getattr(resp, "text", None)
+        return text if text is not None else str(resp)
+
+    def _call_models_generate(self, prompt: str, images: List[str]) -> str:
+        models_mod = genai.models
+        if images:
+            # Compose multimodal input as a list of parts when supported
+            inputs: Any = [{"content": prompt}]
+            inputs.extend({"image": {"mime_type": "image/jpeg", "data": img}}
+                          for img in images)
+        else:
+            inputs = {"content": prompt}
+
+        resp = models_mod.generate(model=self.model_name, input=inputs)
+        # Try common response accessors
+        #  - resp.output_text
+        #  - resp.output (list)
+        ot = getattr(resp, "output_text", None)
+        if ot:
+            return ot
+
+        out = getattr(resp, "output", None)
+        if out:
+            first = out[0]
+            if isinstance(first, dict):
+                # content may be list of blocks
+                text_fields = [item["text"] for item in (first.get("content") or [])
+                               if isinstance(item, dict) and item.get("text")]
+                if text_fields:
+                    return "\n".join(text_fields)
+
+        # Last resort
+        return str(resp)
+
+    def _call_generate(self, prompt: str, images: List[str]) -> str:
+        if images:
+            parts: List[Any] = [prompt]
+            parts.extend({"image": img} for img in images)
+            resp = genai.generate(model=self.model_name, prompt=parts)
+        else:
+            resp = genai.generate(model=self.model_name, prompt=prompt)
+        text = getattr(resp, "text", None) or getattr(
+            resp, "output_text", None)
+        return text if text is not None else str(resp)
+
+    def _call_sync(self, prompt: str, images: List[str]) -> str:
+        self._ensure_ready()
+        while True:
+            adapter = self._adapter
             try:
-                if image_base64:
-                    # Compose multimodal input as a list of parts when supported
-                    inputs = [{"content": prompt}, {
-                        "image": {"mime_type": "image/jpeg", "data": image_base64}}]
-                else:
-                    inputs = {"content": prompt}
-
-                resp = models_mod.generate(model=GEMINI_MODEL, input=inputs)
-                # Try common response accessors
-                #  - resp.output_text
-                #  - resp.output (list)
-                ot = getattr(resp, "output_text", None)
-                if ot:
-                    return ot
-
-                out = getattr(resp, "output", None)
-                if out:
+                return getattr(self, f"_call_{adapter}")(prompt, images)
+            except (AttributeError, TypeError):
+                # The SDK doesn't accept this call shape after all: move to
+                # the next one and remember it so later calls go straight
+                # there. Any other error is a real API failure.
+                available = self._available_adapters()
+                remaining = available[available.index(adapter) + 1:] \
+                    if adapter in available else []
+                if not remaining:
+                    raise
+                self._stats["adapterFallbacks"] += 1
+                GEMINI_ADAPTER_FALLBACKS.inc()
+                self._adapter = remaining[0]
+                logger.warning("Gemini adapter %s failed; switching to %s",
+                               adapter, self._adapter)
+
+    # -------------------------------------------------------------------------
+    # Scheduling
+    # -------------------------------------------------------------------------
+    def _purpose_sem(self, purpose: str) -> asyncio.Semaphore:
+        purpose_sem = self._purpose_sems.get(purpose)
+        if purpose_sem is None:
+            raise ValueError(f"unknown Gemini purpose: {purpose}")
+        return purpose_sem
+
+    async def _admit(self, purpose: str) -> None:
+        """Pass the circuit breaker and take a rate-limit token."""
+        if not self.breaker.allow(interactive=purpose == GEMINI_PURPOSE_QUERY):
+            self._stats["shed"] += 1
+            GEMINI_SHED.inc(purpose=purpose)
+            raise GeminiUnavailable(purpose, self.breaker.retry_after())
+        start = time.perf_counter()
+        await self.limiter.acquire(GEMINI_PRIORITIES[purpose])
+        GEMINI_RATE_WAIT_SECONDS.since(start, purpose=purpose)
+
+    def _record_failure(self, purpose: str, exc: BaseException) -> None:
+        self._stats["errors"] += 1
+        GEMINI_ERRORS.inc(purpose=purpose)
+        kind = _classify_gemini_error(exc)
+        if kind == "rate_limited":
+            self.limiter.drain()
+        if kind is not None:
+            self.breaker.record_failure()
+
+    def _retry_delay(self, purpose: str, attempt: int, exc: BaseException) -> Optional[float]:
+        """Backoff before retrying a failed call, or None to give up."""
+        if (attempt >= self.max_retries or isinstance(exc, GeminiUnavailable)
+                or _classify_gemini_error(exc) is None):
+            return None
+        delay = random.uniform(
+            0, min(self.retry_max_seconds, self.retry_base_seconds * (2 ** attempt)))
+        self._stats["retries"] += 1
+        GEMINI_RETRIES.inc(purpose=purpose)
+        logger.warning("Gemini %s call failed (%s); retry %d/%d in %.2fs",
+                       purpose, exc, attempt + 1, self.max_retries, delay)
+        return delay
+
+    async def _hedged(self, prompt: str, images: List[str]) -> str:
+        """Run an interactive call, sending a second copy if the first is
+        still pending after `hedge_after_seconds`; first success wins."""
+        loop = asyncio.get_running_loop()
+        primary = loop.run_in_executor(self._executor, self._call_sync, prompt, images)
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after_seconds)
+        # Never hedge with a token someone else is queued for
+        if done or not self.limiter.try_acquire():
+            return await primary
+        self._stats["hedges"] += 1
+        GEMINI_HEDGES.inc(outcome="launched")
+        hedge = loop.run_in_executor(self._executor, self._call_sync, prompt, images)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    for loser in pending:
+                        # Nobody awaits the loser; don't log its result as lost
+                        loser.add_done_callback(lambda f: f.cancelled() or f.exception())
+                    if fut is hedge:
+                        self._stats["hedgesWon"] += 1
+                        GEMINI_HEDGES.inc(outcome="won")
+                    return fut.result()
+                error = fut.exception()
+        raise error
+
+    async def _attempt(self, prompt: str, images: List[str], purpose: str) -> str:
+        async with self._purpose_sem(purpose):
+            await self._admit(purpose)
+            async with self._global_sem:
+                self._stats["calls"] += 1
+                try:
+                    if purpose == GEMINI_PURPOSE_QUERY and self.hedge_after_seconds > 0:
+                        text = await self._hedged(prompt, images)
+                    else:
+                        text = await asyncio.get_running_loop().run_in_executor(
+                            self._executor, self._call_sync, prompt, images)
+                except Exception as e:
+                    error = GeminiCallError(e)
+                    self._record_failure(purpose, error)
+                    raise error from e
+        self.breaker.record_success()
+        return text
+
+    # -------------------------------------------------------------------------
+    # Public API
+    # -------------------------------------------------------------------------
+    async def generate(self, prompt: str, images: Optional[List[str]] = None,
+                       purpose: str = GEMINI_PURPOSE_QUERY) -> str:
+        """Return the raw text response (not JSON-parsed).
+
+        Raises GeminiUnavailable when a background call is shed by the
+        circuit breaker.
+        """
+        images = [img for img in (images or []) if img]
+        self._purpose_sem(purpose)
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    return await self._attempt(prompt, images, purpose)
+                except Exception as e:
+                    delay = self._retry_delay(purpose, attempt, e)
+                    if delay is None:
+                        raise
+                await asyncio.sleep(delay)
+                attempt += 1
+        finally:
+            GEMINI_CALL_SECONDS.since(start, purpose=purpose)
+
+    def _stream_sync(self, prompt: str, images: List[str], emit) -> None:
+        self._ensure_ready()
+        if self._adapter != "generative_model":
+            # Only the GenerativeModel shape supports streaming; other
+            # shapes deliver the whole response as one chunk.
+            emit(self._call_sync(prompt, images))
+            return
+        model_obj = self._model(self.model_name)
+        for chunk in model_obj.generate_content(
+                self._generative_model_input(prompt, images), stream=True):
+            text = getattr(chunk, "text", None)
+            if text:
+                emit(text)
+
+    async def generate_stream(self, prompt: str, images: Optional[List[str]] = None,
+                              purpose: str = GEMINI_PURPOSE_QUERY) -> AsyncIterator[str]:
+        """Yield raw response text chunks as Gemini generates them.
+
+        Failures before the first chunk are retried like `generate`; once
+        text has been yielded an error is raised to the caller.
+        """
+        images = [img for img in (images or []) if img]
+        purpose_sem = self._purpose_sem(purpose)
+        loop = asyncio.get_running_loop()
+        end = object()
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                chunks: asyncio.Queue = asyncio.Queue()
+
+                def _emit(item: Any, chunks: asyncio.Queue = chunks) -> None:
+                    loop.call_soon_threadsafe(chunks.put_nowait, item)
+
+                def _run(emit: Callable[[Any], None] = _emit) -> None:
                     try:
-                        first = out[0]
-                        if isinstance(first, dict):
-                            # content may be list of blocks
-                            content = first.get("content")
-                            if isinstance(content, list):
-                                for item in content:
-                                    if isinstance(item, dict) and "text" in item:
-                                        return item["text"]
-                            # fallback to joining text-like fields
-                            text_fields = []
-                            for v in (first.get("content") or []):
-                                if isinstance(v, dict) and v.get("text"):
-                                    text_fields.append(v.get("text"))
-                            if text_fields:
-                                return "\n".join(text_fields)
-                    except Exception:
-                        pass
+                        self._stream_sync(prompt, images, emit)
+                    except Exception as e:
+                        emit(e)
+                    finally:
+                        emit(end)
 
-                # Last resort
-                return str(resp)
-            except Exception:
-                pass
+                yielded = False
+                try:
+                    async with purpose_sem:
+                        await self._admit(purpose)
+                        async with self._global_sem:
+                            self._stats["calls"] += 1
+                            worker = loop.run_in_executor(self._executor, _run)
+                            try:
+                                while True:
+                                    item = await chunks.get()
+                                    if item is end:
+                                        break
+                                    if isinstance(item, Exception):
+                                        error = GeminiCallError(item)
+                                        self._record_failure(purpose, error)
+                                        raise error from item
+                                    yielded = True
+                                    yield item
+                            finally:
+                                await asyncio.shield(worker)
+                    self.breaker.record_success()
+                    return
+                except Exception as e:
+                    delay = None if yielded else self._retry_delay(purpose, attempt, e)
+                    if delay is None:
+                        raise
+                await asyncio.sleep(delay)
+                attempt += 1
+        finally:
+            GEMINI_CALL_SECONDS.since(start, purpose=purpose)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "adapter": self._adapter,
+                "rateLimiter": self.limiter.stats(), "breaker": self.breaker.stats()}
+
+
+gemini = GeminiGateway(
+    GEMINI_MODEL,
+    max_concurrency=GEMINI_MAX_CONCURRENCY,
+    purpose_limits={
+        GEMINI_PURPOSE_CAPTURE: GEMINI_CAPTURE_CONCURRENCY,
+        GEMINI_PURPOSE_QUERY: GEMINI_QUERY_CONCURRENCY,
+        GEMINI_PURPOSE_CONDENSE: GEMINI_CONDENSE_CONCURRENCY,
+    },
+    limiter=GeminiRateLimiter(GEMINI_REQUESTS_PER_MINUTE / 60.0, GEMINI_BURST),
+    breaker=GeminiCircuitBreaker(GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_COOLDOWN_SECONDS),
+    max_retries=GEMINI_MAX_RETRIES,
+    retry_base_seconds=GEMINI_RETRY_BASE_SECONDS,
+    retry_max_seconds=GEMINI_RETRY_MAX_SECONDS,
+    hedge_after_seconds=GEMINI_HEDGE_AFTER_SECONDS,
+)
+GEMINI_BREAKER_OPEN.set_function(lambda: float(gemini.breaker.is_open))
 
-        # 3) Another possible shape: genai.generate(...)
-        if hasattr(genai, "generate"):
+
+@app.on_event("startup")
+async def _start_gemini_gateway() -> None:
+    gemini.startup()
+
+
+@app.on_event("shutdown")
+async def _stop_gemini_gateway() -> None:
+    gemini.shutdown()
+
+
+async def _call_gemini_with_image(prompt: str, image_base64: Optional[str] = None,
+                                  purpose: str = GEMINI_PURPOSE_QUERY) -> Dict[str, Any]:
+    text = await _call_gemini_raw(prompt, image_base64, purpose)
+    return _parse_json_response(text)
+
+
+async def _call_gemini_text(prompt: str, purpose: str = GEMINI_PURPOSE_QUERY) -> Dict[str, Any]:
+    text = await _call_gemini_raw(prompt, None, purpose)
+    return _parse_json_response(text)
+
+
+async def _call_gemini_raw(prompt: str, image_base64: Optional[str] = None,
+                           purpose: str = GEMINI_PURPOSE_QUERY) -> str:
+    """Call Gemini through the shared gateway and return the raw text
+    response. The caller will parse JSON as needed.
+    """
+    images = [image_base64] if image_base64 else None
+    return await gemini.generate(prompt, images, purpose)
+
+
+# =============================================================================
+# PROMPT ASSEMBLY (compact, token-budgeted)
+# =============================================================================
+
+PROMPT_KIND_CAPTURE = "capture"
+PROMPT_KIND_QUERY_ROUTER = "query_router"
+PROMPT_KIND_QUERY_ANSWER = "query_answer"
+PROMPT_KIND_HOURLY = "hourly"
+PROMPT_KIND_DAILY = "daily"
+
+PROMPT_TOKEN_BUDGETS: Dict[str, int] = {
+    PROMPT_KIND_CAPTURE: PROMPT_BUDGET_CAPTURE,
+    PROMPT_KIND_QUERY_ROUTER: PROMPT_BUDGET_QUERY_ROUTER,
+    PROMPT_KIND_QUERY_ANSWER: PROMPT_BUDGET_QUERY_ANSWER,
+    PROMPT_KIND_HOURLY: PROMPT_BUDGET_HOURLY,
+    PROMPT_KIND_DAILY: PROMPT_BUDGET_DAILY,
+}
+
+# Bookkeeping and storage fields the model never needs
+_PROMPT_DROP_FIELDS = frozenset({
+    "userId", "createdAt", "updatedAt", "expireAt", "captureIds", "hourlyIds",
+    "photoURL", "audioURL", "bestFacePhotoURL", "key", "processed", "sharded",
+})
+
+_prompt_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _estimate_tokens(text: str) -> int:
+    return -(-len(text) // PROMPT_CHARS_PER_TOKEN)
+
+
+def _prompt_value(value: Any) -> Any:
+    """Recursively drop bookkeeping fields and empty values."""
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            if k in _PROMPT_DROP_FIELDS:
+                continue
+            v = _prompt_value(v)
+            if v is None or v == "" or v == [] or v == {}:
+                continue
+            out[k] = v
+        return out
+    if isinstance(value, (list, tuple)):
+        return [_prompt_value(v) for v in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _compact_json(value: Any) -> str:
+    return json.dumps(_prompt_value(value), separators=(",", ":"),
+                      ensure_ascii=False, default=str)
+
+
+def _spread_priorities(n: int) -> List[float]:
+    """Priorities whose top-k picks are spread evenly over a sequence, so a
+    budget cut thins out a long list instead of dropping its tail."""
+    prio = [0.0] * n
+    assigned: Set[int] = set()
+    rank = 0
+    step = max(1, n)
+    while len(assigned) < n:
+        for i in range(0, n, step):
+            if i not in assigned:
+                assigned.add(i)
+                prio[i] = float(-rank)
+                rank += 1
+        step = max(1, step // 2)
+    return prio
+
+
+class PromptBuilder:
+    """Formats a prompt template under the token budget of its kind.
+
+    `text` and `json` fields are always included (text can be capped);
+    `items` fields are JSON arrays packed by priority into whatever budget
+    is left, in the order they were added, keeping the original item order
+    in the output. Token counts are estimated from characters.
+    """
+
+    def __init__(self, kind: str, template: str, budget: Optional[int] = None) -> None:
+        self.kind = kind
+        self.template = template
+        self.budget = budget or PROMPT_TOKEN_BUDGETS.get(kind, PROMPT_BUDGET_QUERY_ANSWER)
+        self._fixed: Dict[str, str] = {}
+        self._items: List[Tuple[str, List[str], List[float], str]] = []
+
+    def text(self, name: str, value: Any, max_tokens: Optional[int] = None) -> "PromptBuilder":
+        value = "" if value is None else str(value)
+        if max_tokens is not None and _estimate_tokens(value) > max_tokens:
+            value = value[:max_tokens * PROMPT_CHARS_PER_TOKEN].rstrip() + "…"
+        self._fixed[name] = value
+        return self
+
+    def json(self, name: str, value: Any, empty: Optional[str] = None) -> "PromptBuilder":
+        self._fixed[name] = empty if (empty is not None and not value) else _compact_json(value)
+        return self
+
+    def items(self, name: str, items: List[Any], priorities: Optional[List[float]] = None,
+              empty: str = "[]") -> "PromptBuilder":
+        encoded = [_compact_json(item) for item in items]
+        if priorities is None:
+            priorities = [0.0] * len(items)
+        self._items.append((name, encoded, list(priorities), empty))
+        return self
+
+    def build(self) -> str:
+        fields = dict(self._fixed)
+        for name, _, _, empty in self._items:
+            fields[name] = empty
+        remaining = self.budget - _estimate_tokens(self.template.format(**fields))
+
+        kept_total = dropped_total = 0
+        for name, encoded, priorities, empty in self._items:
+            order = sorted(range(len(encoded)), key=lambda i: -priorities[i])
+            keep: List[int] = []
+            for i in order:
+                cost = _estimate_tokens(encoded[i]) + 1
+                if cost <= remaining:
+                    keep.append(i)
+                    remaining -= cost
+            kept_total += len(keep)
+            dropped_total += len(encoded) - len(keep)
+            fields[name] = ("[" + ",".join(encoded[i] for i in sorted(keep)) + "]") if keep else empty
+
+        prompt = self.template.format(**fields)
+        tokens = _estimate_tokens(prompt)
+        st = _prompt_stats.setdefault(self.kind, {
+            "prompts": 0, "tokens": 0, "maxTokens": 0, "droppedItems": 0})
+        st["prompts"] += 1
+        st["tokens"] += tokens
+        st["maxTokens"] = max(st["maxTokens"], tokens)
+        st["droppedItems"] += dropped_total
+        logger.info("[PROMPT] kind=%s tokens~%d budget=%d items=%d dropped=%d",
+                    self.kind, tokens, self.budget, kept_total, dropped_total)
+        return prompt
+
+
+def prompt_stats() -> Dict[str, Any]:
+    return {kind: {**st, "avgTokens": st["tokens"] // st["prompts"] if st["prompts"] else 0,
+                   "budget": PROMPT_TOKEN_BUDGETS.get(kind)}
+            for kind, st in _prompt_stats.items()}
+
+
+# =============================================================================
+# CAPTURE VECTOR INDEX (semantic retrieval)
+# =============================================================================
+# Per-user embedding index over capture analyses, kept as a float32 NumPy
+# matrix. Rows are added as captures finish processing and when the query
+# pipeline loads captures the index hasn't seen (e.g. after a restart).
+# Search is exact (one matrix-vector product) up to VECTOR_INDEX_EXACT_LIMIT
+# candidate rows, and above that uses random-hyperplane signatures to
+# shortlist candidates before an exact re-rank.
+
+_EMBED_TOKEN_RE = re.compile(r"[a-z0-9']+")
+_EMBED_STOPWORDS = frozenset(
+    "a an and are as at be but by did do for from had has have i in is it its "
+    "me my of on or so that the then there they this to was we were what when "
+    "where which who with you your".split())
+
+
+def _capture_embedding_text(capture: Dict[str, Any]) -> str:
+    analysis = capture.get("geminiAnalysis") or {}
+    parts = [
+        analysis.get("keyMoment") or "",
+        analysis.get("imageSummary") or "",
+        " ".join(t for t in (analysis.get("themes") or []) if isinstance(t, str)),
+        capture.get("transcription") or "",
+    ]
+    return "\n".join(p for p in parts if p)
+
+
+class HashingEmbeddingProvider:
+    """CPU-only embeddings: signed feature hashing of word unigrams and
+    bigrams. No model download or network access, so it works offline and in
+    tests; quality is keyword-level rather than truly semantic."""
+
+    name = "local"
+
+    def __init__(self, dim: int) -> None:
+        self.dim = dim
+
+    def _embed_one(self, text: str, out: "np.ndarray") -> None:
+        tokens = [t for t in _EMBED_TOKEN_RE.findall(text.lower())
+                  if t not in _EMBED_STOPWORDS]
+        feats = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for i, feat in enumerate(feats):
+            h = int.from_bytes(hashlib.blake2b(
+                feat.encode("utf-8"), digest_size=8).digest(), "little")
+            weight = 1.0 if i < len(tokens) else 0.5
+            out[h % self.dim] += weight if (h >> 63) & 1 else -weight
+        norm = float(np.linalg.norm(out))
+        if norm:
+            out /= norm
+
+    def _embed_sync(self, texts: List[str]) -> "np.ndarray":
+        mat = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            self._embed_one(text, mat[i])
+        return mat
+
+    async def embed(self, texts: List[str]) -> "np.ndarray":
+        if len(texts) <= 32:
+            return self._embed_sync(texts)
+        return await asyncio.to_thread(self._embed_sync, texts)
+
+    async def embed_query(self, text: str) -> "np.ndarray":
+        return (await self.embed([text]))[0]
+
+
+class GeminiEmbeddingProvider:
+    """Embeddings from the Gemini embedding API (EMBEDDING_PROVIDER=gemini)."""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str) -> None:
+        self.model_name = model_name
+
+    def _embed_sync(self, texts: List[str], task_type: str = "retrieval_document") -> "np.ndarray":
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY not set")
+        if genai is None:
+            raise RuntimeError("google-generativeai not installed")
+        resp = genai.embed_content(
+            model=self.model_name, content=texts, task_type=task_type)
+        vectors = resp["embedding"]
+        if vectors and not isinstance(vectors[0], list):
+            vectors = [vectors]
+        mat = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return mat / norms
+
+    async def embed(self, texts: List[str]) -> "np.ndarray":
+        return await asyncio.to_thread(self._embed_sync, texts)
+
+    async def embed_query(self, text: str) -> "np.ndarray":
+        """Search-side embedding (the API embeds queries differently)."""
+        return (await asyncio.to_thread(self._embed_sync, [text], "retrieval_query"))[0]
+
+
+class _UserVectors:
+    def __init__(self, dim: int, sig_bytes: int, capacity: int = 256) -> None:
+        self.dim = dim
+        self.ids: List[str] = []
+        self.pos: Dict[str, int] = {}
+        self.ts = np.zeros(capacity, dtype=np.float64)
+        self.mat = np.zeros((capacity, dim), dtype=np.float32)
+        # Packed hyperplane signature per row, computed once at insert
+        self.sigs = np.zeros((capacity, sig_bytes), dtype=np.uint8)
+
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+    def upsert(self, capture_id: str, ts: float, vec: "np.ndarray", sig: "np.ndarray") -> None:
+        i = self.pos.get(capture_id)
+        if i is None:
+            i = len(self.ids)
+            if i == self.mat.shape[0]:
+                self.mat = np.concatenate([self.mat, np.zeros_like(self.mat)])
+                self.ts = np.concatenate([self.ts, np.zeros_like(self.ts)])
+                self.sigs = np.concatenate([self.sigs, np.zeros_like(self.sigs)])
+            self.ids.append(capture_id)
+            self.pos[capture_id] = i
+        self.mat[i] = vec
+        self.ts[i] = ts
+        self.sigs[i] = sig
+
+    def drop_oldest(self, count: int) -> None:
+        n = self.size
+        keep = np.sort(np.argsort(self.ts[:n], kind="stable")[count:])
+        self.ids = [self.ids[i] for i in keep]
+        self.pos = {cid: i for i, cid in enumerate(self.ids)}
+        self.mat[:len(keep)] = self.mat[keep]
+        self.ts[:len(keep)] = self.ts[keep]
+        self.sigs[:len(keep)] = self.sigs[keep]
+
+
+# Set bits per byte value, for Hamming distances between packed signatures
+_POPCOUNT8 = (np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+              .astype(np.uint8) if np is not None else None)
+
+
+class CaptureVectorIndex:
+    SIGNATURE_BITS = 64
+    CANDIDATE_FACTOR = 20
+
+    def __init__(self, provider: Any, exact_limit: int, max_per_user: int) -> None:
+        self.provider = provider
+        self.exact_limit = exact_limit
+        self.max_per_user = max_per_user
+        self._users: Dict[str, _UserVectors] = {}
+        self._planes: Optional["np.ndarray"] = None
+        self._stats: Dict[str, int] = {
+            "added": 0, "searches": 0, "approxSearches": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return np is not None
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        user_id, capture_id = key
+        vectors = self._users.get(user_id)
+        return vectors is not None and capture_id in vectors.pos
+
+    async def add_many(self, user_id: str, captures: List[Dict[str, Any]]) -> int:
+        """Embed and index processed captures not already in the index."""
+        if not self.enabled:
+            return 0
+        todo = []
+        for c in captures:
+            analysis = c.get("geminiAnalysis")
+            if (not c.get("id") or not isinstance(analysis, dict)
+                    or analysis.get("error") or (user_id, c["id"]) in self):
+                continue
             try:
-                if image_base64:
-                    resp = genai.generate(model=GEMINI_MODEL, prompt=[
-                                          prompt, {"image": image_base64}])
-                else:
-                    resp = genai.generate(model=GEMINI_MODEL, prompt=prompt)
-                text = getattr(resp, "text", None) or getattr(
-                    resp, "output_text", None)
-                return text if text is not None else str(resp)
+                ts = _parse_iso_datetime(c.get("timestamp")).timestamp()
             except Exception:
-                pass
+                continue
+            todo.append((str(c["id"]), ts, _capture_embedding_text(c)))
+        if not todo:
+            return 0
+
+        mat = await self.provider.embed([t[2] for t in todo])
+        sigs = self._signatures(mat)
+        vectors = self._users.get(user_id)
+        if vectors is None or vectors.dim != mat.shape[1]:
+            vectors = _UserVectors(mat.shape[1], sigs.shape[1])
+            self._users[user_id] = vectors
+        for (capture_id, ts, _), vec, sig in zip(todo, mat, sigs):
+            vectors.upsert(capture_id, ts, vec, sig)
+        if vectors.size > self.max_per_user:
+            vectors.drop_oldest(vectors.size - self.max_per_user)
+        self._stats["added"] += len(todo)
+        return len(todo)
+
+    async def add(self, user_id: str, capture: Dict[str, Any]) -> bool:
+        return bool(await self.add_many(user_id, [capture]))
+
+    def _signatures(self, rows: "np.ndarray") -> "np.ndarray":
+        if self._planes is None or self._planes.shape[1] != rows.shape[1]:
+            rng = np.random.default_rng(0)
+            self._planes = rng.standard_normal(
+                (self.SIGNATURE_BITS, rows.shape[1])).astype(np.float32)
+        return np.packbits(rows @ self._planes.T > 0, axis=-1)
+
+    async def search(self, user_id: str, query_text: str, k: int,
+                     start_ts: Optional[float] = None, end_ts: Optional[float] = None,
+                     allowed_ids: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Top-k (capture_id, score) by cosine similarity, best first."""
+        vectors = self._users.get(user_id)
+        if not self.enabled or vectors is None or not vectors.size or k <= 0:
+            return []
+        n = vectors.size
+        mask = np.ones(n, dtype=bool)
+        if start_ts is not None:
+            mask &= vectors.ts[:n] >= start_ts
+        if end_ts is not None:
+            mask &= vectors.ts[:n] <= end_ts
+        if allowed_ids is not None:
+            mask &= np.fromiter((cid in allowed_ids for cid in vectors.ids),
+                                dtype=bool, count=n)
+        rows = np.flatnonzero(mask)
+        if not rows.size:
+            return []
+
+        qvec = await self.provider.embed_query(query_text)
+        if qvec.shape[0] != vectors.dim:
+            return []
+        self._stats["searches"] += 1
+
+        if rows.size > self.exact_limit:
+            # Shortlist by Hamming distance between hyperplane signatures
+            self._stats["approxSearches"] += 1
+            qsig = self._signatures(qvec[None, :])[0]
+            dist = _POPCOUNT8[vectors.sigs[rows] ^ qsig].sum(axis=1, dtype=np.int32)
+            shortlist = min(rows.size, k * self.CANDIDATE_FACTOR)
+            rows = rows[np.argpartition(dist, shortlist - 1)[:shortlist]]
+
+        scores = vectors.mat[rows] @ qvec
+        top = min(k, rows.size)
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+        return [(vectors.ids[rows[i]], float(scores[i])) for i in best]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "provider": getattr(self.provider, "name", type(self.provider).__name__),
+            "users": len(self._users),
+            "vectors": sum(v.size for v in self._users.values()),
+        }
+
 
-        raise RuntimeError(
-            "Unsupported google.generativeai SDK API shape; please ensure the SDK is up-to-date")
+def _make_embedding_provider() -> Any:
+    if EMBEDDING_PROVIDER == "gemini":
+        return GeminiEmbeddingProvider(GEMINI_EMBEDDING_MODEL)
+    return HashingEmbeddingProvider(VECTOR_INDEX_DIM)
+
+
+capture_index = CaptureVectorIndex(
+    _make_embedding_provider(),
+    exact_limit=VECTOR_INDEX_EXACT_LIMIT,
+    max_per_user=VECTOR_INDEX_MAX_PER_USER,
+)
+if np is None:
+    logger.warning("numpy not available; semantic capture retrieval disabled")
 
 
 # =============================================================================
 # CAPTURE ANALYSIS WITH GEMINI VISION
 # =============================================================================
 
-async def _analyze_capture_with_gemini(capture: Dict[str, Any]) -> Dict[str, Any]:
+async def _analyze_single_capture(capture: Dict[str, Any], image_b64: Optional[str]) -> Dict[str, Any]:
     ts = capture.get("timestamp")
     if isinstance(ts, datetime):
         ts_str = ts.isoformat()
@@ -1163,21 +4313,160 @@ async def _analyze_capture_with_gemini(capture: Dict[str, Any]) -> Dict[str, Any
 
     transcription = capture.get(
         "transcription") or "No transcription available"
-    photo_url = capture.get("photoURL")
 
-    prompt = CAPTURE_ANALYSIS_PROMPT.format(
-        timestamp=ts_str,
-        transcription=transcription
-    )
+    prompt = (PromptBuilder(PROMPT_KIND_CAPTURE, CAPTURE_ANALYSIS_PROMPT)
+              .text("timestamp", ts_str)
+              .text("transcription", transcription,
+                    max_tokens=PROMPT_BUDGET_CAPTURE - _estimate_tokens(CAPTURE_ANALYSIS_PROMPT))
+              .build())
+    return await _call_gemini_with_image(prompt, image_b64, GEMINI_PURPOSE_CAPTURE)
+
+
+class CaptureAnalysisBatcher:
+    """Collects captures per user for a short window (or up to `max_items`)
+    and analyzes them with one multi-image Gemini call.
+
+    Captures missing from the batch response, or a batch whose response
+    doesn't parse, fall back to one call per capture. A batch that fails
+    upstream (rate limit, outage) fails every capture in it.
+    """
+
+    def __init__(self, window_seconds: float, max_items: int) -> None:
+        self.window_seconds = window_seconds
+        self.max_items = max(1, max_items)
+        self._pending: Dict[str, List[Tuple[Dict[str, Any], Optional[str], asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._running: Set[asyncio.Task] = set()
+        self._stats: Dict[str, int] = {
+            "batches": 0, "batchedCaptures": 0, "fallbacks": 0}
+
+    async def analyze(self, capture: Dict[str, Any], image_b64: Optional[str]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future = loop.create_future()
+        user_id = capture.get("userId") or ""
+        bucket = self._pending.setdefault(user_id, [])
+        bucket.append((capture, image_b64, fut))
+        if len(bucket) >= self.max_items:
+            self._flush(user_id)
+        elif len(bucket) == 1:
+            self._timers[user_id] = loop.call_later(
+                self.window_seconds, self._flush, user_id)
+        return await fut
+
+    def _flush(self, user_id: str) -> None:
+        timer = self._timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+        items = self._pending.pop(user_id, [])
+        if items:
+            task = asyncio.create_task(self._run(items))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, items: List[Tuple[Dict[str, Any], Optional[str], asyncio.Future]]) -> None:
+        results: Dict[str, Dict[str, Any]] = {}
+        if len(items) > 1:
+            try:
+                results = await self._analyze_batch(items)
+            except Exception as e:
+                # Upstream trouble: single calls would only add load, so the
+                # whole batch fails and is retried by the capture queue
+                for _, _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+                return
+
+        async def _settle(capture: Dict[str, Any], image_b64: Optional[str], fut: asyncio.Future) -> None:
+            analysis = results.get(str(capture.get("id")))
+            try:
+                if analysis is None:
+                    if len(items) > 1:
+                        self._stats["fallbacks"] += 1
+                    analysis = await _analyze_single_capture(capture, image_b64)
+                if not fut.done():
+                    fut.set_result(analysis)
+            except Exception as e:
+                if not fut.done():
+                    fut.set_exception(e)
+
+        await asyncio.gather(*[_settle(c, img, fut) for c, img, fut in items])
+
+    async def _analyze_batch(self, items: List[Tuple[Dict[str, Any], Optional[str], asyncio.Future]]) -> Dict[str, Dict[str, Any]]:
+        captures_for_prompt = []
+        images: List[str] = []
+        for capture, image_b64, _ in items:
+            ts = capture.get("timestamp")
+            entry: Dict[str, Any] = {
+                "captureId": str(capture.get("id")),
+                "timestamp": ts.isoformat() if isinstance(ts, datetime) else str(ts),
+                "transcription": capture.get("transcription") or "No transcription available",
+                "imageIndex": None,
+            }
+            if image_b64:
+                images.append(image_b64)
+                entry["imageIndex"] = len(images)
+            captures_for_prompt.append(entry)
+
+        # Captures cut by the budget are missing from the response and fall
+        # back to single calls
+        prompt = (PromptBuilder(PROMPT_KIND_CAPTURE, CAPTURE_BATCH_ANALYSIS_PROMPT,
+                                budget=PROMPT_BUDGET_CAPTURE * len(items))
+                  .text("count", len(items))
+                  .items("captures_json", captures_for_prompt)
+                  .build())
+        try:
+            text = await gemini.generate(prompt, images, GEMINI_PURPOSE_CAPTURE)
+            parsed = _parse_json_response(text)
+            analyses = parsed.get("analyses") if isinstance(parsed, dict) else None
+            if not isinstance(analyses, list):
+                raise ValueError("batch response has no analyses array")
+        except Exception as e:
+            if _classify_gemini_error(e) is not None:
+                raise
+            logger.exception(
+                "Batch capture analysis failed (%d captures), falling back to single calls", len(items))
+            return {}
+
+        out: Dict[str, Dict[str, Any]] = {}
+        for a in analyses:
+            if isinstance(a, dict) and a.get("captureId"):
+                out[str(a.pop("captureId"))] = a
+        self._stats["batches"] += 1
+        self._stats["batchedCaptures"] += len(out)
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats)
+
+
+capture_batcher = CaptureAnalysisBatcher(
+    CAPTURE_BATCH_WINDOW_SECONDS, CAPTURE_BATCH_MAX_ITEMS)
+
+
+async def _analyze_capture_with_gemini(capture: Dict[str, Any]) -> Dict[str, Any]:
+    transcription = capture.get(
+        "transcription") or "No transcription available"
+    photo_url = capture.get("photoURL")
 
     image_b64 = None
     if photo_url:
         image_b64 = await _download_image_as_base64(photo_url)
 
     try:
-        analysis = await _call_gemini_with_image(prompt, image_b64)
+        if CAPTURE_BATCH_ENABLED:
+            analysis = await capture_batcher.analyze(capture, image_b64)
+        else:
+            analysis = await _analyze_single_capture(capture, image_b64)
+        if photo_url:
+            # Lets the upload completion hook redo captures whose photo
+            # landed after they were analyzed
+            analysis["imageAnalyzed"] = image_b64 is not None
         return analysis
     except Exception as e:
+        if _classify_gemini_error(e) is not None:
+            # Quota, outage or shed by the breaker: fail the job so the
+            # capture queue retries it instead of saving a placeholder
+            raise
         logger.exception("Gemini analysis failed, using fallback")
         return {
             "imageSummary": "Analysis unavailable",
@@ -1195,97 +4484,342 @@ async def _analyze_capture_with_gemini(capture: Dict[str, Any]) -> Dict[str, Any
 # CONTACTS MANAGEMENT
 # =============================================================================
 
-async def _update_contacts_from_analysis(user_id: str, analysis: Dict[str, Any], capture: Dict[str, Any]) -> None:
-    mentioned_names = analysis.get("mentionedNames") or []
-    detected_faces = analysis.get("detectedFaces") or []
-
-    if not mentioned_names and not detected_faces:
-        return
-
-    contacts_doc = await repo.get_contacts(user_id)
-    if not contacts_doc:
-        contacts_doc = {"contacts": []}
-
-    contacts_list = contacts_doc.get("contacts", [])
-    contacts_by_name = {c.get("name", "").lower(): c for c in contacts_list}
-    now_iso = datetime.now(timezone.utc).isoformat()
-
-    for name in mentioned_names:
-        name_lower = name.lower()
-        if name_lower in contacts_by_name:
-            contacts_by_name[name_lower]["lastSeen"] = now_iso
-            contacts_by_name[name_lower]["mentionCount"] = contacts_by_name[name_lower].get(
-                "mentionCount", 0) + 1
-        else:
-            new_contact = {
-                "name": name,
+def _apply_contact_deltas(existing: Dict[str, Dict[str, Any]],
+                          deltas: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Apply coalesced deltas (keyed by _contact_key) to the matching
+    existing contacts and return every contact that changed.
+
+    Mentions bump `mentionCount` and insert unknown names; face-only deltas
+    just refresh `lastSeen`/`bestFacePhotoURL` on contacts that already exist.
+    """
+    changed: Dict[str, Dict[str, Any]] = {}
+    for key, delta in deltas.items():
+        contact = existing.get(key)
+        if contact is None:
+            if not delta["mentions"]:
+                continue
+            contact = {
+                "name": delta["name"],
                 "relationship": "unknown",
-                "notes": f"First mentioned in capture {capture.get('id')}",
+                "notes": f"First mentioned in capture {delta.get('firstCaptureId')}",
                 "bestFacePhotoURL": None,
-                "firstSeen": now_iso,
-                "lastSeen": now_iso,
-                "mentionCount": 1
+                "firstSeen": delta["firstSeen"],
+                "lastSeen": delta["lastSeen"],
+                "mentionCount": 0,
             }
-            contacts_list.append(new_contact)
-            contacts_by_name[name_lower] = new_contact
+        else:
+            contact = dict(contact)
+        contact["mentionCount"] = contact.get("mentionCount", 0) + delta["mentions"]
+        if delta["lastSeen"] > (contact.get("lastSeen") or ""):
+            contact["lastSeen"] = delta["lastSeen"]
+        if not contact.get("bestFacePhotoURL") and delta.get("facePhotoURL"):
+            contact["bestFacePhotoURL"] = delta["facePhotoURL"]
+        changed[key] = contact
+    return changed
+
+
+class ContactDeltaAggregator:
+    """Coalesces per-capture contact updates per user.
+
+    Mention counts, `lastSeen` and new names accumulate in memory and are
+    written with one transaction per user, every `interval_seconds` or as
+    soon as a user has `max_pending` distinct names waiting. A failed flush
+    folds its deltas back in for the next attempt; `stop()` flushes
+    everything that is still pending.
+    """
 
-    for face in detected_faces:
-        face_name = face.get("possibleName")
-        if face_name:
-            name_lower = face_name.lower()
-            if name_lower in contacts_by_name:
-                contact = contacts_by_name[name_lower]
-                if not contact.get("bestFacePhotoURL") and capture.get("photoURL"):
-                    contact["bestFacePhotoURL"] = capture.get("photoURL")
-                contact["lastSeen"] = now_iso
+    def __init__(self, interval_seconds: float, max_pending: int) -> None:
+        self.interval_seconds = interval_seconds
+        self.max_pending = max(1, max_pending)
+        self._pending: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._flushing: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._stats: Dict[str, int] = {
+            "updates": 0, "flushes": 0, "flushedNames": 0, "flushErrors": 0}
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+        await self.flush_all()
+
+    def add(self, user_id: str, analysis: Dict[str, Any], capture: Dict[str, Any],
+            previous: Optional[Dict[str, Any]] = None) -> None:
+        """Fold one capture's analysis into the pending deltas.
+
+        `previous` is the analysis the capture already had when it is being
+        reprocessed (e.g. once its photo arrives); names it mentioned were
+        counted then and are not counted again.
+        """
+        counted = {_contact_key(n) for n in (previous or {}).get("mentionedNames") or []
+                   if isinstance(n, str)}
+        mentioned_names = analysis.get("mentionedNames") or []
+        detected_faces = analysis.get("detectedFaces") or []
+        if not mentioned_names and not detected_faces:
+            return
 
-    contacts_doc["contacts"] = list(contacts_by_name.values())
-    await repo.upsert_contacts(user_id, contacts_doc)
-    logger.info("Updated contacts for user=%s, total=%d",
-                user_id, len(contacts_doc["contacts"]))
+        now_iso = datetime.now(timezone.utc).isoformat()
+        deltas = self._pending.setdefault(user_id, {})
+
+        def _delta(name: str) -> Dict[str, Any]:
+            key = _contact_key(name)
+            delta = deltas.get(key)
+            if delta is None:
+                delta = {"name": name.strip(), "mentions": 0, "firstSeen": now_iso,
+                         "lastSeen": now_iso, "firstCaptureId": capture.get("id"),
+                         "facePhotoURL": None}
+                deltas[key] = delta
+            delta["lastSeen"] = now_iso
+            return delta
+
+        for name in mentioned_names:
+            if not isinstance(name, str) or not _contact_key(name):
+                continue
+            delta = _delta(name)
+            if _contact_key(name) not in counted:
+                delta["mentions"] += 1
+        for face in detected_faces:
+            face_name = face.get("possibleName") if isinstance(face, dict) else None
+            if isinstance(face_name, str) and _contact_key(face_name):
+                delta = _delta(face_name)
+                if not delta["facePhotoURL"] and capture.get("photoURL"):
+                    delta["facePhotoURL"] = capture.get("photoURL")
+
+        self._stats["updates"] += 1
+        if len(deltas) >= self.max_pending:
+            task = asyncio.create_task(self.flush(user_id))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    def _restore(self, user_id: str, deltas: Dict[str, Dict[str, Any]]) -> None:
+        pending = self._pending.setdefault(user_id, {})
+        for name_lower, delta in deltas.items():
+            newer = pending.get(name_lower)
+            if newer is None:
+                pending[name_lower] = delta
+                continue
+            newer["mentions"] += delta["mentions"]
+            newer["firstSeen"] = min(newer["firstSeen"], delta["firstSeen"])
+            newer["firstCaptureId"] = delta["firstCaptureId"]
+            newer["facePhotoURL"] = delta["facePhotoURL"] or newer["facePhotoURL"]
+
+    async def flush(self, user_id: str) -> None:
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            deltas = self._pending.pop(user_id, None)
+            if not deltas:
+                return
+            try:
+                written = await repo.apply_contact_deltas(user_id, deltas)
+            except Exception:
+                self._stats["flushErrors"] += 1
+                self._restore(user_id, deltas)
+                logger.exception("Contacts flush failed user=%s names=%d",
+                                 user_id, len(deltas))
+                return
+            self._stats["flushes"] += 1
+            self._stats["flushedNames"] += len(deltas)
+            if written:
+                answer_cache.invalidate(user_id, "contacts")
+            logger.info("Updated contacts for user=%s, names=%d, written=%d",
+                        user_id, len(deltas), written)
+
+    async def flush_all(self) -> None:
+        await asyncio.gather(*[self.flush(user_id) for user_id in list(self._pending)])
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.flush_all()
+            except Exception:
+                logger.exception("Contacts flush loop error")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "pendingUsers": len(self._pending),
+            "pendingNames": sum(len(d) for d in self._pending.values()),
+        }
+
+
+contact_updates = ContactDeltaAggregator(
+    interval_seconds=CONTACTS_FLUSH_INTERVAL_SECONDS,
+    max_pending=CONTACTS_FLUSH_MAX_PENDING,
+)
+
+
+async def _update_contacts_from_analysis(user_id: str, analysis: Dict[str, Any], capture: Dict[str, Any]) -> None:
+    previous = capture.get("geminiAnalysis") if capture.get("processed") else None
+    contact_updates.add(user_id, analysis, capture, previous=previous)
 
 
 # =============================================================================
 # HOURLY CONDENSATION
 # =============================================================================
 
-async def _check_and_run_hourly_condensation(user_id: str, capture_ts: datetime) -> None:
-    profile = await repo.get_user_profile(user_id)
-    if not profile:
-        return
-
-    last_condensation = profile.get("lastCondensationTime")
-    if last_condensation:
-        if isinstance(last_condensation, str):
-            last_condensation = _parse_iso_datetime(last_condensation)
-        time_since = capture_ts - last_condensation
-        if time_since < timedelta(hours=1):
+def _est_hour_start(ts: datetime) -> datetime:
+    return ts.astimezone(EST).replace(minute=0, second=0, microsecond=0)
+
+
+def _est_day_end(day: date) -> datetime:
+    return datetime.combine(day + timedelta(days=1), datetime.min.time(), tzinfo=EST)
+
+
+_HOURLY_SUMMARY_FIELDS = ("summary", "themes", "events", "peoplePresent",
+                          "locations", "highlight", "mood", "activities")
+
+
+def _hourly_capture_item(c: Dict[str, Any]) -> Dict[str, Any]:
+    ts = c.get("timestamp")
+    if isinstance(ts, datetime):
+        ts = ts.isoformat()
+    return {
+        "timestamp": ts,
+        "transcription": c.get("transcription"),
+        "analysis": c.get("geminiAnalysis", {})
+    }
+
+
+def _hour_period(ts: datetime) -> Tuple[str, int]:
+    hour_start = _est_hour_start(ts)
+    return hour_start.date().isoformat(), hour_start.hour
+
+
+class HourlyRollup:
+    """Incrementally summarizes the current hour of each user.
+
+    Processed captures are buffered per (user, hour); every `batch_size` of
+    them are folded into a rolling partial summary (HOURLY_PARTIAL_PROMPT)
+    stored in `hourly_partials`. At the end of the hour `finalize` folds
+    whatever the partial doesn't cover yet and writes the final summary with
+    HOURLY_FINALIZE_PROMPT, so each prompt carries at most one partial plus
+    `batch_size` captures however busy the hour was. Buffers are only a
+    trigger: `finalize` re-reads the hour's captures, so nothing is lost if
+    the process restarts mid-hour.
+    """
+
+    def __init__(self, batch_size: int) -> None:
+        self.batch_size = max(1, batch_size)
+        self._buffers: Dict[Tuple[str, str, int], List[Dict[str, Any]]] = {}
+        self._locks: Dict[Tuple[str, str, int], asyncio.Lock] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._stats: Dict[str, int] = {"folds": 0, "foldedCaptures": 0,
+                                       "foldErrors": 0, "finalized": 0}
+
+    def _lock(self, key: Tuple[str, str, int]) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    def note(self, user_id: str, capture: Dict[str, Any]) -> None:
+        """Buffer a processed capture and fold once a batch is ready."""
+        ts = capture.get("timestamp")
+        if not ts:
             return
+        date_str, hour = _hour_period(_parse_iso_datetime(ts))
+        key = (user_id, date_str, hour)
+        buffer = self._buffers.setdefault(key, [])
+        buffer.append(capture)
+        if len(buffer) >= self.batch_size:
+            batch = self._buffers.pop(key)
+            task = asyncio.create_task(self._fold_batch(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fold(self, key: Tuple[str, str, int], partial: Optional[Dict[str, Any]],
+                    captures: List[Dict[str, Any]]) -> Dict[str, Any]:
+        user_id, date_str, hour = key
+        covered = set((partial or {}).get("captureIds", []))
+        captures = [c for c in captures if c.get("id") not in covered]
+        if not captures:
+            return partial or {"summary": {}, "captureIds": []}
+
+        prompt = (PromptBuilder(PROMPT_KIND_HOURLY, HOURLY_PARTIAL_PROMPT)
+                  .json("partial_json", (partial or {}).get("summary", {}))
+                  .items("captures_json", [_hourly_capture_item(c) for c in captures],
+                         _spread_priorities(len(captures)))
+                  .build())
+        result = await _call_gemini_text(prompt, GEMINI_PURPOSE_CONDENSE)
+        partial = {
+            "summary": {f: result.get(f) for f in _HOURLY_SUMMARY_FIELDS if f in result},
+            "captureIds": sorted(covered | {c.get("id") for c in captures}),
+        }
+        await repo.put_hourly_partial(user_id, date_str, hour, partial)
+        self._stats["folds"] += 1
+        self._stats["foldedCaptures"] += len(captures)
+        return partial
 
-    now_est = capture_ts.astimezone(EST)
-    hour_start = now_est.replace(
-        minute=0, second=0, microsecond=0) - timedelta(hours=1)
-    hour_end = hour_start + timedelta(hours=1) - timedelta(seconds=1)
+    async def _fold_batch(self, key: Tuple[str, str, int], batch: List[Dict[str, Any]]) -> None:
+        async with self._lock(key):
+            try:
+                partial = await repo.get_hourly_partial(*key)
+                await self._fold(key, partial, batch)
+            except Exception:
+                self._stats["foldErrors"] += 1
+                logger.exception("Hourly partial fold failed user=%s date=%s hour=%d", *key)
+
+    async def finalize(self, user_id: str, hour_start: datetime,
+                       captures: List[Dict[str, Any]],
+                       queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Finish the hour from its partial and return the summary fields."""
+        date_str, hour = _hour_period(hour_start)
+        key = (user_id, date_str, hour)
+        self._buffers.pop(key, None)
+        async with self._lock(key):
+            partial = await repo.get_hourly_partial(user_id, date_str, hour)
+            covered = set((partial or {}).get("captureIds", []))
+            remaining = [c for c in captures if c.get("id") not in covered]
+            # Fold full batches first so the final prompt stays bounded
+            while len(remaining) > self.batch_size:
+                partial = await self._fold(key, partial, remaining[:self.batch_size])
+                remaining = remaining[self.batch_size:]
+
+            prompt = (PromptBuilder(PROMPT_KIND_HOURLY, HOURLY_FINALIZE_PROMPT)
+                      .json("partial_json", (partial or {}).get("summary", {}))
+                      .items("captures_json", [_hourly_capture_item(c) for c in remaining],
+                             _spread_priorities(len(remaining)), empty="None")
+                      .items("queries_json", queries, empty="No queries this hour")
+                      .build())
+            result = await _call_gemini_text(prompt, GEMINI_PURPOSE_CONDENSE)
+            await repo.delete_hourly_partial(user_id, date_str, hour)
+        self._locks.pop(key, None)
+        self._stats["finalized"] += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "enabled": HOURLY_INCREMENTAL_ENABLED,
+            "bufferedHours": len(self._buffers),
+            "bufferedCaptures": sum(len(b) for b in self._buffers.values()),
+        }
+
+
+hourly_rollup = HourlyRollup(batch_size=HOURLY_PARTIAL_BATCH)
+
+
+async def _run_hourly_condensation(user_id: str, hour_start: datetime,
+                                   update_profile: bool = True) -> bool:
+    """Summarize the captures of the EST hour starting at `hour_start`.
 
+    Returns False when the hour had no captures (nothing is written).
+    """
     hour_start_utc = hour_start.astimezone(timezone.utc)
-    hour_end_utc = hour_end.astimezone(timezone.utc)
+    hour_end_utc = hour_start_utc + timedelta(hours=1) - timedelta(seconds=1)
 
     captures = await repo.list_captures_in_range(user_id, hour_start_utc, hour_end_utc)
-
     if not captures:
-        await repo.upsert_user_profile(user_id, {"lastCondensationTime": capture_ts})
-        return
-
-    captures_for_prompt = []
-    for c in captures:
-        ts = c.get("timestamp")
-        if isinstance(ts, datetime):
-            ts = ts.isoformat()
-        captures_for_prompt.append({
-            "timestamp": ts,
-            "transcription": c.get("transcription"),
-            "analysis": c.get("geminiAnalysis", {})
-        })
+        return False
 
     # Fetch queries made during this hour
     queries_for_prompt = []
@@ -1301,108 +4835,467 @@ async def _check_and_run_hourly_condensation(user_id: str, capture_ts: datetime)
                         "answer": q.get("answer", "")[:300]
                     })
 
-    try:
-        prompt = HOURLY_SUMMARY_PROMPT.format(
-            captures_json=json.dumps(captures_for_prompt, indent=2),
-            queries_json=json.dumps(
-                queries_for_prompt, indent=2) if queries_for_prompt else "No queries this hour"
-        )
-        summary_result = await _call_gemini_text(prompt)
-
-        date_str = hour_start.date().isoformat()
-        hour_num = hour_start.hour
-
-        await repo.create_hourly_summary(user_id, date_str, hour_num, {
-            "summary": summary_result.get("summary", ""),
-            "themes": summary_result.get("themes", []),
-            "events": summary_result.get("events", []),
-            "peoplePresent": summary_result.get("peoplePresent", []),
-            "locations": summary_result.get("locations", []),
-            "highlight": summary_result.get("highlight", ""),
-            "mood": summary_result.get("mood", ""),
-            "activities": summary_result.get("activities", []),
-            "captureIds": [c.get("id") for c in captures],
-            "captureCount": len(captures)
+    if HOURLY_INCREMENTAL_ENABLED:
+        summary_result = await hourly_rollup.finalize(
+            user_id, hour_start, captures, queries_for_prompt)
+    else:
+        # Over budget, captures are thinned evenly across the hour
+        prompt = (PromptBuilder(PROMPT_KIND_HOURLY, HOURLY_SUMMARY_PROMPT)
+                  .items("captures_json", [_hourly_capture_item(c) for c in captures],
+                         _spread_priorities(len(captures)))
+                  .items("queries_json", queries_for_prompt, empty="No queries this hour")
+                  .build())
+        summary_result = await _call_gemini_text(
+            prompt, GEMINI_PURPOSE_CONDENSE)
+
+    date_str = hour_start.date().isoformat()
+    hour_num = hour_start.hour
+
+    await repo.create_hourly_summary(user_id, date_str, hour_num, {
+        "summary": summary_result.get("summary", ""),
+        "themes": summary_result.get("themes", []),
+        "events": summary_result.get("events", []),
+        "peoplePresent": summary_result.get("peoplePresent", []),
+        "locations": summary_result.get("locations", []),
+        "highlight": summary_result.get("highlight", ""),
+        "mood": summary_result.get("mood", ""),
+        "activities": summary_result.get("activities", []),
+        "captureIds": [c.get("id") for c in captures],
+        "captureCount": len(captures)
+    })
+
+    if update_profile:
+        await repo.upsert_user_profile(user_id, {
+            "lastCondensationTime": datetime.now(timezone.utc),
+            "lastHourSummaryTime": hour_end_utc.isoformat(),
+            "lastHourSummary": summary_result.get("summary", "")
         })
+    answer_cache.invalidate(user_id, f"hourly:{date_str}",
+                            *(["profile"] if update_profile else []))
+
+    logger.info("Created hourly summary for user=%s date=%s hour=%d",
+                user_id, date_str, hour_num)
+    return True
+
+
+# =============================================================================
+# DAILY CONDENSATION
+# =============================================================================
+
+async def _run_daily_condensation(user_id: str, date_str: str,
+                                  update_profile: bool = True) -> bool:
+    """Summarize one EST day from its hourly summaries.
 
+    Returns False when the day has no hourly summaries.
+    """
+    hourly_summaries = await repo.list_hourly_summaries_for_date(user_id, date_str)
+    if not hourly_summaries:
+        return False
+
+    hourly_for_prompt = []
+    for h in hourly_summaries:
+        hourly_for_prompt.append({
+            "hour": h.get("hour"),
+            "summary": h.get("summary"),
+            "themes": h.get("themes"),
+            "events": h.get("events", []),
+            "peoplePresent": h.get("peoplePresent", []),
+            "locations": h.get("locations", []),
+            "activities": h.get("activities", []),
+            "mood": h.get("mood"),
+            "captureCount": h.get("captureCount", 0)
+        })
+
+    # Over budget, the busiest hours are kept
+    prompt = (PromptBuilder(PROMPT_KIND_DAILY, DAILY_SUMMARY_PROMPT)
+              .items("hourly_json", hourly_for_prompt,
+                     [h.get("captureCount") or 0 for h in hourly_for_prompt])
+              .build())
+    daily_result = await _call_gemini_text(
+        prompt, GEMINI_PURPOSE_CONDENSE)
+
+    await repo.create_daily_summary(user_id, date_str, {
+        "summary": daily_result.get("summary", ""),
+        "timeline": daily_result.get("timeline", []),
+        "themes": daily_result.get("themes", []),
+        "highlights": daily_result.get("highlights", []),
+        "mood": daily_result.get("mood", ""),
+        "peopleInteractions": daily_result.get("peopleInteractions", []),
+        "locations": daily_result.get("locations", []),
+        "accomplishments": daily_result.get("accomplishments", []),
+        "morningOverview": daily_result.get("morningOverview", ""),
+        "afternoonOverview": daily_result.get("afternoonOverview", ""),
+        "eveningOverview": daily_result.get("eveningOverview", ""),
+        "hourlyIds": [f"hourly_{user_id}_{date_str}_{h.get('hour', 0):02d}" for h in hourly_summaries],
+        "totalCaptures": sum(h.get("captureCount", 0) for h in hourly_summaries)
+    })
+
+    if update_profile:
         await repo.upsert_user_profile(user_id, {
-            "lastCondensationTime": capture_ts,
-            "lastHourSummaryTime": capture_ts.isoformat(),
-            "lastHourSummary": summary_result.get("summary", "")
+            "lastDaySummaryDate": date_str,
+            "lastDaySummary": daily_result.get("summary", "")
         })
+    answer_cache.invalidate(user_id, f"daily:{date_str}",
+                            *(["profile"] if update_profile else []))
 
-        logger.info("Created hourly summary for user=%s date=%s hour=%d",
-                    user_id, date_str, hour_num)
-    except Exception:
-        logger.exception("Hourly condensation failed for user=%s", user_id)
-        await repo.upsert_user_profile(user_id, {"lastCondensationTime": capture_ts})
+    logger.info("Created daily summary for user=%s date=%s",
+                user_id, date_str)
+    return True
 
 
 # =============================================================================
-# DAILY CONDENSATION (midnight EST check)
+# CONDENSATION SCHEDULER
 # =============================================================================
 
-async def _check_and_run_daily_condensation(user_id: str, capture_ts: datetime) -> None:
-    now_est = capture_ts.astimezone(EST)
-    yesterday_est = (now_est - timedelta(days=1)).date()
-    yesterday_str = yesterday_est.isoformat()
+CONDENSE_HOURLY = "hourly"
+CONDENSE_DAILY = "daily"
 
-    existing = await repo.get_daily_summary(user_id, yesterday_str)
-    if existing:
-        return
 
-    if now_est.hour < 1:
-        return
+@dataclass(order=True)
+class CondensationJob:
+    due: float
+    kind: str
+    user_id: str
+    # "YYYY-MM-DD" for daily jobs, "YYYY-MM-DDTHH" (EST) for hourly jobs
+    period: str
+    force: bool = False
+    backfill: bool = False
+    attempts: int = 0
 
-    hourly_summaries = await repo.list_hourly_summaries_for_date(user_id, yesterday_str)
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        return (self.kind, self.user_id, self.period)
 
-    if not hourly_summaries:
-        return
 
+class CondensationScheduler:
+    """Runs hourly and daily condensation once their period has closed.
+
+    Processed captures register their (user, hour) and (user, day) with
+    `note_capture`, which only touches memory. Jobs sit in a due-time heap
+    and run `hourly_delay`/`daily_delay` seconds after the boundary, at most
+    `concurrency` at a time. Finished periods go into a bounded completion
+    index so repeat registrations are free; before running, a job also
+    checks Firestore so restarts and other instances don't redo work.
+    A daily job waits while any hour of its day is still pending.
+
+    A capture registered after its period was due is late: the period is
+    reopened and re-summarized (forced) `late_debounce` seconds later. If
+    the period's job is running at that moment, it is rerun once it ends.
+    """
+
+    def __init__(self, concurrency: int, hourly_delay: float, daily_delay: float,
+                 max_retries: int, retry_seconds: float, done_max_entries: int = 50000,
+                 late_debounce: float = 0.0) -> None:
+        self.concurrency = max(1, concurrency)
+        self.hourly_delay = hourly_delay
+        self.daily_delay = daily_delay
+        self.late_debounce = late_debounce
+        self.max_retries = max_retries
+        self.retry_seconds = retry_seconds
+        self.done_max_entries = done_max_entries
+        self._heap: List[CondensationJob] = []
+        self._active: Dict[Tuple[str, str, str], CondensationJob] = {}
+        self._blocked: Dict[Tuple[str, str], CondensationJob] = {}
+        self._done: "OrderedDict[Tuple[str, str, str], None]" = OrderedDict()
+        self._latest: Dict[Tuple[str, str], str] = {}
+        # keys whose job is executing, and those of them that saw a late
+        # capture mid-run and must run again
+        self._executing: Set[Tuple[str, str, str]] = set()
+        self._stale: Set[Tuple[str, str, str]] = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        self._stats: Dict[str, int] = {
+            "scheduled": 0, "completed": 0, "empty": 0, "skipped": 0,
+            "failed": 0, "retried": 0, "shed": 0, "reopened": 0}
+
+    # -------------------------------------------------------------------------
+    # Lifecycle
+    # -------------------------------------------------------------------------
+    def start(self) -> None:
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._sem = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.create_task(self._run_loop())
+
+    async def stop(self) -> None:
+        tasks = ([self._task] if self._task else []) + list(self._running)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._running.clear()
+
+    # -------------------------------------------------------------------------
+    # Scheduling
+    # -------------------------------------------------------------------------
+    def _push(self, job: CondensationJob) -> bool:
+        if job.key in self._active:
+            return False
+        if not job.force and job.key in self._done:
+            return False
+        self._active[job.key] = job
+        heapq.heappush(self._heap, job)
+        self._stats["scheduled"] += 1
+        if self._wake:
+            self._wake.set()
+        return True
+
+    def _hour_job(self, user_id: str, hour_start: datetime, **kwargs: Any) -> CondensationJob:
+        hour_start = _est_hour_start(hour_start)
+        due = hour_start.timestamp() + 3600 + self.hourly_delay
+        period = f"{hour_start.date().isoformat()}T{hour_start.hour:02d}"
+        return CondensationJob(due, CONDENSE_HOURLY, user_id, period, **kwargs)
+
+    def _day_job(self, user_id: str, day: date, **kwargs: Any) -> CondensationJob:
+        due = _est_day_end(day).timestamp() + self.daily_delay
+        return CondensationJob(due, CONDENSE_DAILY, user_id, day.isoformat(), **kwargs)
+
+    def schedule_hour(self, user_id: str, hour_start: datetime,
+                      force: bool = False, backfill: bool = False) -> bool:
+        return self._push(self._hour_job(user_id, hour_start, force=force, backfill=backfill))
+
+    def schedule_day(self, user_id: str, day: date,
+                     force: bool = False, backfill: bool = False) -> bool:
+        return self._push(self._day_job(user_id, day, force=force, backfill=backfill))
+
+    def note_capture(self, user_id: str, capture_ts: datetime) -> None:
+        """Register the hour and day a freshly processed capture belongs to."""
+        now = time.time()
+        for job in (self._hour_job(user_id, capture_ts),
+                    self._day_job(user_id, capture_ts.astimezone(EST).date())):
+            if job.due <= now:
+                self._reopen(job, now)
+            else:
+                self._push(job)
+
+    def _reopen(self, job: CondensationJob, now: float) -> None:
+        """Re-summarize a period whose summary may predate a late capture."""
+        if job.key in self._executing:
+            self._stale.add(job.key)
+            return
+        pending = self._active.get(job.key)
+        if pending is not None:
+            # Not started yet, so it will read the capture; make sure an
+            # existing summary doesn't make it skip
+            pending.force = True
+            return
+        self._done.pop(job.key, None)
+        job.force = True
+        job.due = now + self.late_debounce
+        if self._push(job):
+            self._stats["reopened"] += 1
+
+    def backfill(self, user_id: str, start_day: date, end_day: date, force: bool = False) -> int:
+        """Queue every hour and day in [start_day, end_day] (EST) for a user.
+
+        Periods that are still open keep their normal due time; hours with
+        no captures finish without a Gemini call.
+        """
+        count = 0
+        day = start_day
+        while day <= end_day:
+            hour = datetime.combine(day, datetime.min.time(), tzinfo=EST)
+            while hour.date() == day:
+                count += self.schedule_hour(user_id, hour, force=force, backfill=True)
+                hour = (hour.astimezone(timezone.utc) + timedelta(hours=1)).astimezone(EST)
+            count += self.schedule_day(user_id, day, force=force, backfill=True)
+            day += timedelta(days=1)
+        return count
+
+    async def recover(self, hours: int) -> int:
+        """Re-register periods touched by captures in the last `hours` hours,
+        so summaries still happen after a restart."""
+        since = datetime.now(timezone.utc) - timedelta(hours=hours)
+        seen = await repo.list_capture_periods_since(since)
+        for user_id, ts in seen:
+            # Not note_capture: these are old captures, not late ones
+            self.schedule_hour(user_id, ts)
+            self.schedule_day(user_id, ts.astimezone(EST).date())
+        return len(seen)
+
+    # -------------------------------------------------------------------------
+    # Execution
+    # -------------------------------------------------------------------------
+    def _mark_done(self, key: Tuple[str, str, str]) -> None:
+        self._done[key] = None
+        self._done.move_to_end(key)
+        while len(self._done) > self.done_max_entries:
+            self._done.popitem(last=False)
+
+    def _day_has_pending_hours(self, user_id: str, date_str: str) -> bool:
+        prefix = f"{date_str}T"
+        return any(kind == CONDENSE_HOURLY and uid == user_id and period.startswith(prefix)
+                   for kind, uid, period in self._active)
+
+    async def _run_loop(self) -> None:
+        while True:
+            self._wake.clear()
+            now = time.time()
+            while self._heap and self._heap[0].due <= now:
+                job = heapq.heappop(self._heap)
+                if job.kind == CONDENSE_DAILY and self._day_has_pending_hours(job.user_id, job.period):
+                    # Released by _release_daily when the day's last hour finishes
+                    self._blocked[(job.user_id, job.period)] = job
+                    continue
+                task = asyncio.create_task(self._run_job(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            timeout = (self._heap[0].due - now) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _release_daily(self, job: CondensationJob) -> None:
+        if job.kind != CONDENSE_HOURLY:
+            return
+        date_str = job.period.split("T")[0]
+        daily = self._blocked.get((job.user_id, date_str))
+        if daily and not self._day_has_pending_hours(job.user_id, date_str):
+            del self._blocked[(job.user_id, date_str)]
+            heapq.heappush(self._heap, daily)
+            self._wake.set()
+
+    async def _already_done(self, job: CondensationJob) -> bool:
+        if job.kind == CONDENSE_DAILY:
+            return bool(await repo.get_daily_summary(job.user_id, job.period))
+        date_str, hour = job.period.split("T")
+        return bool(await repo.get_hourly_summary(job.user_id, date_str, int(hour)))
+
+    def _is_latest(self, job: CondensationJob) -> bool:
+        marker = (job.kind, job.user_id)
+        if job.period >= self._latest.get(marker, ""):
+            self._latest[marker] = job.period
+            return True
+        return False
+
+    async def _run_job(self, job: CondensationJob) -> None:
+        async with self._sem:
+            start = time.perf_counter()
+            self._executing.add(job.key)
+            try:
+                if not job.force and await self._already_done(job):
+                    outcome = "skipped"
+                elif job.kind == CONDENSE_HOURLY:
+                    date_str, hour = job.period.split("T")
+                    hour_start = datetime.combine(
+                        date.fromisoformat(date_str), datetime.min.time(), tzinfo=EST
+                    ).replace(hour=int(hour))
+                    ran = await _run_hourly_condensation(
+                        job.user_id, hour_start,
+                        update_profile=not job.backfill and self._is_latest(job))
+                    outcome = "completed" if ran else "empty"
+                else:
+                    ran = await _run_daily_condensation(
+                        job.user_id, job.period,
+                        update_profile=not job.backfill and self._is_latest(job))
+                    outcome = "completed" if ran else "empty"
+            except asyncio.CancelledError:
+                raise
+            except GeminiUnavailable as e:
+                # Shed by the Gemini breaker; doesn't count as an attempt
+                self._finish_executing(job)
+                self._active.pop(job.key, None)
+                job.due = time.time() + e.retry_after + random.uniform(0, self.retry_seconds)
+                self._stats["shed"] += 1
+                self._push(job)
+                logger.warning("%s condensation deferred user=%s period=%s: %s",
+                               job.kind.capitalize(), job.user_id, job.period, e)
+                return
+            except Exception:
+                self._finish_executing(job)
+                self._active.pop(job.key, None)
+                if job.attempts < self.max_retries:
+                    job.attempts += 1
+                    job.due = time.time() + self.retry_seconds * (2 ** (job.attempts - 1))
+                    self._stats["retried"] += 1
+                    self._push(job)
+                else:
+                    self._stats["failed"] += 1
+                    self._release_daily(job)
+                logger.exception("%s condensation failed user=%s period=%s attempt=%d",
+                                 job.kind.capitalize(), job.user_id, job.period, job.attempts)
+                return
+
+        if outcome != "skipped":
+            CONDENSATION_SECONDS.since(start, kind=job.kind)
+        stale = self._finish_executing(job)
+        self._active.pop(job.key, None)
+        self._mark_done(job.key)
+        self._stats[outcome] += 1
+        if stale:
+            # A late capture arrived while this ran; the summary may miss it
+            self._reopen(replace(job, attempts=0, backfill=False), time.time())
+        self._release_daily(job)
+
+    def _finish_executing(self, job: CondensationJob) -> bool:
+        """Clear the running marker; True if a late capture came in mid-run.
+        A retried job re-reads its captures, so it is forced instead."""
+        self._executing.discard(job.key)
+        if job.key not in self._stale:
+            return False
+        self._stale.discard(job.key)
+        job.force = True
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "pending": len(self._heap) + len(self._blocked),
+            "running": len(self._running),
+            "completedIndex": len(self._done),
+            "nextDueInSeconds": round(self._heap[0].due - time.time(), 1) if self._heap else None,
+        }
+
+
+condensation_scheduler = CondensationScheduler(
+    concurrency=CONDENSE_CONCURRENCY,
+    hourly_delay=CONDENSE_HOURLY_DELAY_SECONDS,
+    daily_delay=CONDENSE_DAILY_DELAY_SECONDS,
+    max_retries=CONDENSE_MAX_RETRIES,
+    retry_seconds=CONDENSE_RETRY_SECONDS,
+    late_debounce=CONDENSE_LATE_DEBOUNCE_SECONDS,
+)
+
+
+@app.on_event("startup")
+async def _start_condensation_scheduler() -> None:
+    condensation_scheduler.start()
     try:
-        hourly_for_prompt = []
-        for h in hourly_summaries:
-            hourly_for_prompt.append({
-                "hour": h.get("hour"),
-                "summary": h.get("summary"),
-                "themes": h.get("themes"),
-                "events": h.get("events", []),
-                "peoplePresent": h.get("peoplePresent", []),
-                "locations": h.get("locations", []),
-                "activities": h.get("activities", []),
-                "mood": h.get("mood"),
-                "captureCount": h.get("captureCount", 0)
-            })
+        count = await condensation_scheduler.recover(CONDENSE_RECOVERY_HOURS)
+        logger.info("Condensation scheduler recovered %d recent captures", count)
+    except Exception:
+        logger.exception("Condensation scheduler recovery failed")
+
+
+@app.on_event("shutdown")
+async def _stop_condensation_scheduler() -> None:
+    await condensation_scheduler.stop()
 
-        prompt = DAILY_SUMMARY_PROMPT.format(
-            hourly_json=json.dumps(hourly_for_prompt, indent=2))
-        daily_result = await _call_gemini_text(prompt)
-
-        await repo.create_daily_summary(user_id, yesterday_str, {
-            "summary": daily_result.get("summary", ""),
-            "timeline": daily_result.get("timeline", []),
-            "themes": daily_result.get("themes", []),
-            "highlights": daily_result.get("highlights", []),
-            "mood": daily_result.get("mood", ""),
-            "peopleInteractions": daily_result.get("peopleInteractions", []),
-            "locations": daily_result.get("locations", []),
-            "accomplishments": daily_result.get("accomplishments", []),
-            "morningOverview": daily_result.get("morningOverview", ""),
-            "afternoonOverview": daily_result.get("afternoonOverview", ""),
-            "eveningOverview": daily_result.get("eveningOverview", ""),
-            "hourlyIds": [f"hourly_{user_id}_{yesterday_str}_{h.get('hour', 0):02d}" for h in hourly_summaries],
-            "totalCaptures": sum(h.get("captureCount", 0) for h in hourly_summaries)
-        })
 
-        await repo.upsert_user_profile(user_id, {
-            "lastDaySummaryDate": yesterday_str,
-            "lastDaySummary": daily_result.get("summary", "")
-        })
+class CondenseRequest(BaseModel):
+    startDate: str
+    endDate: Optional[str] = None
+    force: bool = False
 
-        logger.info("Created daily summary for user=%s date=%s",
-                    user_id, yesterday_str)
-    except Exception:
-        logger.exception("Daily condensation failed for user=%s", user_id)
+
+@app.post("/condense/{user_id}")
+async def trigger_condensation(user_id: str, request: CondenseRequest) -> Dict[str, Any]:
+    """Backfill hourly and daily summaries for a date range (EST dates)."""
+    try:
+        start_day = date.fromisoformat(request.startDate)
+        end_day = date.fromisoformat(request.endDate or request.startDate)
+        if end_day < start_day:
+            return {"status": "error", "error": "endDate is before startDate"}
+        if (end_day - start_day).days > 31:
+            return {"status": "error", "error": "Backfill is limited to 31 days"}
+        scheduled = condensation_scheduler.backfill(
+            user_id, start_day, end_day, force=request.force)
+        return {"status": "success", "scheduled": scheduled}
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}
 
 
 # =============================================================================
@@ -1410,23 +5303,40 @@ async def _check_and_run_daily_condensation(user_id: str, capture_ts: datetime)
 # =============================================================================
 
 async def _process_capture_async(user_id: str, capture_id: str, capture_ts: datetime) -> None:
+    """Run the full analysis pipeline for one capture.
+
+    Failures are recorded on the capture and re-raised so the capture queue
+    can retry the job.
+    """
     try:
         capture_doc = await repo.get_capture(capture_id)
         if not capture_doc:
             logger.error("Capture not found: %s", capture_id)
             return
 
+        start = time.perf_counter()
         analysis = await _analyze_capture_with_gemini(capture_doc)
+        CAPTURE_ANALYSIS_SECONDS.since(start)
 
         await repo.update_capture(capture_id, {
             "processed": True,
             "geminiAnalysis": analysis,
         })
+        answer_cache.invalidate(
+            user_id, f"captures:{capture_ts.astimezone(timezone.utc).date().isoformat()}")
+        recent_activity.add(user_id, {**capture_doc, "geminiAnalysis": analysis})
+
+        try:
+            await capture_index.add(
+                user_id, {**capture_doc, "geminiAnalysis": analysis})
+        except Exception:
+            logger.exception("Failed to index capture=%s", capture_id)
 
         await _update_contacts_from_analysis(user_id, analysis, capture_doc)
 
-        await _check_and_run_hourly_condensation(user_id, capture_ts)
-        await _check_and_run_daily_condensation(user_id, capture_ts)
+        if HOURLY_INCREMENTAL_ENABLED:
+            hourly_rollup.note(user_id, {**capture_doc, "geminiAnalysis": analysis})
+        condensation_scheduler.note_capture(user_id, capture_ts)
 
         day_key = _date_key_from_dt(capture_ts)
         await manager.broadcast_unity(user_id, {
@@ -1436,6 +5346,9 @@ async def _process_capture_async(user_id: str, capture_id: str, capture_ts: date
         })
 
         logger.info("Processed capture=%s user=%s", capture_id, user_id)
+    except GeminiUnavailable as e:
+        logger.warning("Deferring capture=%s user=%s: %s", capture_id, user_id, e)
+        raise
     except Exception:
         logger.exception(
             "Processing failed for capture=%s user=%s", capture_id, user_id)
@@ -1446,6 +5359,377 @@ async def _process_capture_async(user_id: str, capture_id: str, capture_ts: date
             })
         except Exception:
             logger.exception("Failed to mark capture processing failure")
+        raise
+
+
+# =============================================================================
+# CAPTURE PROCESSING QUEUE
+# =============================================================================
+# Captures are processed by a fixed pool of workers instead of one task per
+# message. Users are served round-robin so a burst from one pair of glasses
+# can't starve everyone else, live captures beat retries/recovered work, and
+# the depth limits let ws_ios push back (or defer to the startup/periodic
+# recovery pass, which re-enqueues anything still marked processed=False).
+
+CAPTURE_PRIORITY_LIVE = 0
+CAPTURE_PRIORITY_BACKGROUND = 1  # retries and recovered captures
+
+
+class CaptureQueueFull(Exception):
+    """Raised when a capture can't be enqueued because of depth limits."""
+
+
+@dataclass
+class CaptureJob:
+    user_id: str
+    capture_id: str
+    capture_ts: datetime
+    priority: int = CAPTURE_PRIORITY_LIVE
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class CaptureJobQueue:
+    def __init__(self, workers: int, max_depth: int, max_per_user: int,
+                 max_inflight_per_user: int, max_retries: int,
+                 retry_base_seconds: float) -> None:
+        self.workers = max(1, workers)
+        self.max_depth = max_depth
+        self.max_per_user = max_per_user
+        self.max_inflight_per_user = max(1, max_inflight_per_user)
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+
+        # user_id -> one deque per priority level
+        self._pending: Dict[str, List[Deque[CaptureJob]]] = {}
+        self._rotation: Deque[str] = deque()
+        self._inflight: Dict[str, int] = {}
+        # capture ids queued, running or waiting for a retry (dedupe)
+        self._known: Set[str] = set()
+        # capture ids being processed right now, and those of them whose
+        # inputs changed mid-run (e.g. the photo arrived) and need another pass
+        self._running: Set[str] = set()
+        self._rerun: Dict[str, CaptureJob] = {}
+        self._depth = 0
+        self._cond = asyncio.Condition()
+        self._tasks: List[asyncio.Task] = []
+        self._retry_handles: Set[asyncio.TimerHandle] = set()
+        # retries whose timer fired, waiting on the condition to re-enqueue
+        self._requeues: Set[asyncio.Task] = set()
+        self._deferred_since_sweep = 0
+        self._stats: Dict[str, int] = {
+            "enqueued": 0,
+            "processed": 0,
+            "failed": 0,
+            "retried": 0,
+            "deferred": 0,
+            "recovered": 0,
+            "shed": 0,
+            "reruns": 0,
+        }
+
+    # -------------------------------------------------------------------------
+    # Lifecycle
+    # -------------------------------------------------------------------------
+    def start(self) -> None:
+        if self._tasks:
+            return
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+        self._tasks.append(asyncio.create_task(self._recovery_loop()))
+        logger.info("Capture queue started workers=%d max_depth=%d",
+                    self.workers, self.max_depth)
+
+    async def stop(self) -> None:
+        for handle in self._retry_handles:
+            handle.cancel()
+        self._retry_handles.clear()
+        for task in (*self._tasks, *self._requeues):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._requeues, return_exceptions=True)
+        self._tasks = []
+
+    # -------------------------------------------------------------------------
+    # Enqueueing
+    # -------------------------------------------------------------------------
+    def _user_depth(self, user_id: str) -> int:
+        return sum(len(q) for q in self._pending.get(user_id, []))
+
+    def _has_room(self, user_id: str) -> bool:
+        return (self._depth < self.max_depth
+                and self._user_depth(user_id) < self.max_per_user)
+
+    def _push(self, job: CaptureJob) -> None:
+        queues = self._pending.get(job.user_id)
+        if queues is None:
+            queues = [deque(), deque()]
+            self._pending[job.user_id] = queues
+            self._rotation.append(job.user_id)
+        queues[job.priority].append(job)
+        self._known.add(job.capture_id)
+        self._depth += 1
+        self._cond.notify()
+
+    async def put(self, job: CaptureJob, timeout: float = 0.0) -> bool:
+        """Enqueue a job, waiting up to `timeout` seconds for space.
+
+        Returns False if the capture is already queued or running. Raises
+        CaptureQueueFull if there is still no room once the timeout expires.
+        """
+        async with self._cond:
+            if job.capture_id in self._known:
+                return False
+            if not self._has_room(job.user_id):
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(
+                            lambda: self._has_room(job.user_id)),
+                        timeout=timeout)
+                except asyncio.TimeoutError:
+                    self._stats["deferred"] += 1
+                    self._deferred_since_sweep += 1
+                    raise CaptureQueueFull(
+                        f"capture queue full (depth={self._depth})")
+                if job.capture_id in self._known:
+                    return False
+            self._push(job)
+            self._stats["enqueued"] += 1
+            return True
+
+    async def rerun(self, job: CaptureJob) -> str:
+        """Make sure the capture gets a pass that starts after this call.
+
+        A queued or retry-pending capture will already see the new inputs; a
+        running one is flagged and re-enqueued when its current pass ends.
+        Returns "queued", "rerun" or "pending".
+        """
+        async with self._cond:
+            if job.capture_id in self._running:
+                self._rerun.setdefault(job.capture_id, job)
+                return "rerun"
+            if job.capture_id in self._known:
+                return "pending"
+            # Finished between the caller's put() and now
+            self._push(job)
+            self._stats["enqueued"] += 1
+            return "queued"
+
+    def _requeue(self, job: CaptureJob) -> None:
+        # Retries already hold a slot in `_known`; bypass depth limits so an
+        # accepted capture is never dropped.
+        async def _push_later() -> None:
+            async with self._cond:
+                self._push(job)
+        task = asyncio.create_task(_push_later())
+        self._requeues.add(task)
+        task.add_done_callback(self._requeues.discard)
+
+    # -------------------------------------------------------------------------
+    # Workers
+    # -------------------------------------------------------------------------
+    def _next_job(self) -> Optional[CaptureJob]:
+        for priority in (CAPTURE_PRIORITY_LIVE, CAPTURE_PRIORITY_BACKGROUND):
+            for _ in range(len(self._rotation)):
+                user_id = self._rotation[0]
+                self._rotation.rotate(-1)
+                queues = self._pending[user_id]
+                if not queues[priority]:
+                    continue
+                if self._inflight.get(user_id, 0) >= self.max_inflight_per_user:
+                    continue
+                job = queues[priority].popleft()
+                if not queues[0] and not queues[1]:
+                    del self._pending[user_id]
+                    self._rotation.remove(user_id)
+                return job
+        return None
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            async with self._cond:
+                job = self._next_job()
+                while job is None:
+                    await self._cond.wait()
+                    job = self._next_job()
+                self._depth -= 1
+                self._inflight[job.user_id] = self._inflight.get(
+                    job.user_id, 0) + 1
+                self._running.add(job.capture_id)
+                # Room for a producer (and possibly a job for another worker)
+                self._cond.notify_all()
+
+            retry = False
+            delay: Optional[float] = None
+            try:
+                await _process_capture_async(
+                    job.user_id, job.capture_id, job.capture_ts)
+                self._stats["processed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except GeminiUnavailable as e:
+                # Shed while Gemini is degraded: wait out the breaker without
+                # using up one of the capture's attempts
+                retry, delay = True, e.retry_after
+                self._stats["shed"] += 1
+            except Exception:
+                job.attempts += 1
+                retry = job.attempts <= self.max_retries
+                if not retry:
+                    self._stats["failed"] += 1
+                    # Still processed=False; let the next recovery sweep
+                    # pick it up once upstream has had time to recover
+                    self._deferred_since_sweep += 1
+                    logger.error("Capture %s failed after %d attempts; leaving "
+                                 "for recovery", job.capture_id, job.attempts)
+            finally:
+                async with self._cond:
+                    self._inflight[job.user_id] -= 1
+                    if not self._inflight[job.user_id]:
+                        del self._inflight[job.user_id]
+                    self._running.discard(job.capture_id)
+                    rerun = self._rerun.pop(job.capture_id, None)
+                    if rerun is not None and not retry:
+                        # Keeps its `_known` slot; bypasses depth limits like
+                        # a retry so the late upload is never dropped
+                        self._stats["reruns"] += 1
+                        self._push(rerun)
+                    elif not retry:
+                        self._known.discard(job.capture_id)
+                    self._cond.notify_all()
+
+            if retry:
+                self._schedule_retry(job, delay)
+
+    def _schedule_retry(self, job: CaptureJob, delay: Optional[float] = None) -> None:
+        if delay is None:
+            delay = self.retry_base_seconds * (2 ** (job.attempts - 1))
+        delay += random.uniform(0, self.retry_base_seconds)
+        job.priority = CAPTURE_PRIORITY_BACKGROUND
+        job.enqueued_at = time.monotonic() + delay
+        self._stats["retried"] += 1
+        logger.warning("Retrying capture %s in %.1fs (attempt %d/%d)",
+                       job.capture_id, delay, job.attempts, self.max_retries)
+
+        loop = asyncio.get_running_loop()
+        handle: Optional[asyncio.TimerHandle] = None
+
+        def _fire() -> None:
+            self._retry_handles.discard(handle)
+            self._requeue(job)
+
+        handle = loop.call_later(delay, _fire)
+        self._retry_handles.add(handle)
+
+    # -------------------------------------------------------------------------
+    # Recovery
+    # -------------------------------------------------------------------------
+    async def recover(self, limit: int = CAPTURE_RECOVERY_LIMIT) -> int:
+        """Re-enqueue captures still marked processed=False."""
+        try:
+            docs = await repo.list_unprocessed_captures(limit)
+        except Exception:
+            logger.exception("Capture recovery scan failed")
+            return 0
+
+        recovered = 0
+        for doc in docs:
+            try:
+                ts = _parse_iso_datetime(doc.get("timestamp"))
+                job = CaptureJob(doc["userId"], doc["id"], ts,
+                                 priority=CAPTURE_PRIORITY_BACKGROUND)
+                if await self.put(job):
+                    recovered += 1
+            except CaptureQueueFull:
+                break
+            except Exception:
+                logger.warning("Skipping unrecoverable capture %s",
+                               doc.get("id"))
+        self._stats["recovered"] += recovered
+        if recovered:
+            logger.info("Re-enqueued %d unprocessed captures", recovered)
+        return recovered
+
+    async def _recovery_loop(self) -> None:
+        await self.recover()
+        while True:
+            await asyncio.sleep(CAPTURE_RECOVERY_INTERVAL_SECONDS)
+            if self._deferred_since_sweep and self._depth < self.max_depth // 2:
+                self._deferred_since_sweep = 0
+                await self.recover()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "depth": self._depth,
+            "inflight": sum(self._inflight.values()),
+            "users": len(self._pending),
+            "workers": self.workers,
+            "maxDepth": self.max_depth,
+        }
+
+
+capture_queue = CaptureJobQueue(
+    workers=CAPTURE_WORKERS,
+    max_depth=CAPTURE_QUEUE_MAX_DEPTH,
+    max_per_user=CAPTURE_QUEUE_MAX_PER_USER,
+    max_inflight_per_user=CAPTURE_MAX_INFLIGHT_PER_USER,
+    max_retries=CAPTURE_MAX_RETRIES,
+    retry_base_seconds=CAPTURE_RETRY_BASE_SECONDS,
+)
+
+
+@app.on_event("startup")
+async def _start_capture_queue() -> None:
+    capture_queue.start()
+
+
+@app.on_event("shutdown")
+async def _stop_capture_queue() -> None:
+    await capture_queue.stop()
+
+
+@app.on_event("startup")
+async def _start_contact_updates() -> None:
+    contact_updates.start()
+
+
+@app.on_event("shutdown")
+async def _flush_contact_updates() -> None:
+    # Registered after the capture queue so in-flight captures are stopped
+    # before the final flush.
+    await contact_updates.stop()
+
+
+@app.get("/stats")
+async def get_stats() -> Dict[str, Any]:
+    return {
+        "status": "ok",
+        "captureQueue": capture_queue.stats(),
+        "gemini": gemini.stats(),
+        "captureBatcher": capture_batcher.stats(),
+        "userCache": repo.cache_stats(),
+        "captureIndex": capture_index.stats(),
+        "recentActivity": recent_activity.stats(),
+        "answerCache": answer_cache.stats(),
+        "contactUpdates": contact_updates.stats(),
+        "condensation": condensation_scheduler.stats(),
+        "hourlyRollup": hourly_rollup.stats(),
+        "prompts": prompt_stats(),
+        "imagePreprocessor": image_preprocessor.stats(),
+        "mediaCache": media_cache.stats(),
+        "mediaIO": media_io.stats(),
+        "tts": tts_service.stats(),
+    }
+
+
+INFLIGHT_TASKS.set_function(lambda: capture_queue.stats()["inflight"], kind="capture")
+INFLIGHT_TASKS.set_function(lambda: condensation_scheduler.stats()["running"], kind="condensation")
+
+
+@app.get("/metrics")
+async def get_metrics() -> PlainTextResponse:
+    """Prometheus text exposition of the METRICS section."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 
 @app.websocket("/ws/ios/{user_id}")
@@ -1514,22 +5798,32 @@ async def ws_ios(websocket: WebSocket, user_id: str) -> None:
 
                 await repo.create_capture(doc)
 
+                # Backpressure: wait briefly for queue space, otherwise defer.
+                # Deferred captures stay processed=False in the DB and are
+                # picked up by the queue's recovery pass.
+                status = "received"
+                try:
+                    await capture_queue.put(
+                        CaptureJob(user_id, capture_id, ts),
+                        timeout=CAPTURE_ENQUEUE_TIMEOUT_SECONDS)
+                except CaptureQueueFull:
+                    status = "deferred"
+                    logger.warning(
+                        "[SEND_DATA] user=%s capture=%s deferred, queue full",
+                        user_id, capture_id)
+
                 ack_ts = ts.astimezone(
                     timezone.utc).isoformat().replace("+00:00", "Z")
                 await manager.send_json(
                     websocket,
                     {
                         "type": "ack",
-                        "status": "received",
+                        "status": status,
                         "captureId": capture_id,
                         "timestamp": ack_ts,
                     },
                 )
 
-                # Non-blocking processing
-                asyncio.create_task(
-                    _process_capture_async(user_id, capture_id, ts))
-
             except Exception as e:
                 logger.exception(
                     "Failed to handle iOS message user=%s", user_id)
@@ -1559,38 +5853,559 @@ def _serialize_capture(doc: Dict[str, Any]) -> Dict[str, Any]:
     return out
 
 
+# =============================================================================
+# ANSWER CACHE
+# =============================================================================
+# Patients often repeat a question within minutes. Final answers are cached
+# per user under the normalized question (plus date range / face options),
+# with the previously generated audioURL, so a repeat skips both Gemini calls
+# and TTS. Rewordings match through the capture index's embedding provider.
+#
+# Each entry records the version of every data tag its answer read:
+#   "profile", "contacts", "captures:<date>", "hourly:<date>", "daily:<date>"
+# Writers bump tags (a processed capture bumps its day's "captures" tag, a
+# new summary its "hourly"/"daily" tag and "profile"), so only answers that
+# depended on the changed data go stale. Versions are snapshotted when the
+# query starts, so data that changes while an answer is being generated
+# invalidates it too.
+
+_ANSWER_NORMALIZE_RE = re.compile(r"[^\w\s']")
+# Response fields that belong to one delivery rather than to the answer
+_ANSWER_PER_QUERY_FIELDS = frozenset(
+    ("queryId", "audioURL", "timings", "streamed", "audioChunks"))
+
+
+@dataclass
+class _AnswerEntry:
+    key: str
+    scope: str
+    response: Dict[str, Any]
+    deps: Dict[str, int]
+    audio_url: Optional[str]
+    expires: float
+    vector: Any = None
+
+
+class AnswerCache:
+    def __init__(self, ttl_seconds: float, max_per_user: int, similarity: float,
+                 provider: Any = None) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_per_user = max(1, max_per_user)
+        self.similarity = similarity
+        self.provider = provider if np is not None else None
+        self._users: Dict[str, "OrderedDict[str, _AnswerEntry]"] = {}
+        self._versions: Dict[str, Dict[str, int]] = {}
+        self._stats: Dict[str, int] = {
+            "hits": 0, "semanticHits": 0, "misses": 0, "stale": 0,
+            "stores": 0, "invalidations": 0}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(_ANSWER_NORMALIZE_RE.sub(" ", text.lower()).split())
+
+    @staticmethod
+    def scope(date_range: Optional[Dict], include_faces: bool, max_images: int) -> str:
+        return json.dumps([date_range, bool(include_faces), max_images],
+                          sort_keys=True, default=str)
+
+    def snapshot(self, user_id: str) -> Dict[str, int]:
+        return dict(self._versions.get(user_id, {}))
+
+    def invalidate(self, user_id: str, *tags: str) -> None:
+        versions = self._versions.setdefault(user_id, {})
+        for tag in tags:
+            versions[tag] = versions.get(tag, 0) + 1
+        self._stats["invalidations"] += 1
+
+    def _fresh(self, user_id: str, entry: _AnswerEntry) -> bool:
+        if entry.expires < time.monotonic():
+            return False
+        versions = self._versions.get(user_id, {})
+        return all(versions.get(tag, 0) == v for tag, v in entry.deps.items())
+
+    async def _embed(self, text: str) -> Any:
+        if self.provider is None or self.similarity > 1.0:
+            return None
+        try:
+            return await self.provider.embed_query(text)
+        except Exception:
+            logger.warning("Answer cache embedding failed", exc_info=True)
+            return None
+
+    async def lookup(self, user_id: str, query_text: str, scope: str) -> Tuple[Optional[_AnswerEntry], Any]:
+        """Fresh entry for the question, if any, and the question's
+        embedding (reused by put on a miss)."""
+        entries = self._users.get(user_id)
+        key = f"{scope}|{self.normalize(query_text)}"
+        if entries:
+            for k in [k for k, e in entries.items() if not self._fresh(user_id, e)]:
+                del entries[k]
+                self._stats["stale"] += 1
+            entry = entries.get(key)
+            if entry is not None:
+                entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry, None
+
+        vector = await self._embed(self.normalize(query_text))
+        entries = self._users.get(user_id)
+        if vector is not None and entries:
+            best, best_score = None, self.similarity
+            for entry in entries.values():
+                if entry.scope != scope or entry.vector is None or not self._fresh(user_id, entry):
+                    continue
+                score = float(np.dot(entry.vector, vector))
+                if score >= best_score:
+                    best, best_score = entry, score
+            if best is not None:
+                entries.move_to_end(best.key)
+                self._stats["hits"] += 1
+                self._stats["semanticHits"] += 1
+                return best, vector
+        self._stats["misses"] += 1
+        return None, vector
+
+    def put(self, user_id: str, query_text: str, scope: str, response: Dict[str, Any],
+            deps: List[str], versions: Dict[str, int], audio_url: Optional[str],
+            vector: Any = None) -> None:
+        """Cache a final answer. `versions` is the snapshot taken when the
+        query started; nothing is stored if a dependency changed since."""
+        current = self._versions.get(user_id, {})
+        dep_versions = {tag: versions.get(tag, 0) for tag in deps}
+        if any(current.get(tag, 0) != v for tag, v in dep_versions.items()):
+            return
+        key = f"{scope}|{self.normalize(query_text)}"
+        entries = self._users.setdefault(user_id, OrderedDict())
+        response = {k: v for k, v in response.items() if k not in _ANSWER_PER_QUERY_FIELDS}
+        entries[key] = _AnswerEntry(
+            key, scope, copy.deepcopy(response), dep_versions, audio_url,
+            time.monotonic() + self.ttl_seconds, vector)
+        entries.move_to_end(key)
+        while len(entries) > self.max_per_user:
+            entries.popitem(last=False)
+        self._stats["stores"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "users": len(self._users),
+            "entries": sum(len(e) for e in self._users.values()),
+            "hitRate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+
+answer_cache = AnswerCache(
+    ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_PER_USER, ANSWER_CACHE_SIMILARITY,
+    capture_index.provider)
+
+
+def _cached_query_response(entry: _AnswerEntry, started: float) -> Dict[str, Any]:
+    result = copy.deepcopy(entry.response)
+    result["cached"] = True
+    result["timings"] = {"cacheMs": _elapsed_ms(started), "totalMs": _elapsed_ms(started)}
+    return result
+
+
+# =============================================================================
+# RECENT ACTIVITY WINDOW
+# =============================================================================
+# Per-user ring of the most recent processed captures (analysis +
+# transcription), filled as captures finish processing. "What did I just
+# do?" questions are answered from it directly, skipping the router and the
+# per-day Firestore reads. A user's ring is rehydrated once per process from
+# list_captures_in_range, so it is complete after a restart.
+
+class RecentActivityWindow:
+    def __init__(self, window_minutes: int, max_items: int) -> None:
+        self.window = timedelta(minutes=window_minutes)
+        self.max_items = max(1, max_items)
+        self._users: Dict[str, Deque[Tuple[datetime, Dict[str, Any]]]] = {}
+        self._hydrated: Set[str] = set()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._stats: Dict[str, int] = {"added": 0, "reads": 0, "hydrations": 0}
+
+    @staticmethod
+    def _item(capture: Dict[str, Any]) -> Optional[Tuple[datetime, Dict[str, Any]]]:
+        analysis = capture.get("geminiAnalysis")
+        if not capture.get("id") or not isinstance(analysis, dict) or analysis.get("error"):
+            return None
+        try:
+            ts = _parse_iso_datetime(capture.get("timestamp"))
+        except Exception:
+            return None
+        return ts, {"id": capture["id"], "timestamp": ts.isoformat(),
+                    "transcription": capture.get("transcription"),
+                    "geminiAnalysis": analysis}
+
+    def _insert(self, user_id: str, item: Tuple[datetime, Dict[str, Any]]) -> None:
+        ring = self._users.setdefault(user_id, deque())
+        ts, doc = item
+        for i, (_, existing) in enumerate(ring):
+            if existing["id"] == doc["id"]:
+                del ring[i]
+                break
+        # Captures finish roughly in order; walk back from the newest
+        pos = len(ring)
+        while pos and ring[pos - 1][0] > ts:
+            pos -= 1
+        ring.insert(pos, item)
+        cutoff = ring[-1][0] - self.window
+        while len(ring) > self.max_items or (ring and ring[0][0] < cutoff):
+            ring.popleft()
+
+    def add(self, user_id: str, capture: Dict[str, Any]) -> None:
+        item = self._item(capture)
+        if item is not None:
+            self._insert(user_id, item)
+            self._stats["added"] += 1
+
+    async def _hydrate(self, user_id: str) -> None:
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            if user_id in self._hydrated:
+                return
+            now = datetime.now(timezone.utc)
+            captures = await repo.list_captures_in_range(user_id, now - self.window, now)
+            for c in captures:
+                item = self._item(c)
+                if item is not None:
+                    self._insert(user_id, item)
+            self._hydrated.add(user_id)
+            self._stats["hydrations"] += 1
+
+    async def recent(self, user_id: str, minutes: int) -> List[Dict[str, Any]]:
+        """Processed captures from the last `minutes`, oldest first."""
+        if user_id not in self._hydrated:
+            await self._hydrate(user_id)
+        self._stats["reads"] += 1
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=minutes)
+        return [doc for ts, doc in self._users.get(user_id, ()) if ts >= cutoff]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "users": len(self._users),
+            "items": sum(len(r) for r in self._users.values()),
+        }
+
+
+recent_activity = RecentActivityWindow(
+    RECENT_ACTIVITY_WINDOW_MINUTES, RECENT_ACTIVITY_MAX_ITEMS)
+
+# "right now" / "just now" are left out on purpose: "where am I right now"
+# or "who am I talking to right now" need the router, not a rewind.
+_RECENCY_QUERY_RE = re.compile(
+    r"\b(?:(?:was|did|have|had) i just|i (?:was|have) just|just happened|"
+    r"(?:a|one) (?:moment|minute|second) ago|moments? ago|"
+    r"(?:a )?(?:few|couple (?:of )?) minutes ago|rewind|"
+    r"(?:last|past) (?:few |couple (?:of )?)?minutes?|"
+    r"(?:last|past) (?P<n>\d+|five|ten|fifteen|twenty|thirty) min(?:ute)?s?)\b",
+    re.IGNORECASE)
+_NUMBER_WORDS = {"five": 5, "ten": 10, "fifteen": 15, "twenty": 20, "thirty": 30}
+
+
+def _recency_minutes(query_text: str) -> Optional[int]:
+    """Rewind span for a "what did I just do?" style question, else None."""
+    m = _RECENCY_QUERY_RE.search(query_text)
+    if not m:
+        return None
+    n = m.group("n")
+    if n:
+        minutes = int(n) if n.isdigit() else _NUMBER_WORDS[n.lower()]
+        return max(1, min(minutes, RECENT_ACTIVITY_WINDOW_MINUTES))
+    return RECENT_ACTIVITY_REWIND_MINUTES
+
+
 # =============================================================================
 # UNITY QUERY PIPELINE
 # =============================================================================
 
-async def _process_unity_query(user_id: str, query_text: str, date_range: Optional[Dict], include_faces: bool, max_images: int, user_image: Optional[str] = None) -> Dict[str, Any]:
-    profile = await repo.get_user_profile(user_id)
-    contacts_doc = await repo.get_contacts(user_id)
-    recent_queries_doc = await repo.get_recent_queries(user_id)
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def _record_stage(timings: Dict[str, float], stage: str, start: float) -> None:
+    """Store a stage's latency in the response timings and the histogram."""
+    timings[f"{stage}Ms"] = round(QUERY_STAGE_SECONDS.since(start, stage=stage) * 1000, 1)
+
+
+def _capture_context_item(c: Dict[str, Any]) -> Dict[str, Any]:
+    analysis = c.get("geminiAnalysis")
+    if analysis:
+        return {
+            "type": "capture",
+            "id": c.get("id"),
+            "timestamp": str(c.get("timestamp")),
+            "transcription": c.get("transcription"),
+            "analysis": analysis
+        }
+    # Unprocessed capture - use raw transcription
+    return {
+        "type": "recent_capture",
+        "id": c.get("id"),
+        "timestamp": str(c.get("timestamp")),
+        "transcription": c.get("transcription") or "(no audio)",
+        "status": "processing"
+    }
+
+
+_MEMORY_CONTEXT_RANK = {"daily_summary": 3.0, "hourly_summary": 2.0,
+                        "recent_capture": 1.5, "capture": 1.0}
+
+
+def _memory_context_priority(item: Dict[str, Any]) -> float:
+    """Prompt packing priority: summaries first, then newer captures."""
+    base = _MEMORY_CONTEXT_RANK.get(item.get("type"), 0.0)
+    try:
+        stamp = _parse_iso_datetime(item.get("timestamp") or item.get("date")).timestamp()
+    except Exception:
+        stamp = 0.0
+    return base * 1e10 + stamp
+
+
+async def _select_relevant_captures(user_id: str, query_text: str, captures_by_date: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Pick the captures most relevant to the query across all fetched dates.
+
+    Processed captures are ranked with the vector index (indexing any it
+    hasn't seen yet); the newest few unprocessed captures are kept as raw
+    transcriptions. Without numpy this falls back to the latest ten captures
+    of each day.
+    """
+    all_captures = [c for date_str in sorted(captures_by_date)
+                    for c in captures_by_date[date_str]]
+    if not capture_index.enabled:
+        return [_capture_context_item(c) for date_str in sorted(captures_by_date)
+                for c in captures_by_date[date_str][-10:]]
+
+    await capture_index.add_many(user_id, all_captures)
+    by_id = {str(c.get("id")): c for c in all_captures}
+    ranked = await capture_index.search(
+        user_id, query_text, QUERY_MAX_CAPTURES, allowed_ids=set(by_id))
+    selected = [by_id[cid] for cid, _ in ranked]
+
+    unprocessed = [c for c in all_captures if not c.get("geminiAnalysis")]
+    selected.extend(unprocessed[-QUERY_MAX_UNPROCESSED_CAPTURES:])
+
+    def _ts_key(c: Dict[str, Any]) -> float:
+        try:
+            return _parse_iso_datetime(c.get("timestamp")).timestamp()
+        except Exception:
+            return 0.0
+    selected.sort(key=_ts_key)
+    return [_capture_context_item(c) for c in selected]
+
+
+async def _fetch_memory_context(user_id: str, query_text: str, specific_dates: List[str], data_needed: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Fetch every requested (kind, date) concurrently.
+
+    Reads are capped at RETRIEVAL_CONCURRENCY in flight; anything still
+    running at RETRIEVAL_DEADLINE_SECONDS is cancelled and left out so a slow
+    read can't hold up the answer. Results keep the daily / hourly / capture
+    ordering of the original sequential loops; captures from all dates are
+    ranked together by relevance to the query.
+    """
+    sem = asyncio.Semaphore(RETRIEVAL_CONCURRENCY)
+    captures_by_date: Dict[str, List[Dict[str, Any]]] = {}
+
+    async def _daily(date_str: str) -> List[Dict[str, Any]]:
+        summary = await repo.get_daily_summary(user_id, date_str)
+        if summary:
+            return [{"type": "daily_summary", "date": date_str, "data": summary}]
+        return []
+
+    async def _hourly(date_str: str) -> List[Dict[str, Any]]:
+        hourly = await repo.list_hourly_summaries_for_date(user_id, date_str)
+        return [{"type": "hourly_summary", "date": date_str, "hour": h.get("hour"), "data": h}
+                for h in hourly]
+
+    async def _captures(date_str: str) -> List[Dict[str, Any]]:
+        day = datetime.fromisoformat(date_str).date()
+        captures_by_date[date_str] = await repo.list_captures_for_date(user_id, day)
+        return []
+
+    async def _limited(fetch, date_str: str) -> List[Dict[str, Any]]:
+        async with sem:
+            return await fetch(date_str)
+
+    tasks: List[Tuple[str, str, asyncio.Task]] = []
+    for flag, fetch in (("dailySummaries", _daily), ("hourlySummaries", _hourly), ("captures", _captures)):
+        if data_needed.get(flag):
+            for date_str in specific_dates:
+                tasks.append((flag, date_str, asyncio.create_task(
+                    _limited(fetch, date_str))))
+    if not tasks:
+        return []
+
+    done, pending = await asyncio.wait(
+        [t for _, _, t in tasks], timeout=RETRIEVAL_DEADLINE_SECONDS)
+    for t in pending:
+        t.cancel()
+    if pending:
+        logger.warning("[QUERY_DATA] user=%s retrieval deadline hit, dropped %d of %d reads",
+                       user_id, len(pending), len(tasks))
+
+    memory_context: List[Dict[str, Any]] = []
+    for flag, date_str, t in tasks:
+        if t not in done:
+            continue
+        if t.exception() is not None:
+            logger.warning("[QUERY_DATA] user=%s %s fetch failed for %s: %s",
+                           user_id, flag, date_str, t.exception())
+            continue
+        memory_context.extend(t.result())
+
+    if captures_by_date:
+        try:
+            memory_context.extend(await _select_relevant_captures(
+                user_id, query_text, captures_by_date))
+        except Exception:
+            logger.exception(
+                "[QUERY_DATA] user=%s capture ranking failed", user_id)
+    return memory_context
+
+
+@dataclass
+class QueryPlan:
+    """Everything the answer call needs, produced by _plan_unity_query."""
+    answer_prompt: str
+    user_image: Optional[str]
+    memory_context: List[Dict[str, Any]]
+    contacts_info: List[Dict[str, Any]]
+    attached_images: List[str]
+    timings: Dict[str, float]
+    started: float
+    # AnswerCache tags for the data the answer was built from
+    deps: List[str] = field(default_factory=list)
+
+
+def _format_recent_queries(recent_queries_doc: Optional[Dict[str, Any]], limit: int,
+                           now: datetime) -> List[Dict[str, Any]]:
+    out = []
+    for q in (recent_queries_doc or {}).get("queries", [])[:limit]:
+        q_ts = q.get("timestamp")
+        if isinstance(q_ts, datetime):
+            formatted_ts = _format_query_timestamp(q_ts, now)
+        else:
+            formatted_ts = str(q_ts)
+        out.append({
+            "query": q.get("query"),
+            "answer": q.get("answer", "")[:200],
+            "timestamp": formatted_ts
+        })
+    return out
+
+
+def _build_answer_prompt(profile: Optional[Dict[str, Any]], contacts_info: List[Dict[str, Any]],
+                         now: datetime, query_text: str, memory_context: List[Dict[str, Any]],
+                         recent_queries_list: List[Dict[str, Any]]) -> str:
+    return (PromptBuilder(PROMPT_KIND_QUERY_ANSWER, QUERY_ANSWER_PROMPT)
+            .json("user_profile", profile, empty="No profile available")
+            .json("contacts_info", contacts_info)
+            .text("current_time", now.strftime("%Y-%m-%d %H:%M:%S UTC"))
+            .text("query_text", query_text)
+            .items("memory_context", memory_context,
+                   [_memory_context_priority(mc) for mc in memory_context])
+            .items("recent_queries", recent_queries_list,
+                   [-i for i in range(len(recent_queries_list))],
+                   empty="No recent queries")
+            .build())
+
+
+def _recent_capture_names(captures: List[Dict[str, Any]]) -> List[str]:
+    """People mentioned or recognized in captures, most recent first."""
+    names: List[str] = []
+    for c in reversed(captures):
+        analysis = c.get("geminiAnalysis") or {}
+        names.extend(n for n in analysis.get("mentionedNames") or [] if isinstance(n, str))
+        names.extend(f.get("possibleName") for f in analysis.get("detectedFaces") or []
+                     if isinstance(f, dict) and isinstance(f.get("possibleName"), str))
+    return list(dict.fromkeys(n for n in names if n.strip()))
+
+
+async def _plan_recent_activity_query(user_id: str, query_text: str, minutes: int,
+                                      include_faces: bool, max_images: int,
+                                      user_image: Optional[str]) -> Optional[QueryPlan]:
+    """Fast path for "what did I just do?": answer from the in-memory recent
+    activity window, skipping the router and Firestore capture reads.
+    People seen or mentioned in those captures are resolved to contacts (and
+    face photos), as the router would have asked for.
+    Returns None when there is nothing recent, so the full pipeline runs."""
+    query_start = time.perf_counter()
+    captures = await recent_activity.recent(user_id, minutes)
+    if not captures:
+        return None
+    timings: Dict[str, float] = {"recentMs": _elapsed_ms(query_start)}
+
+    stage_start = time.perf_counter()
+    profile, recent_queries_doc, contacts_info = await asyncio.gather(
+        repo.get_user_profile(user_id),
+        repo.get_recent_queries(user_id, limit=20),
+        repo.find_contacts(user_id, _recent_capture_names(captures)[:10]),
+    )
+    _record_stage(timings, "context", stage_start)
+
+    attached_images: List[str] = []
+    if include_faces:
+        attached_images = [c["bestFacePhotoURL"] for c in contacts_info
+                           if c.get("bestFacePhotoURL")][:max_images]
+
+    now = datetime.now(timezone.utc)
+    memory_context = [_capture_context_item(c) for c in captures]
+    answer_prompt = _build_answer_prompt(
+        profile, contacts_info, now, query_text, memory_context,
+        _format_recent_queries(recent_queries_doc, 5, now))
+    logger.info("[QUERY_DATA] user=%s recent-activity fast path minutes=%d captures=%d",
+                user_id, minutes, len(captures))
+
+    days = {(now - timedelta(minutes=minutes)).date().isoformat(), now.date().isoformat()}
+    return QueryPlan(
+        answer_prompt=answer_prompt,
+        user_image=user_image,
+        memory_context=memory_context,
+        contacts_info=contacts_info,
+        attached_images=attached_images,
+        timings=timings,
+        started=query_start,
+        deps=["profile", "contacts"] + [f"captures:{d}" for d in sorted(days)],
+    )
+
+
+async def _plan_unity_query(user_id: str, query_text: str, date_range: Optional[Dict], include_faces: bool, max_images: int, user_image: Optional[str] = None) -> Any:
+    """Run the router and retrieval stages.
+
+    Returns a final response dict when the query ends early (router failure
+    or clarification), otherwise a QueryPlan for the answer stage.
+    """
+    if not date_range:
+        minutes = _recency_minutes(query_text)
+        if minutes:
+            try:
+                plan = await _plan_recent_activity_query(
+                    user_id, query_text, minutes, include_faces, max_images, user_image)
+            except Exception:
+                logger.exception("[QUERY_DATA] user=%s recent activity lookup failed", user_id)
+                plan = None
+            if plan is not None:
+                return plan
+
+    query_start = time.perf_counter()
+    timings: Dict[str, float] = {}
+
+    stage_start = time.perf_counter()
+    profile, recent_contacts, recent_queries_doc = await asyncio.gather(
+        repo.get_user_profile(user_id),
+        repo.list_recent_contacts(user_id, limit=20),
+        repo.get_recent_queries(user_id, limit=20),
+    )
+    _record_stage(timings, "context", stage_start)
 
-    profile_str = json.dumps(
-        profile, default=str) if profile else "No profile available"
-    contacts_list = contacts_doc.get("contacts", []) if contacts_doc else []
     contacts_summary = ", ".join(
-        [f"{c.get('name')} ({c.get('relationship')})" for c in contacts_list[:20]]) or "No contacts"
+        [f"{c.get('name')} ({c.get('relationship')})" for c in recent_contacts]) or "No contacts"
 
     # Format recent queries for conversation context with formatted timestamps
     now = datetime.now(timezone.utc)
-    recent_queries_list = []
-    if recent_queries_doc:
-        for q in recent_queries_doc.get("queries", [])[:5]:
-            q_ts = q.get("timestamp")
-            if isinstance(q_ts, datetime):
-                formatted_ts = _format_query_timestamp(q_ts, now)
-            else:
-                formatted_ts = str(q_ts)
-            recent_queries_list.append({
-                "query": q.get("query"),
-                "answer": q.get("answer", "")[:200],
-                "timestamp": formatted_ts
-            })
-    recent_queries_str = json.dumps(
-        recent_queries_list, default=str, indent=2) if recent_queries_list else "No recent queries"
+    recent_queries_list = _format_recent_queries(recent_queries_doc, 5, now)
 
     last_hour = profile.get(
         "lastHourSummary", "No recent hourly summary") if profile else "No data"
@@ -1601,21 +6416,25 @@ async def _process_unity_query(user_id: str, query_text: str, date_range: Option
     if date_range:
         date_range_str = f"{date_range.get('start', 'any')} to {date_range.get('end', 'any')}"
 
-    router_prompt = QUERY_ROUTER_PROMPT.format(
-        user_profile=profile_str,
-        contacts_summary=contacts_summary,
-        last_hour_summary=last_hour,
-        last_day_summary=last_day,
-        recent_queries=recent_queries_str,
-        query_text=query_text,
-        date_range=date_range_str
-    )
-
+    router_prompt = (PromptBuilder(PROMPT_KIND_QUERY_ROUTER, QUERY_ROUTER_PROMPT)
+                     .json("user_profile", profile, empty="No profile available")
+                     .text("contacts_summary", contacts_summary)
+                     .text("last_hour_summary", last_hour)
+                     .text("last_day_summary", last_day)
+                     .text("query_text", query_text)
+                     .text("date_range", date_range_str)
+                     .items("recent_queries", recent_queries_list,
+                            [-i for i in range(len(recent_queries_list))],
+                            empty="No recent queries")
+                     .build())
+
+    stage_start = time.perf_counter()
     try:
         router_result = await _call_gemini_text(router_prompt)
     except Exception as e:
         logger.exception("Query router failed")
         return {"ok": False, "error": "query_routing_failed", "detail": str(e)}
+    _record_stage(timings, "router", stage_start)
 
     if router_result.get("needsClarification"):
         # Return clarification as a regular response - user can follow up with new query
@@ -1627,32 +6446,19 @@ async def _process_unity_query(user_id: str, query_text: str, date_range: Option
             "confidence": 0.5,
             "sources": [],
             "relatedContacts": [],
-            "attachedImages": []
+            "attachedImages": [],
+            "timings": {**timings, "totalMs": _elapsed_ms(query_start)}
         }
 
     # Check if router needs more query context
     more_context = router_result.get("needsMoreQueryContext", 0)
     if more_context and more_context > 5 and recent_queries_doc:
         extended_count = min(more_context, 20)
-        recent_queries_list = []
-        for q in recent_queries_doc.get("queries", [])[:extended_count]:
-            q_ts = q.get("timestamp")
-            if isinstance(q_ts, datetime):
-                formatted_ts = _format_query_timestamp(q_ts, now)
-            else:
-                formatted_ts = str(q_ts)
-            recent_queries_list.append({
-                "query": q.get("query"),
-                "answer": q.get("answer", "")[:200],
-                "timestamp": formatted_ts
-            })
-        recent_queries_str = json.dumps(
-            recent_queries_list, default=str, indent=2)
+        recent_queries_list = _format_recent_queries(
+            recent_queries_doc, extended_count, now)
         logger.info("[QUERY_DATA] Extended query context to %d queries", len(
             recent_queries_list))
 
-    memory_context = []
-
     data_needed = router_result.get("dataNeeded", {})
     specific_dates = data_needed.get("specificDates", [])
 
@@ -1673,89 +6479,53 @@ async def _process_unity_query(user_id: str, query_text: str, date_range: Option
         specific_dates = [
             today.isoformat(), (today - timedelta(days=1)).isoformat()]
 
-    specific_dates = list(set(specific_dates))[:7]
-
-    if data_needed.get("dailySummaries"):
-        for date_str in specific_dates:
-            summary = await repo.get_daily_summary(user_id, date_str)
-            if summary:
-                memory_context.append(
-                    {"type": "daily_summary", "date": date_str, "data": summary})
-
-    if data_needed.get("hourlySummaries"):
-        for date_str in specific_dates:
-            hourly = await repo.list_hourly_summaries_for_date(user_id, date_str)
-            for h in hourly:
-                memory_context.append(
-                    {"type": "hourly_summary", "date": date_str, "hour": h.get("hour"), "data": h})
+    # Most recent 7 dates
+    specific_dates = sorted(set(specific_dates), reverse=True)[:7]
 
-    if data_needed.get("captures"):
-        for date_str in specific_dates:
-            try:
-                day = datetime.fromisoformat(date_str).date()
-                captures = await repo.list_captures_for_date(user_id, day)
-                for c in captures[:10]:
-                    analysis = c.get("geminiAnalysis")
-                    if analysis:
-                        memory_context.append({
-                            "type": "capture",
-                            "id": c.get("id"),
-                            "timestamp": str(c.get("timestamp")),
-                            "transcription": c.get("transcription"),
-                            "analysis": analysis
-                        })
-                    else:
-                        # Unprocessed capture - use raw transcription
-                        memory_context.append({
-                            "type": "recent_capture",
-                            "id": c.get("id"),
-                            "timestamp": str(c.get("timestamp")),
-                            "transcription": c.get("transcription") or "(no audio)",
-                            "status": "processing"
-                        })
-            except Exception:
-                pass
+    stage_start = time.perf_counter()
+    memory_context = await _fetch_memory_context(
+        user_id, query_text, specific_dates, data_needed)
+    _record_stage(timings, "retrieval", stage_start)
 
     relevant_contacts = router_result.get("relevantContacts", [])
     contacts_info = []
     attached_images = []
 
     if include_faces and router_result.get("needsFaceImages"):
-        for contact_name in relevant_contacts[:max_images]:
-            for c in contacts_list:
-                if c.get("name", "").lower() == contact_name.lower():
-                    contacts_info.append(c)
-                    if c.get("bestFacePhotoURL"):
-                        attached_images.append(c.get("bestFacePhotoURL"))
-                    break
+        matched = await repo.find_contacts(user_id, relevant_contacts[:max_images])
+        for c in matched[:max_images]:
+            contacts_info.append(c)
+            if c.get("bestFacePhotoURL"):
+                attached_images.append(c.get("bestFacePhotoURL"))
 
     attached_images = attached_images[:max_images]
 
-    answer_prompt = QUERY_ANSWER_PROMPT.format(
-        user_profile=profile_str,
-        recent_queries=recent_queries_str,
-        memory_context=json.dumps(memory_context, default=str, indent=2),
-        contacts_info=json.dumps(contacts_info, default=str),
-        current_time=now.strftime("%Y-%m-%d %H:%M:%S UTC"),
-        query_text=query_text
+    answer_prompt = _build_answer_prompt(
+        profile, contacts_info, now, query_text, memory_context, recent_queries_list)
+
+    deps = ["profile", "contacts"]
+    for flag, tag in (("captures", "captures"), ("hourlySummaries", "hourly"),
+                      ("dailySummaries", "daily")):
+        if data_needed.get(flag):
+            deps.extend(f"{tag}:{d}" for d in specific_dates)
+
+    return QueryPlan(
+        answer_prompt=answer_prompt,
+        user_image=user_image,
+        memory_context=memory_context,
+        contacts_info=contacts_info,
+        attached_images=attached_images,
+        timings=timings,
+        started=query_start,
+        deps=deps,
     )
 
-    try:
-        # Use vision model if user provided an image with their query
-        if user_image:
-            logger.info(
-                "[QUERY_DATA] Processing query with user-provided image")
-            answer_result = await _call_gemini_with_image(answer_prompt, user_image)
-        else:
-            answer_result = await _call_gemini_text(answer_prompt)
-    except Exception as e:
-        logger.exception("Query answer generation failed")
-        return {"ok": False, "error": "answer_generation_failed", "detail": str(e)}
 
+def _build_query_response(plan: QueryPlan, answer_result: Dict[str, Any]) -> Dict[str, Any]:
     source_ids = answer_result.get("sourceCaptureIds", [])
     sources = []
     for sid in source_ids[:5]:
-        for mc in memory_context:
+        for mc in plan.memory_context:
             if mc.get("id") == sid:
                 sources.append({
                     "captureId": sid,
@@ -1770,12 +6540,155 @@ async def _process_unity_query(user_id: str, query_text: str, date_range: Option
         "answer": answer_result.get("answer", "I couldn't find relevant information."),
         "confidence": answer_result.get("confidence", 0.5),
         "sources": sources,
-        "relatedContacts": [{"name": c.get("name"), "relationship": c.get("relationship"), "faceImageURL": c.get("bestFacePhotoURL")} for c in contacts_info],
-        "attachedImages": attached_images,
-        "suggestedFollowUp": answer_result.get("suggestedFollowUp")
+        "relatedContacts": [{"name": c.get("name"), "relationship": c.get("relationship"), "faceImageURL": c.get("bestFacePhotoURL")} for c in plan.contacts_info],
+        "attachedImages": plan.attached_images,
+        "suggestedFollowUp": answer_result.get("suggestedFollowUp"),
+        "timings": {**plan.timings, "totalMs": _elapsed_ms(plan.started)},
+        # Popped by ws_query before sending; see AnswerCache
+        "_deps": plan.deps,
     }
 
 
+async def _process_unity_query(user_id: str, query_text: str, date_range: Optional[Dict], include_faces: bool, max_images: int, user_image: Optional[str] = None) -> Dict[str, Any]:
+    plan = await _plan_unity_query(user_id, query_text, date_range, include_faces, max_images, user_image)
+    if not isinstance(plan, QueryPlan):
+        return plan
+
+    stage_start = time.perf_counter()
+    try:
+        # Use vision model if user provided an image with their query
+        if plan.user_image:
+            logger.info(
+                "[QUERY_DATA] Processing query with user-provided image")
+            answer_result = await _call_gemini_with_image(plan.answer_prompt, plan.user_image)
+        else:
+            answer_result = await _call_gemini_text(plan.answer_prompt)
+    except Exception as e:
+        logger.exception("Query answer generation failed")
+        return {"ok": False, "error": "answer_generation_failed", "detail": str(e)}
+    _record_stage(plan.timings, "answer", stage_start)
+
+    return _build_query_response(plan, answer_result)
+
+
+# =============================================================================
+# STREAMING QUERY ANSWERS
+# =============================================================================
+# With {"stream": true} the answer call is streamed: the "answer" string is
+# pulled out of the partially generated JSON and forwarded as text frames,
+# and each completed sentence is synthesized and sent as an audio chunk while
+# the rest of the answer is still being generated.
+
+class _JsonStringFieldStreamer:
+    """Incrementally decodes one top-level string field from streamed JSON."""
+
+    _ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+    def __init__(self, field_name: str) -> None:
+        self._key_re = re.compile(r'"%s"\s*:\s*"' % re.escape(field_name))
+        self._buf = ""
+        self._cursor: Optional[int] = None
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        """Add raw response text; return newly decoded field text."""
+        self._buf += chunk
+        if self.done:
+            return ""
+        if self._cursor is None:
+            m = self._key_re.search(self._buf)
+            if not m:
+                return ""
+            self._cursor = m.end()
+
+        buf, i, out = self._buf, self._cursor, []
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+            # Escape sequence: wait for the rest of it if it's split
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc != "u":
+                out.append(self._ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
+            code = int(buf[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                if i + 12 > len(buf):
+                    break
+                low = int(buf[i + 8:i + 12], 16)
+                out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+            else:
+                out.append(chr(code))
+                i += 6
+        self._cursor = i
+        return "".join(out)
+
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+
+
+class _SentenceBuffer:
+    """Splits streamed text into sentences of at least `min_chars`."""
+
+    def __init__(self, min_chars: int) -> None:
+        self.min_chars = min_chars
+        self._buf = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._buf += text
+        out = []
+        start = 0
+        for m in _SENTENCE_END_RE.finditer(self._buf):
+            if m.end() - start >= self.min_chars:
+                out.append(self._buf[start:m.end()].strip())
+                start = m.end()
+        self._buf = self._buf[start:]
+        return out
+
+    def flush(self) -> Optional[str]:
+        rest, self._buf = self._buf.strip(), ""
+        return rest or None
+
+
+async def _stream_unity_query(user_id: str, query_text: str, date_range: Optional[Dict], include_faces: bool, max_images: int,
+                              user_image: Optional[str], on_text: Callable[[str], Awaitable[None]]) -> Dict[str, Any]:
+    """Like _process_unity_query, but streams the answer text to `on_text`."""
+    plan = await _plan_unity_query(user_id, query_text, date_range, include_faces, max_images, user_image)
+    if not isinstance(plan, QueryPlan):
+        return plan
+
+    stage_start = time.perf_counter()
+    answer_field = _JsonStringFieldStreamer("answer")
+    raw_chunks: List[str] = []
+    images = [plan.user_image] if plan.user_image else None
+    try:
+        async for chunk in gemini.generate_stream(plan.answer_prompt, images, GEMINI_PURPOSE_QUERY):
+            raw_chunks.append(chunk)
+            delta = answer_field.feed(chunk)
+            if delta:
+                if "firstTextMs" not in plan.timings:
+                    plan.timings["firstTextMs"] = _elapsed_ms(plan.started)
+                await on_text(delta)
+        answer_result = _parse_json_response("".join(raw_chunks))
+    except Exception as e:
+        logger.exception("Streaming query answer generation failed")
+        return {"ok": False, "error": "answer_generation_failed", "detail": str(e)}
+    _record_stage(plan.timings, "answer", stage_start)
+
+    return _build_query_response(plan, answer_result)
+
+
 # =============================================================================
 # /ws/query/{user_id} - Dedicated Query WebSocket
 # =============================================================================
@@ -1792,8 +6705,83 @@ async def _process_unity_query(user_id: str, query_text: str, date_range: Option
 #      - {"type": "error", "ok": false, "error": "...", "detail": "..."}  (error)
 #   4. If clarification was requested, client sends: {"text": "clarification response"}
 #   5. Server sends final response
+#
+# Streaming (opt-in with "stream": true):
+#   - {"type": "partial", "queryId": ..., "text": "..."}  (answer text as generated)
+#   - {"type": "audio_chunk", "queryId": ..., "seq": n, "audio": "<base64 mp3>"}
+#   - then the usual final frame, with "streamed": true and "audioURL": null
 # =============================================================================
 
+async def _stream_query_response(websocket: WebSocket, user_id: str, query_id: str, query_text: str, date_range: Optional[Dict],
+                                 include_faces: bool, max_images: int, user_image: Optional[str]) -> Dict[str, Any]:
+    """Send partial/audio_chunk frames for one query; return the final result
+    (the caller sends it as the closing frame)."""
+    send_lock = asyncio.Lock()
+    sentences = _SentenceBuffer(STREAM_TTS_MIN_CHARS)
+    audio_queue: asyncio.Queue = asyncio.Queue()
+    streamed_text = False
+
+    async def _send(frame: Dict[str, Any]) -> None:
+        async with send_lock:
+            await manager.send_json(websocket, frame)
+
+    def _speak(sentence: str) -> None:
+        # Synthesis starts immediately; frames are still sent in order
+        audio_queue.put_nowait(
+            (sentence, asyncio.create_task(tts_service.synthesize(sentence))))
+
+    async def _send_audio() -> int:
+        seq = 0
+        while True:
+            item = await audio_queue.get()
+            if item is None:
+                return seq
+            sentence, task = item
+            try:
+                audio = await task
+            except Exception as e:
+                logger.warning(
+                    "Streaming TTS failed for query_id=%s: %s", query_id, e)
+                continue
+            if audio:
+                await _send({
+                    "type": "audio_chunk",
+                    "queryId": query_id,
+                    "seq": seq,
+                    "text": sentence,
+                    "format": "mp3",
+                    "audio": base64.b64encode(audio).decode("utf-8"),
+                })
+                seq += 1
+
+    async def _on_text(delta: str) -> None:
+        nonlocal streamed_text
+        streamed_text = True
+        await _send({"type": "partial", "queryId": query_id, "text": delta})
+        if tts_service.is_available:
+            for sentence in sentences.feed(delta):
+                _speak(sentence)
+
+    audio_sender = asyncio.create_task(_send_audio())
+    try:
+        result = await _stream_unity_query(
+            user_id, query_text, date_range, include_faces, max_images, user_image, _on_text)
+        # Early answers (e.g. clarification questions) arrive in one piece
+        if result.get("ok") and result.get("answer") and not streamed_text:
+            await _on_text(result["answer"])
+        if tts_service.is_available:
+            rest = sentences.flush()
+            if rest:
+                _speak(rest)
+    finally:
+        audio_queue.put_nowait(None)
+        audio_chunks = await audio_sender
+
+    result["streamed"] = True
+    result["audioChunks"] = audio_chunks
+    return result
+
+
 @app.websocket("/ws/query/{user_id}")
 async def ws_query(websocket: WebSocket, user_id: str) -> None:
     await manager.connect("unity", user_id, websocket)
@@ -1820,6 +6808,8 @@ async def ws_query(websocket: WebSocket, user_id: str) -> None:
                     req.get("maxImages", DEFAULT_QUERY_IMAGES), MAX_QUERY_IMAGES)
                 # Optional: URL from POST /query-upload
                 image_url = req.get("imageURL")
+                # Optional: stream partial text and audio chunks before the final frame
+                stream = bool(req.get("stream", False))
 
                 # Generate unique query ID
                 query_id = str(uuid.uuid4())[:8]
@@ -1840,16 +6830,44 @@ async def ws_query(websocket: WebSocket, user_id: str) -> None:
                     image_url[:80] if image_url else "none"
                 )
 
-                start_time = time.time()
-                result = await _process_unity_query(user_id, query_text, date_range, include_faces, max_images, user_image)
-                elapsed_ms = (time.time() - start_time) * 1000
+                start_time = time.perf_counter()
+                # Questions with an attached image are never answered from cache
+                use_cache = ANSWER_CACHE_ENABLED and not image_url
+                cache_scope = AnswerCache.scope(date_range, include_faces, max_images)
+                cache_versions = answer_cache.snapshot(user_id)
+                cached, query_vector = None, None
+                INFLIGHT_TASKS.inc(kind="query")
+                try:
+                    if use_cache:
+                        cached, query_vector = await answer_cache.lookup(
+                            user_id, query_text, cache_scope)
+                    if cached is not None:
+                        result = _cached_query_response(cached, time.perf_counter())
+                        if stream:
+                            await manager.send_json(websocket, {
+                                "type": "partial", "queryId": query_id, "text": result.get("answer", "")})
+                            result["streamed"] = True
+                            result["audioChunks"] = 0
+                    elif stream:
+                        result = await _stream_query_response(
+                            websocket, user_id, query_id, query_text, date_range, include_faces, max_images, user_image)
+                    else:
+                        result = await _process_unity_query(user_id, query_text, date_range, include_faces, max_images, user_image)
+                finally:
+                    INFLIGHT_TASKS.dec(kind="query")
+                elapsed_ms = QUERY_STAGE_SECONDS.since(start_time, stage="total") * 1000
+                deps = result.pop("_deps", None)
 
                 # Add queryId to result
                 result["queryId"] = query_id
 
-                # Generate TTS audio for successful responses (non-blocking on failure)
-                audio_url = None
-                if result.get("ok") and result.get("answer"):
+                # Generate TTS audio for successful responses (non-blocking on failure).
+                # Streamed responses already delivered their audio as chunks;
+                # cache hits reuse the audio generated the first time.
+                audio_url = cached.audio_url if cached is not None else None
+                tts_start = time.perf_counter()
+                if (result.get("ok") and result.get("answer") and not audio_url
+                        and (not stream or cached is not None)):
                     try:
                         audio_url = await tts_service.generate_speech(
                             result["answer"],
@@ -1862,6 +6880,15 @@ async def ws_query(websocket: WebSocket, user_id: str) -> None:
 
                 # Add audioURL to result (null if TTS failed or unavailable)
                 result["audioURL"] = audio_url
+                if "timings" in result:
+                    result["timings"]["ttsMs"] = _elapsed_ms(tts_start)
+
+                if cached is not None:
+                    if audio_url and not cached.audio_url:
+                        cached.audio_url = audio_url
+                elif use_cache and deps is not None and result.get("type") == "response":
+                    answer_cache.put(user_id, query_text, cache_scope, result, deps,
+                                     cache_versions, audio_url, query_vector)
 
                 # Log response summary
                 logger.info(
@@ -0,0 +1,61 @@
+"""Shared fixtures: the app module running on the in-memory repo, with the
+load-test Gemini stand-in behind a real GeminiGateway."""
+
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import loadtest  # noqa: E402  (sets up the offline environment before main)
+import main  # noqa: E402
+
+
+def make_gateway(error_rate: float = 0.0, latency_ms: float = 0.0, max_retries: int = 0,
+                 breaker_failures: int = 5, breaker_cooldown: float = 30.0,
+                 rate_per_second: float = 0.0, burst: int = 10):
+    """A fresh gateway (its semaphores belong to the test's event loop) with
+    the fake SDK installed."""
+    gateway = main.GeminiGateway(
+        "fake-model",
+        max_concurrency=4,
+        purpose_limits={
+            main.GEMINI_PURPOSE_CAPTURE: 2,
+            main.GEMINI_PURPOSE_QUERY: 2,
+            main.GEMINI_PURPOSE_CONDENSE: 1,
+        },
+        limiter=main.GeminiRateLimiter(rate_per_second, burst),
+        breaker=main.GeminiCircuitBreaker(breaker_failures, breaker_cooldown),
+        max_retries=max_retries,
+        retry_base_seconds=0.001,
+        retry_max_seconds=0.01,
+    )
+    fake = loadtest.FakeGemini(loadtest.LatencyModel(latency_ms), error_rate, seed=7)
+    fake.install(gateway)
+    return gateway, fake
+
+
+@pytest.fixture
+def repo(monkeypatch):
+    """A fresh in-memory repo in place of the module-level one."""
+    # Without the SDK the repo doesn't look for credentials
+    with monkeypatch.context() as m:
+        m.setattr(main, "firestore", None)
+        fresh = main.FirestoreRepo()
+    monkeypatch.setattr(main, "repo", fresh)
+    return fresh
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    gateway, fake = make_gateway()
+    monkeypatch.setattr(main, "gemini", gateway)
+    yield fake
+    gateway.shutdown()
+
+
+@pytest.fixture
+def user_id():
+    return f"test-{uuid.uuid4().hex[:8]}"
@@ -0,0 +1,156 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import main
+from conftest import make_gateway
+
+SCOPE = main.AnswerCache.scope(None, False, 0)
+
+
+def _cache(provider=None, similarity=0.9):
+    return main.AnswerCache(ttl_seconds=60, max_per_user=10, similarity=similarity,
+                            provider=provider)
+
+
+def _answer(text):
+    return {"type": "response", "ok": True, "answer": text, "queryId": "q1",
+            "timings": {"totalMs": 1}}
+
+
+def _lookup(cache, user_id, question):
+    return asyncio.run(cache.lookup(user_id, question, SCOPE))[0]
+
+
+def test_put_dropped_when_dependency_changed_after_snapshot():
+    cache = _cache()
+    versions = cache.snapshot("u")
+    cache.invalidate("u", "captures:2026-01-24")
+    cache.put("u", "Where are my keys?", SCOPE, _answer("On the counter."),
+              ["profile", "captures:2026-01-24"], versions, None)
+    assert _lookup(cache, "u", "Where are my keys?") is None
+    assert cache.stats()["stores"] == 0
+
+
+def test_put_kept_when_only_unrelated_tags_changed():
+    cache = _cache()
+    versions = cache.snapshot("u")
+    cache.invalidate("u", "captures:2026-01-23", "contacts")
+    cache.invalidate("other-user", "profile")
+    cache.put("u", "Where are my keys?", SCOPE, _answer("On the counter."),
+              ["profile", "captures:2026-01-24"], versions, "https://audio")
+    entry = _lookup(cache, "u", "  where are my KEYS ")
+    assert entry is not None
+    assert entry.audio_url == "https://audio"
+    # Per-delivery fields are not cached
+    assert "queryId" not in entry.response and "timings" not in entry.response
+
+
+def test_invalidation_after_put_makes_entry_stale():
+    cache = _cache()
+    cache.put("u", "Who is Bob?", SCOPE, _answer("A friend."), ["contacts"],
+              cache.snapshot("u"), None)
+    assert _lookup(cache, "u", "Who is Bob?") is not None
+    cache.invalidate("u", "contacts")
+    assert _lookup(cache, "u", "Who is Bob?") is None
+    assert cache.stats()["stale"] == 1
+
+
+def test_slow_writer_with_older_snapshot_cannot_replace_fresh_answer():
+    cache = _cache()
+    old_versions = cache.snapshot("u")
+    cache.invalidate("u", "captures:2026-01-24")
+    cache.put("u", "What did I eat?", SCOPE, _answer("Pasta."),
+              ["captures:2026-01-24"], cache.snapshot("u"), None)
+    # The query that started before the capture finishes last
+    cache.put("u", "What did I eat?", SCOPE, _answer("Nothing yet."),
+              ["captures:2026-01-24"], old_versions, None)
+    assert _lookup(cache, "u", "What did I eat?").response["answer"] == "Pasta."
+
+
+class _GatedProvider:
+    """Embeds every question to the same vector once `gate` is set."""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+
+    async def embed_query(self, text):
+        await self.gate.wait()
+        return main.np.array([1.0, 0.0], dtype=main.np.float32)
+
+
+@pytest.mark.skipif(main.np is None, reason="numpy not installed")
+def test_invalidation_while_embedding_blocks_semantic_hit():
+    async def scenario():
+        provider = _GatedProvider()
+        cache = _cache(provider)
+        provider.gate.set()
+        versions = cache.snapshot("u")
+        _, vector = await cache.lookup("u", "Where did I leave my keys?", SCOPE)
+        cache.put("u", "Where did I leave my keys?", SCOPE, _answer("On the counter."),
+                  ["captures:2026-01-24"], versions, None, vector)
+
+        provider.gate.clear()
+        lookup = asyncio.create_task(cache.lookup("u", "where are my keys", SCOPE))
+        await asyncio.sleep(0.01)
+        cache.invalidate("u", "captures:2026-01-24")
+        provider.gate.set()
+        stale, _ = await lookup
+
+        versions = cache.snapshot("u")
+        fresh, _ = await cache.lookup("u", "where are my keys", SCOPE)
+        cache.put("u", "Where did I leave my keys?", SCOPE, _answer("In the car."),
+                  ["captures:2026-01-24"], versions, None, vector)
+        rephrased, _ = await cache.lookup("u", "keys, where are they", SCOPE)
+        return stale, fresh, rephrased
+
+    stale, fresh, rephrased = asyncio.run(scenario())
+    assert stale is None and fresh is None
+    assert rephrased.response["answer"] == "In the car."
+
+
+def _today_noon_est():
+    today = datetime.now(main.EST).date()
+    return datetime.combine(today, datetime.min.time(), tzinfo=main.EST).replace(hour=12)
+
+
+def _run_query_and_capture(monkeypatch, repo, user_id, with_capture):
+    gateway, _ = make_gateway(latency_ms=20)
+    monkeypatch.setattr(main, "gemini", gateway)
+    cache = _cache()
+    monkeypatch.setattr(main, "answer_cache", cache)
+
+    async def scenario():
+        ts = _today_noon_est().astimezone(timezone.utc)
+        await repo.create_capture({
+            "id": f"{user_id}-cap", "userId": user_id, "timestamp": ts, "photoURL": None,
+            "audioURL": None, "transcription": "Mary called about Sunday.",
+            "processed": False, "geminiAnalysis": None})
+        versions = cache.snapshot(user_id)
+        jobs = [main._process_unity_query(user_id, "Who is Bob?", None, False, 0)]
+        if with_capture:
+            jobs.append(main._process_capture_async(user_id, f"{user_id}-cap", ts))
+        result = (await asyncio.gather(*jobs))[0]
+        assert result["ok"] is True
+        deps = result.pop("_deps")
+        cache.put(user_id, "Who is Bob?", SCOPE, result, deps, versions, None)
+        entry, _ = await cache.lookup(user_id, "Who is Bob?", SCOPE)
+        return deps, entry
+
+    try:
+        return asyncio.run(scenario())
+    finally:
+        gateway.shutdown()
+
+
+def test_answer_not_cached_when_capture_lands_during_query(monkeypatch, repo, user_id):
+    deps, entry = _run_query_and_capture(monkeypatch, repo, user_id, with_capture=True)
+    today = _today_noon_est().date().isoformat()
+    assert f"captures:{today}" in deps
+    assert entry is None
+
+
+def test_answer_cached_when_nothing_changed_during_query(monkeypatch, repo, user_id):
+    _, entry = _run_query_and_capture(monkeypatch, repo, user_id, with_capture=False)
+    assert entry is not None and entry.response["answer"]
@@ -0,0 +1,224 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import main
+
+
+def _queue(**overrides):
+    kwargs = dict(workers=1, max_depth=50, max_per_user=50, max_inflight_per_user=1,
+                  max_retries=2, retry_base_seconds=0.001)
+    kwargs.update(overrides)
+    return main.CaptureJobQueue(**kwargs)
+
+
+def _job(user_id, capture_id, priority=main.CAPTURE_PRIORITY_LIVE):
+    return main.CaptureJob(user_id, capture_id, datetime.now(timezone.utc), priority=priority)
+
+
+async def _until(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def _record(monkeypatch, gate=None, fail=None):
+    """Replace the pipeline with a recorder; `fail(capture_id, n)` may raise."""
+    calls = []
+
+    async def _process(user_id, capture_id, capture_ts):
+        calls.append(capture_id)
+        if gate is not None:
+            await gate.wait()
+        if fail is not None:
+            fail(capture_id, calls.count(capture_id))
+
+    monkeypatch.setattr(main, "_process_capture_async", _process)
+    return calls
+
+
+def test_processes_capture_through_pipeline(repo, fake_gemini, user_id):
+    async def scenario():
+        ts = datetime.now(timezone.utc)
+        await repo.create_capture({
+            "id": "cap-1", "userId": user_id, "timestamp": ts, "photoURL": None,
+            "audioURL": None, "transcription": "Bob said the coffee is great.",
+            "processed": False, "geminiAnalysis": None})
+        queue = _queue(workers=2)
+        queue.start()
+        try:
+            assert await queue.put(main.CaptureJob(user_id, "cap-1", ts))
+            await _until(lambda: queue.stats()["processed"] == 1)
+        finally:
+            await queue.stop()
+        return await repo.get_capture("cap-1")
+
+    capture = asyncio.run(scenario())
+    assert capture["processed"] is True
+    assert capture["geminiAnalysis"]["mentionedNames"]
+    assert fake_gemini.calls["capture"] == 1
+
+
+def test_put_ignores_capture_already_queued_or_running(monkeypatch):
+    async def scenario():
+        gate = asyncio.Event()
+        calls = _record(monkeypatch, gate)
+        queue = _queue()
+        assert await queue.put(_job("u", "c1"))
+        assert not await queue.put(_job("u", "c1"))
+        queue.start()
+        await _until(lambda: calls == ["c1"])
+        assert not await queue.put(_job("u", "c1"))
+        gate.set()
+        await _until(lambda: queue.stats()["processed"] == 1)
+        # Finished captures may be queued again
+        assert await queue.put(_job("u", "c1"))
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_live_jobs_first_and_users_take_turns(monkeypatch):
+    async def scenario():
+        gate = asyncio.Event()
+        calls = _record(monkeypatch, gate)
+        queue = _queue()
+        queue.start()
+        await queue.put(_job("u0", "blocker"))
+        await _until(lambda: calls == ["blocker"])
+        await queue.put(_job("u1", "u1-bg", main.CAPTURE_PRIORITY_BACKGROUND))
+        await queue.put(_job("u1", "u1-a"))
+        await queue.put(_job("u1", "u1-b"))
+        await queue.put(_job("u2", "u2-a"))
+        gate.set()
+        await _until(lambda: len(calls) == 5)
+        await queue.stop()
+        return calls[1:]
+
+    assert asyncio.run(scenario()) == ["u1-a", "u2-a", "u1-b", "u1-bg"]
+
+
+def test_inflight_limit_per_user(monkeypatch):
+    async def scenario():
+        gate = asyncio.Event()
+        calls = _record(monkeypatch, gate)
+        queue = _queue(workers=3, max_inflight_per_user=1)
+        queue.start()
+        for cid in ("a1", "a2", "a3"):
+            await queue.put(_job("a", cid))
+        await queue.put(_job("b", "b1"))
+        await _until(lambda: len(calls) == 2)
+        await asyncio.sleep(0.02)
+        running = list(calls)
+        gate.set()
+        await _until(lambda: queue.stats()["processed"] == 4)
+        await queue.stop()
+        return running
+
+    assert sorted(asyncio.run(scenario())) == ["a1", "b1"]
+
+
+def test_put_raises_when_full():
+    async def scenario():
+        queue = _queue(max_depth=1)
+        assert await queue.put(_job("u", "c1"))
+        with pytest.raises(main.CaptureQueueFull):
+            await queue.put(_job("u", "c2"), timeout=0.01)
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["deferred"] == 1 and stats["depth"] == 1
+
+
+def test_failed_capture_is_retried(monkeypatch):
+    def fail(capture_id, n):
+        if n == 1:
+            raise RuntimeError("boom")
+
+    async def scenario():
+        calls = _record(monkeypatch, fail=fail)
+        queue = _queue(max_retries=2)
+        queue.start()
+        await queue.put(_job("u", "c1"))
+        await _until(lambda: queue.stats()["processed"] == 1)
+        await queue.stop()
+        return calls, queue.stats()
+
+    calls, stats = asyncio.run(scenario())
+    assert calls == ["c1", "c1"]
+    assert stats["retried"] == 1 and stats["failed"] == 0
+
+
+def test_capture_left_for_recovery_after_last_attempt(monkeypatch):
+    def fail(capture_id, n):
+        raise RuntimeError("boom")
+
+    async def scenario():
+        calls = _record(monkeypatch, fail=fail)
+        queue = _queue(max_retries=1)
+        queue.start()
+        await queue.put(_job("u", "c1"))
+        await _until(lambda: queue.stats()["failed"] == 1)
+        await queue.stop()
+        return calls, queue
+
+    calls, queue = asyncio.run(scenario())
+    assert calls == ["c1", "c1"]
+    assert "c1" not in queue._known
+    assert queue._deferred_since_sweep == 1
+
+
+def test_shed_capture_keeps_its_attempts(monkeypatch):
+    def fail(capture_id, n):
+        if n <= 2:
+            raise main.GeminiUnavailable(main.GEMINI_PURPOSE_CAPTURE, 0.001)
+
+    async def scenario():
+        _record(monkeypatch, fail=fail)
+        queue = _queue(max_retries=0)
+        queue.start()
+        await queue.put(_job("u", "c1"))
+        await _until(lambda: queue.stats()["processed"] == 1)
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed"] == 2 and stats["failed"] == 0
+
+
+def test_upload_during_run_triggers_rerun(monkeypatch):
+    async def scenario():
+        gate = asyncio.Event()
+        calls = _record(monkeypatch, gate)
+        queue = _queue()
+        queue.start()
+        job = _job("u", "c1")
+        await queue.put(job)
+        await _until(lambda: calls == ["c1"])
+        assert not await queue.put(job)
+        assert await queue.rerun(job) == "rerun"
+        assert await queue.rerun(job) == "rerun"
+        gate.set()
+        await _until(lambda: queue.stats()["processed"] == 2)
+        await asyncio.sleep(0.02)
+        await queue.stop()
+        return calls, queue
+
+    calls, queue = asyncio.run(scenario())
+    assert calls == ["c1", "c1"]
+    assert queue.stats()["reruns"] == 1
+    assert "c1" not in queue._known
+
+
+def test_recovery_lists_captures_without_timestamp_first(repo):
+    async def scenario():
+        await repo.create_capture({
+            "id": "dated", "userId": "u", "timestamp": datetime.now(timezone.utc),
+            "processed": False})
+        await repo.create_capture({
+            "id": "undated", "userId": "u", "timestamp": None, "processed": False})
+        return await repo.list_unprocessed_captures(10)
+
+    assert [doc["id"] for doc in asyncio.run(scenario())] == ["undated", "dated"]
@@ -0,0 +1,225 @@
+import asyncio
+
+import pytest
+
+import loadtest
+import main
+from conftest import make_gateway
+
+
+# -----------------------------------------------------------------------------
+# GeminiRateLimiter
+# -----------------------------------------------------------------------------
+
+def test_waiters_served_by_priority_then_arrival():
+    async def scenario():
+        limiter = main.GeminiRateLimiter(rate_per_second=100, burst=1)
+        await limiter.acquire(0)  # empties the bucket
+        order = []
+
+        async def call(label, priority):
+            await limiter.acquire(priority)
+            order.append(label)
+
+        tasks = [asyncio.create_task(call(label, main.GEMINI_PRIORITIES[purpose]))
+                 for label, purpose in (("condense-1", "condense"), ("capture", "capture"),
+                                        ("condense-2", "condense"), ("query", "query"))]
+        await asyncio.gather(*tasks)
+        return order, limiter.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["query", "capture", "condense-1", "condense-2"]
+    assert stats["granted"] == 5 and stats["waited"] == 4 and stats["queued"] == 0
+
+
+def test_cancelled_waiter_does_not_hold_up_the_queue():
+    async def scenario():
+        limiter = main.GeminiRateLimiter(rate_per_second=100, burst=1)
+        await limiter.acquire(0)
+        first = asyncio.create_task(limiter.acquire(0))
+        second = asyncio.create_task(limiter.acquire(1))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.wait_for(second, timeout=1.0)
+        return first
+
+    assert asyncio.run(scenario()).cancelled()
+
+
+def test_try_acquire_never_jumps_the_queue():
+    async def scenario():
+        limiter = main.GeminiRateLimiter(rate_per_second=20, burst=1)
+        assert limiter.try_acquire()
+        waiter = asyncio.create_task(limiter.acquire(2))
+        await asyncio.sleep(0)
+        # A token accrues before the waiter's timer fires; it is not up for grabs
+        limiter._tokens = 1.0
+        taken = limiter.try_acquire()
+        await waiter
+        return taken
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_drain_spends_remaining_tokens():
+    limiter = main.GeminiRateLimiter(rate_per_second=0.001, burst=5)
+    assert limiter.try_acquire()
+    limiter.drain()
+    assert not limiter.try_acquire()
+    assert limiter.stats()["drained"] == 1
+
+
+def test_zero_rate_disables_limiting():
+    async def scenario():
+        limiter = main.GeminiRateLimiter(rate_per_second=0, burst=1)
+        for _ in range(50):
+            await limiter.acquire(2)
+        limiter.drain()
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["enabled"] is False and stats["waited"] == 0
+
+
+# -----------------------------------------------------------------------------
+# GeminiCircuitBreaker
+# -----------------------------------------------------------------------------
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(main.time, "monotonic", clock)
+    return clock
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = main.GeminiCircuitBreaker(threshold=3, cooldown=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+    assert breaker.stats()["opened"] == 1
+
+
+def test_open_breaker_sheds_background_but_not_interactive(clock):
+    breaker = main.GeminiCircuitBreaker(threshold=1, cooldown=30)
+    breaker.record_failure()
+    assert not breaker.allow(interactive=False)
+    assert breaker.allow(interactive=True)
+    clock.now += 10
+    assert breaker.retry_after() == pytest.approx(20)
+    assert breaker.stats()["shed"] == 1
+
+
+def test_single_probe_after_cooldown_closes_on_success(clock):
+    breaker = main.GeminiCircuitBreaker(threshold=1, cooldown=30)
+    breaker.record_failure()
+    clock.now += 31
+    assert breaker.allow(interactive=False)
+    assert not breaker.allow(interactive=False)
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow(interactive=False) and breaker.allow(interactive=False)
+
+
+def test_failed_probe_reopens_for_another_cooldown(clock):
+    breaker = main.GeminiCircuitBreaker(threshold=1, cooldown=30)
+    breaker.record_failure()
+    clock.now += 31
+    assert breaker.allow(interactive=False)
+    breaker.record_failure()
+    assert breaker.is_open and breaker.stats()["opened"] == 1
+    clock.now += 29
+    assert not breaker.allow(interactive=False)
+    clock.now += 2
+    assert breaker.allow(interactive=False)
+
+
+def test_lost_probe_is_replaced_after_a_cooldown(clock):
+    breaker = main.GeminiCircuitBreaker(threshold=1, cooldown=30)
+    breaker.record_failure()
+    clock.now += 31
+    assert breaker.allow(interactive=False)
+    clock.now += 10
+    assert not breaker.allow(interactive=False)
+    clock.now += 21
+    assert breaker.allow(interactive=False)
+
+
+# -----------------------------------------------------------------------------
+# GeminiGateway with the load-test SDK stand-in
+# -----------------------------------------------------------------------------
+
+def _run_gateway(scenario, **kwargs):
+    gateway, fake = make_gateway(**kwargs)
+    try:
+        return asyncio.run(scenario(gateway, fake)), gateway, fake
+    finally:
+        gateway.shutdown()
+
+
+def test_quota_errors_open_breaker_and_shed_background_calls():
+    async def scenario(gateway, fake):
+        for _ in range(2):
+            with pytest.raises(main.GeminiCallError) as err:
+                await gateway.generate("Summarize", purpose=main.GEMINI_PURPOSE_CAPTURE)
+            assert err.value.kind == "rate_limited"
+        with pytest.raises(main.GeminiUnavailable):
+            await gateway.generate("Summarize", purpose=main.GEMINI_PURPOSE_CONDENSE)
+        # Interactive calls still reach upstream
+        with pytest.raises(main.GeminiCallError):
+            await gateway.generate("Who is Bob?", purpose=main.GEMINI_PURPOSE_QUERY)
+
+    _, gateway, fake = _run_gateway(scenario, error_rate=1.0, breaker_failures=2,
+                                    rate_per_second=1000, burst=10)
+    assert sum(fake.calls.values()) == 3
+    assert gateway.breaker.is_open
+    assert gateway.limiter.stats()["drained"] == 3
+    assert gateway.stats()["shed"] == 1
+
+
+def test_transient_errors_are_retried():
+    async def scenario(gateway, fake):
+        failures = iter([loadtest.InjectedQuotaError("quota"), TimeoutError("slow")])
+
+        def flaky(prompt, images):
+            error = next(failures, None)
+            if error is not None:
+                raise error
+            return fake.call(prompt, images)
+
+        gateway._call_sync = flaky
+        return await gateway.generate("Who is Bob?", purpose=main.GEMINI_PURPOSE_QUERY)
+
+    text, gateway, _ = _run_gateway(scenario, max_retries=3)
+    assert '"answer"' in text
+    assert gateway.stats()["retries"] == 2
+    assert not gateway.breaker.is_open
+
+
+def test_non_sdk_errors_are_not_retried_or_counted():
+    async def scenario(gateway, fake):
+        def broken(prompt, images):
+            raise ValueError("Expecting value: line 1 column 1 (char 0)")
+
+        gateway._call_sync = broken
+        with pytest.raises(main.GeminiCallError) as err:
+            await gateway.generate("Who is Bob?", purpose=main.GEMINI_PURPOSE_CAPTURE)
+        return err.value
+
+    error, gateway, _ = _run_gateway(scenario, max_retries=3, breaker_failures=1)
+    assert error.kind is None
+    assert gateway.stats()["retries"] == 0
+    assert not gateway.breaker.is_open
@@ -0,0 +1,147 @@
+import asyncio
+import gc
+import types
+
+import pytest
+
+import main
+
+try:
+    from google.cloud.storage.fileio import BlobWriter
+except Exception:  # pragma: no cover
+    BlobWriter = None
+
+CHUNK = 256 * 1024
+
+
+async def _chunks(*sizes):
+    for size in sizes:
+        yield b"x" * size
+
+
+async def _slow_chunks():
+    yield b"x" * 1000
+    await asyncio.sleep(10)
+    yield b"x"
+
+
+@pytest.fixture
+def local_store(monkeypatch, tmp_path):
+    store = main.LocalMediaStore(str(tmp_path), main.RAW_MEDIA_BUCKET,
+                                 "http://localhost:8080", "secret")
+    monkeypatch.setattr(main, "media_store", store)
+    monkeypatch.setattr(main, "media_cache", main.MediaCache(10 ** 6, "", 0, 60))
+    return store
+
+
+def test_local_upload_reads_back_through_media_cache(local_store):
+    async def scenario():
+        writer = await local_store.open_writer("memories/c1/photo.jpg", "image/jpeg")
+        await writer.write(b"\xff\xd8jpeg")
+        await writer.write(b"-bytes")
+        url = await writer.close()
+        data = await main._download_media_bytes(url)
+        version = await main.media_cache.version(
+            url, main.ImagePreprocessor._source_version_check(url))
+        return url, data, version
+
+    url, data, version = asyncio.run(scenario())
+    assert url == local_store.object_url("memories/c1/photo.jpg")
+    assert data == b"\xff\xd8jpeg-bytes"
+    assert version is not None
+
+
+def test_local_upload_too_large_leaves_nothing(local_store, tmp_path):
+    with pytest.raises(main.UploadTooLarge):
+        asyncio.run(main._stream_to_store(
+            _chunks(600, 600), "memories/c2/photo.jpg", "image/jpeg", 1000))
+    assert not any(p.is_file() for p in tmp_path.rglob("*"))
+
+
+class _FakeResumableUpload:
+    resumable_url = "https://storage.googleapis.com/upload/session-1"
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.finished = False
+
+    def transmit_next_chunk(self, transport, **kwargs):
+        data = self.stream.read(self.chunk_size)
+        self.chunks.append(len(data))
+        if len(data) < self.chunk_size:
+            self.finished = True
+
+
+class _FakeTransport:
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+
+
+class _FakeBlob:
+    """Enough of storage.Blob for a real BlobWriter."""
+
+    def __init__(self):
+        self.bucket = types.SimpleNamespace(client=None)
+        self.chunk_size = None
+        self.upload = None
+        self.transport = _FakeTransport()
+
+    def _initiate_resumable_upload(self, client, stream, content_type, size, num_retries,
+                                   chunk_size=None, **kwargs):
+        self.upload = _FakeResumableUpload(stream, chunk_size)
+        return self.upload, self.transport
+
+
+def _gcs_stream(monkeypatch, blob):
+    writer = BlobWriter(blob, chunk_size=CHUNK, content_type="image/jpeg")
+    stream = main.GcsUploadStream(main.media_io, writer, "https://storage.googleapis.com/b/o")
+    store = types.SimpleNamespace()
+
+    async def open_writer(object_name, content_type):
+        return stream
+
+    store.open_writer = open_writer
+    monkeypatch.setattr(main, "media_store", store)
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_BYTES", CHUNK)
+    return writer
+
+
+@pytest.mark.skipif(BlobWriter is None, reason="google-cloud-storage not installed")
+def test_gcs_abort_cancels_session_instead_of_finalizing(monkeypatch):
+    blob = _FakeBlob()
+    writer = _gcs_stream(monkeypatch, blob)
+    with pytest.raises(main.UploadTooLarge):
+        asyncio.run(main._stream_to_store(
+            _chunks(CHUNK, CHUNK // 2, CHUNK), "memories/c3/photo.jpg", "image/jpeg",
+            2 * CHUNK))
+    del writer
+    gc.collect()
+    # One full chunk went out; the buffered tail was never sent or finalized
+    assert blob.upload.chunks == [CHUNK]
+    assert not blob.upload.finished
+    assert blob.transport.requests == [("DELETE", _FakeResumableUpload.resumable_url)]
+
+
+@pytest.mark.skipif(BlobWriter is None, reason="google-cloud-storage not installed")
+def test_gcs_abort_before_first_chunk_opens_no_session(monkeypatch):
+    blob = _FakeBlob()
+    writer = _gcs_stream(monkeypatch, blob)
+
+    async def scenario():
+        task = asyncio.create_task(main._stream_to_store(
+            _slow_chunks(), "memories/c4/photo.jpg", "image/jpeg", 10 * CHUNK))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    del writer
+    gc.collect()
+    assert blob.upload is None
+    assert blob.transport.requests == []